@@ -10,4 +10,75 @@ DB_CONFIG = {
 
 # Các cấu hình khác có thể thêm sau này
 # FACE_RECOGNITION_THRESHOLD = 0.6 # Ngưỡng nhận diện khuôn mặt
-# DEFAULT_IMAGE_DIR = "assets/student_faces"
\ No newline at end of file
+# DEFAULT_IMAGE_DIR = "assets/student_faces"
+
+# Cấu hình phát hiện khuôn mặt dùng chung cho FaceRecognizer và FaceEmbedder
+# scale < 1.0 nhanh hơn nhưng bỏ sót mặt nhỏ (xa camera): đo bằng face_detector.benchmark_scales
+# trên video của phòng học trước khi giảm
+FACE_DETECTION_CONFIG = {
+    'scale': 1.0,         # Thu nhỏ frame trước khi chạy HOG (1.0 = độ phân giải gốc)
+    'upsample': 1,        # Số lần upsample của dlib (tăng để bắt mặt nhỏ, chậm hơn)
+    'min_face_size': 0,   # Bỏ qua khuôn mặt có cạnh nhỏ hơn (pixel, theo frame gốc)
+    'model': 'hog',       # 'hog' nhanh hơn 'cnn' nhưng ít chính xác hơn
+    'enroll_scale': 0.5,  # Riêng màn hình đăng ký (FaceEmbedder): sinh viên đứng gần camera
+}
+
+# Nguồn camera cho màn hình điểm danh: phần tử đầu là camera xem trước,
+# các nguồn còn lại (chỉ số camera hoặc URL RTSP) chạy nhận diện ở tiến trình riêng
+CAMERA_SOURCES = [0]
+
+# Thư mục cache gallery khuôn mặt trên đĩa (memory-map, tương đối với thư mục gốc project);
+# None để luôn tải từ CSDL
+GALLERY_CACHE_DIR = 'cache/gallery'
+
+# Kiểu lưu trữ embedding: 'float32' (mặc định), 'float16' hoặc 'int8'
+#   gallery : ma trận trong bộ nhớ (int8 dùng scale theo từng chiều)
+#   database: BLOB trong KhuonMat (512 / 256 / 132 byte); dữ liệu cũ vẫn đọc được
+EMBEDDING_STORAGE = {
+    'gallery': 'float32',
+    'database': 'float32',
+}
+
+# Đo thời gian từng giai đoạn nhận diện (xem FaceRecognizer.get_statistics()['pipeline']);
+# tắt mặc định, có thể bật lúc chạy bằng phím F3 trên màn hình điểm danh
+PIPELINE_METRICS = {
+    'enabled': False,
+    'window': 1000,   # Số mẫu gần nhất giữ cho mỗi giai đoạn để tính p50/p95/p99
+}
+
+# Cổng chất lượng trước khi mã hóa khuôn mặt (FaceRecognizer, FaceEmbedder, đăng ký khuôn mặt)
+# Tắt mặc định (mọi khuôn mặt được mã hóa như trước); khi bật, khuôn mặt nhỏ hơn min_face_size
+# bị bỏ qua không báo lỗi, nên chọn min_face_size theo khoảng cách camera - sinh viên thực tế
+FACE_QUALITY_CONFIG = {
+    'enabled': False,
+    'min_face_size': 60,   # Cạnh ngắn nhất của khung khuôn mặt (pixel, theo frame gốc)
+    'min_blur': 40.0,      # Phương sai Laplacian tối thiểu trên ảnh xám 96x96 (nhỏ hơn = nhòe)
+    'max_yaw': 0.35,       # Độ lệch mũi so với trung điểm hai mắt / khoảng cách hai mắt
+    'check_pose': True,    # Ước lượng góc quay bằng 5 điểm mốc (thêm ~1 ms mỗi khuôn mặt)
+    'enroll_candidates': 3,  # Khi đăng ký: thu N lần số mẫu cần, giữ lại các mẫu điểm cao nhất
+}
+
+# Tìm kiếm open-set trên gallery (FaceGallery.search) dùng chung cho FaceRecognizer và FaceEmbedder
+FACE_SEARCH_CONFIG = {
+    'top_k': 3,          # Số sinh viên ứng viên trả về cho mỗi khuôn mặt
+    'min_margin': 0.0,   # Khoảng cách tối thiểu giữa ứng viên tốt nhất và thứ hai (0 = không xét)
+}
+
+# Pool kết nối CSDL (database/connection_manager.py)
+DB_POOL_CONFIG = {
+    'max_size': 8,             # Số kết nối tối đa (mỗi luồng dùng get_connection giữ một kết nối)
+    'max_idle_seconds': 300,   # Kết nối rảnh lâu hơn sẽ bị đóng thay vì dùng lại
+    'ping_interval': 30,       # Ping kết nối đã rảnh lâu hơn trước khi giao cho người mượn
+    'checkout_timeout': 10,    # Thời gian chờ tối đa khi pool đã đầy (giây)
+}
+
+# Hàng đợi ghi điểm danh (database/attendance_queue.py): bản ghi được ghi vào journal SQLite
+# cục bộ trước, luồng nền đẩy lên MySQL theo lô. Không xóa file journal khi còn bản ghi chờ.
+ATTENDANCE_QUEUE_CONFIG = {
+    'journal_path': 'cache/attendance_journal.sqlite3',  # Tương đối với thư mục gốc project
+    'batch_size': 200,        # Số bản ghi tối đa mỗi lần ghi MySQL
+    'flush_interval': 1.0,    # Chu kỳ kiểm tra bản ghi chờ (giây)
+    'retry_base': 2.0,        # Thời gian chờ lần thử lại đầu tiên khi MySQL lỗi (giây), nhân đôi mỗi lần
+    'retry_max': 60.0,        # Thời gian chờ tối đa giữa hai lần thử lại (giây)
+    'keep_days': 7,           # Giữ bản ghi đã đẩy lên trong journal bao nhiêu ngày
+}
@@ -0,0 +1,343 @@
+# database/attendance_queue.py
+"""
+Hàng đợi ghi điểm danh kiểu write-behind.
+
+Màn hình điểm danh không ghi DiemDanh trực tiếp lên MySQL (một máy chủ chậm/mất mạng
+làm treo giao diện tới hết connect_timeout). Thay vào đó mỗi lượt điểm danh được ghi
+vào journal SQLite cục bộ (ghi đồng bộ xuống đĩa, vài ms) rồi một luồng nền đẩy các bản
+ghi chờ lên MySQL theo lô:
+    - Khóa idempotency = (MaBuoiHoc, MaSV): journal từ chối lượt trùng ngay khi ghi, và
+      lệnh ghi MySQL bỏ qua sinh viên đã có bản ghi, nên đẩy lại một lô sau khi mất kết
+      nối giữa chừng (MySQL đã commit nhưng journal chưa kịp đánh dấu) không tạo bản ghi trùng.
+    - Lỗi kết nối/tạm thời: cả lô được thử lại với thời gian chờ tăng gấp đôi.
+    - Lỗi dữ liệu (vd. khóa ngoại): lô được ghi lại từng bản ghi để tách bản ghi hỏng;
+      bản ghi hỏng bị đánh dấu 'rejected' kèm lỗi, không chặn các bản ghi sau.
+Bản ghi còn chờ khi tắt ứng dụng được đẩy tiếp ở lần chạy sau.
+"""
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import pymysql
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from config import ATTENDANCE_QUEUE_CONFIG
+from database.connection_manager import PoolTimeoutError
+
+logger = logging.getLogger(__name__)
+
+STATUS_PENDING = 'pending'
+STATUS_FLUSHED = 'flushed'
+STATUS_REJECTED = 'rejected'
+
+# Lỗi do kết nối/máy chủ (thử lại cả lô); các lỗi MySQL khác được coi là lỗi dữ liệu
+_TRANSIENT_ERRORS = (pymysql.err.OperationalError, pymysql.err.InterfaceError, PoolTimeoutError)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS journal (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    idem_key TEXT NOT NULL UNIQUE,
+    MaBuoiHoc_FK TEXT NOT NULL,
+    MaSV_FK TEXT NOT NULL,
+    ThoiGian TEXT NOT NULL,
+    TrangThai TEXT NOT NULL,
+    HinhAnh TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    done_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_journal_status ON journal (status, id);
+"""
+
+
+def idempotency_key(MaBuoiHoc_FK, MaSV_FK):
+    """Mỗi sinh viên chỉ có một bản ghi điểm danh trong một buổi học"""
+    return f"{MaBuoiHoc_FK}|{MaSV_FK}"
+
+
+class AttendanceJournal:
+    """Journal SQLite cục bộ; dùng được từ nhiều luồng (một kết nối + khóa)"""
+
+    def __init__(self, path=None):
+        """
+        Args:
+            path (str): File journal (mặc định ATTENDANCE_QUEUE_CONFIG['journal_path'],
+                        tương đối với thư mục gốc project)
+        """
+        self.path = os.path.join(project_root, path or ATTENDANCE_QUEUE_CONFIG['journal_path'])
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=FULL")  # Bản ghi đã append phải còn sau khi mất điện
+        self._db.executescript(_SCHEMA)
+
+    def append(self, MaBuoiHoc_FK, MaSV_FK, ThoiGian, TrangThai, HinhAnh=None):
+        """
+        Ghi một lượt điểm danh vào journal
+
+        Lượt cũ đã bị MySQL từ chối ('rejected') không tính: nó được thay bằng lượt mới.
+
+        Returns:
+            bool: False nếu sinh viên đã có lượt điểm danh (chờ hoặc đã ghi) trong buổi học này
+        """
+        key = idempotency_key(MaBuoiHoc_FK, MaSV_FK)
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute("DELETE FROM journal WHERE idem_key = ? AND status = ?", (key, STATUS_REJECTED))
+                self._db.execute(
+                    "INSERT INTO journal (idem_key, MaBuoiHoc_FK, MaSV_FK, ThoiGian, TrangThai, HinhAnh, created_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, MaBuoiHoc_FK, MaSV_FK, ThoiGian, TrangThai, HinhAnh, time.time()))
+            except sqlite3.IntegrityError:
+                self._db.execute("ROLLBACK")
+                return False
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+        return True
+
+    def contains(self, MaBuoiHoc_FK, MaSV_FK):
+        with self._lock:
+            row = self._db.execute("SELECT 1 FROM journal WHERE idem_key = ? AND status != ?",
+                                   (idempotency_key(MaBuoiHoc_FK, MaSV_FK), STATUS_REJECTED)).fetchone()
+        return row is not None
+
+    def pending(self, limit):
+        """
+        Returns:
+            list: [(id, (MaBuoiHoc_FK, MaSV_FK, ThoiGian, TrangThai, HinhAnh)), ...] theo thứ tự ghi
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, MaBuoiHoc_FK, MaSV_FK, ThoiGian, TrangThai, HinhAnh FROM journal"
+                " WHERE status = ? ORDER BY id LIMIT ?", (STATUS_PENDING, int(limit))).fetchall()
+        return [(row[0], tuple(row[1:])) for row in rows]
+
+    def mark_flushed(self, ids):
+        self._update_status(ids, STATUS_FLUSHED, None)
+
+    def mark_rejected(self, row_id, error):
+        self._update_status([row_id], STATUS_REJECTED, str(error))
+
+    def record_failure(self, ids, error):
+        """Tăng số lần thử của các bản ghi vẫn còn chờ"""
+        with self._lock:
+            self._db.executemany("UPDATE journal SET attempts = attempts + 1, last_error = ? WHERE id = ?",
+                                 [(str(error), row_id) for row_id in ids])
+
+    def _update_status(self, ids, status, error):
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.executemany("UPDATE journal SET status = ?, last_error = ?, done_at = ? WHERE id = ?",
+                                 [(status, error, now, row_id) for row_id in ids])
+            self._db.execute("COMMIT")
+
+    def purge(self, keep_days):
+        """Xóa bản ghi đã đẩy lên MySQL quá keep_days ngày (bản ghi bị từ chối được giữ lại)"""
+        cutoff = time.time() - keep_days * 86400
+        with self._lock:
+            return self._db.execute("DELETE FROM journal WHERE status = ? AND done_at < ?",
+                                    (STATUS_FLUSHED, cutoff)).rowcount
+
+    def counts(self):
+        """Returns: dict {status: số bản ghi}"""
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM journal GROUP BY status").fetchall()
+        return {STATUS_PENDING: 0, STATUS_FLUSHED: 0, STATUS_REJECTED: 0, **dict(rows)}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class AttendanceWriteBehind:
+    """
+    Luồng nền đẩy journal lên MySQL.
+
+        queue = AttendanceWriteBehind(AttendanceRepository())
+        queue.start()
+        queue.enqueue(ma_buoi, ma_sv, thoi_gian, trang_thai, anh)  # Không chờ mạng
+        ...
+        queue.stop()
+    """
+
+    def __init__(self, repository, journal=None, batch_size=None, flush_interval=None,
+                 retry_base=None, retry_max=None, keep_days=None):
+        """
+        Args:
+            repository (AttendanceRepository): Dùng add_attendance_records_bulk(mode='skip') để ghi MySQL
+            journal (AttendanceJournal): None = journal theo config
+
+        Tham số None sẽ lấy giá trị trong config.ATTENDANCE_QUEUE_CONFIG.
+        """
+        config = ATTENDANCE_QUEUE_CONFIG
+        self.repository = repository
+        self.journal = journal or AttendanceJournal()
+        self.batch_size = max(1, config['batch_size'] if batch_size is None else batch_size)
+        self.flush_interval = config['flush_interval'] if flush_interval is None else flush_interval
+        self.retry_base = config['retry_base'] if retry_base is None else retry_base
+        self.retry_max = config['retry_max'] if retry_max is None else retry_max
+        self.keep_days = config['keep_days'] if keep_days is None else keep_days
+
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._failures = 0          # Số lần lỗi tạm thời liên tiếp (tính thời gian chờ)
+        self._retry_at = 0.0
+        self.last_error = None
+        self.skipped = 0            # Bản ghi MySQL bỏ qua khi đẩy vì sinh viên đã có bản ghi trong buổi
+
+    # --- Luồng GUI ---
+    def enqueue(self, MaBuoiHoc_FK, MaSV_FK, ThoiGian, TrangThai, HinhAnh=None):
+        """
+        Ghi lượt điểm danh vào journal và báo luồng nền (không truy cập mạng)
+
+        Returns:
+            bool: False nếu sinh viên đã điểm danh trong buổi học này (không ghi gì)
+        """
+        added = self.journal.append(MaBuoiHoc_FK, MaSV_FK, ThoiGian, TrangThai, HinhAnh)
+        if added:
+            self._wake.set()
+        return added
+
+    def is_queued(self, MaBuoiHoc_FK, MaSV_FK):
+        return self.journal.contains(MaBuoiHoc_FK, MaSV_FK)
+
+    def is_recorded(self, MaBuoiHoc_FK, MaSV_FK):
+        """
+        Sinh viên đã điểm danh trong buổi học chưa: theo journal, nếu không có thì hỏi MySQL
+        (bản ghi từ máy khác hoặc từ lần chạy trước đã dọn khỏi journal).
+
+        Khi MySQL đang lỗi (đang chờ thử lại) chỉ dựa vào journal để không chặn giao diện.
+        """
+        if self.journal.contains(MaBuoiHoc_FK, MaSV_FK):
+            return True
+        if self._failures:
+            return False
+        try:
+            return self.repository.check_student_attended_today(MaSV_FK, MaBuoiHoc_FK)
+        except Exception as e:
+            logger.warning(f"AttendanceWriteBehind: Không kiểm tra được MySQL ({e}), chỉ dựa vào journal")
+            return False
+
+    def stats(self):
+        return dict(self.journal.counts(), failures=self._failures, last_error=self.last_error,
+                    skipped=self.skipped)
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='AttendanceWriteBehind', daemon=True)
+        self._thread.start()
+        self._wake.set()  # Đẩy bản ghi còn chờ từ lần chạy trước
+
+    def stop(self, timeout=5.0):
+        """Dừng luồng nền sau khi thử đẩy nốt bản ghi chờ (tối đa timeout giây)"""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._wake.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.warning("AttendanceWriteBehind: Hết thời gian chờ, bản ghi còn lại sẽ được đẩy ở lần chạy sau")
+        self._thread = None
+
+    # --- Luồng nền ---
+    def _run(self):
+        try:
+            self.journal.purge(self.keep_days)
+        except sqlite3.Error as e:
+            logger.warning(f"AttendanceWriteBehind: Không dọn được journal: {e}")
+
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            stopping = self._stopping.is_set()
+            # Khi đang dừng vẫn thử một lần, bỏ qua thời gian chờ thử lại
+            if stopping or time.monotonic() >= self._retry_at:
+                try:
+                    while self.flush_once() == self.batch_size:
+                        pass
+                except Exception as e:
+                    # Lỗi journal (sqlite3.Error) hoặc bản ghi hỏng: không để luồng nền chết
+                    delay = self._backoff(e)
+                    logger.exception(f"AttendanceWriteBehind: Lỗi khi đẩy journal, thử lại sau {delay:.0f}s")
+            if stopping:
+                break
+
+    def flush_once(self):
+        """
+        Đẩy một lô bản ghi chờ lên MySQL
+
+        Returns:
+            int: Số bản ghi đã xử lý xong (đã ghi hoặc bị từ chối), 0 nếu không có gì / lỗi tạm thời
+        """
+        batch = self.journal.pending(self.batch_size)
+        if not batch:
+            return 0
+
+        ids = [row_id for row_id, _ in batch]
+        try:
+            written = self.repository.add_attendance_records_bulk([record for _, record in batch], mode='skip')
+        except _TRANSIENT_ERRORS as e:
+            self._on_transient_error(ids, e)
+            return 0
+        except pymysql.MySQLError:
+            # Lỗi dữ liệu: ghi lại từng bản ghi để tách bản ghi hỏng
+            return self._flush_one_by_one(batch)
+
+        self.journal.mark_flushed(ids)
+        self._count_skipped(len(batch) - written)
+        self._failures = 0
+        self.last_error = None
+        return len(batch)
+
+    def _flush_one_by_one(self, batch):
+        done = 0
+        for row_id, record in batch:
+            try:
+                written = self.repository.add_attendance_records_bulk([record], mode='skip')
+            except _TRANSIENT_ERRORS as e:
+                self._on_transient_error([row_id for row_id, _ in batch[done:]], e)
+                return done
+            except pymysql.MySQLError as e:
+                logger.error(f"AttendanceWriteBehind: Bỏ bản ghi {record[:2]}: {e}")
+                self.journal.mark_rejected(row_id, e)
+            else:
+                self.journal.mark_flushed([row_id])
+                self._count_skipped(1 - written)
+            done += 1
+        self._failures = 0
+        return done
+
+    def _count_skipped(self, count):
+        if count > 0:
+            self.skipped += count
+            logger.info(f"AttendanceWriteBehind: {count} bản ghi đã có trên MySQL (cùng buổi học, sinh viên), bỏ qua")
+
+    def _backoff(self, error):
+        """Ghi nhận lỗi và hẹn lần thử tiếp theo. Returns: thời gian chờ (giây)"""
+        self._failures += 1
+        self.last_error = str(error)
+        delay = min(self.retry_max, self.retry_base * (2 ** (self._failures - 1)))
+        self._retry_at = time.monotonic() + delay
+        return delay
+
+    def _on_transient_error(self, ids, error):
+        delay = self._backoff(error)
+        self.journal.record_failure(ids, error)
+        logger.warning(f"AttendanceWriteBehind: Chưa ghi được {len(ids)} bản ghi lên MySQL ({error}), "
+                       f"thử lại sau {delay:.0f}s")
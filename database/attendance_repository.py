@@ -1,10 +1,39 @@
 # database/attendance_repository.py
 from database.base_repository import BaseRepository
+import pymysql.cursors
 from pymysql import Error  # Import Error for specific error handling if needed
 from datetime import datetime, timedelta, date
+import time
+
+
+def _day_range(ngay):
+    """
+    Khoảng nửa mở [ngày 00:00, ngày hôm sau 00:00) cho điều kiện ThoiGian >= %s AND ThoiGian < %s.
+    So sánh trực tiếp cột ThoiGian (không bọc DATE()) để MySQL dùng được chỉ mục.
+
+    Args:
+        ngay (date | datetime | str): Ngày cần lọc ('YYYY-MM-DD' nếu là chuỗi)
+    """
+    if isinstance(ngay, datetime):
+        ngay = ngay.date()
+    elif isinstance(ngay, str):
+        ngay = datetime.strptime(ngay[:10], "%Y-%m-%d").date()
+    return ngay.strftime("%Y-%m-%d"), (ngay + timedelta(days=1)).strftime("%Y-%m-%d")
 
 
 class AttendanceRepository(BaseRepository):
+    # Số dòng tối đa trong một câu INSERT nhiều dòng
+    BULK_INSERT_ROWS = 500
+    BULK_MODES = ('insert', 'skip', 'upsert')
+    # Số dòng mỗi trang khi đọc lịch sử điểm danh (get_attendance_page / iter_attendance)
+    PAGE_SIZE = 500
+    _COLUMNS = "MaBuoiHoc_FK, MaSV_FK, ThoiGian, TrangThai, HinhAnh"
+    # Có khóa UNIQUE(MaBuoiHoc_FK, MaSV_FK) không; kết quả được kiểm tra lại sau SESSION_KEY_RECHECK
+    # giây vì migration có thể tạo (hoặc DBA xóa) khóa khi ứng dụng đang chạy
+    SESSION_KEY_RECHECK = 60.0
+    _session_student_key = None
+    _session_student_key_checked = 0.0
+
     def __init__(self):
         super().__init__()
 
@@ -19,6 +48,107 @@ class AttendanceRepository(BaseRepository):
         params = (MaBuoiHoc_FK, MaSV_FK, ThoiGian, TrangThai, HinhAnh)
         return self.execute_query(query, params)
 
+    def add_attendance_records_bulk(self, records, mode='insert'):
+        """
+        Ghi nhiều bản ghi điểm danh trong MỘT transaction bằng các câu INSERT nhiều dòng
+        (tối đa BULK_INSERT_ROWS dòng mỗi câu, mỗi câu một lượt gửi), thay vì một lần gửi
+        + commit cho mỗi bản ghi như add_attendance_record.
+
+        Args:
+            records (list): [(MaBuoiHoc_FK, MaSV_FK, ThoiGian, TrangThai[, HinhAnh]), ...]
+            mode (str):
+                'insert': thêm tất cả
+                'skip'  : bỏ qua sinh viên đã có bản ghi trong buổi học (ghi lại cùng lô không tạo trùng)
+                'upsert': sinh viên đã có bản ghi trong buổi học được cập nhật ThoiGian/TrangThai/HinhAnh
+            Với 'skip'/'upsert', bản ghi trùng (MaBuoiHoc, MaSV) trong cùng lô chỉ giữ bản đầu/bản cuối.
+
+        Returns:
+            int: Số dòng bị ảnh hưởng theo quy ước MySQL (thêm mới tính 1, upsert cập nhật tính 2)
+
+        Raises:
+            ValueError: mode không hợp lệ
+            pymysql.MySQLError: Lỗi CSDL (đã rollback, không ghi dòng nào)
+        """
+        if mode not in self.BULK_MODES:
+            raise ValueError(f"mode phải là một trong {self.BULK_MODES}")
+
+        rows = [tuple(record) + (None,) * (5 - len(record)) for record in records]
+        if mode != 'insert':
+            unique = {}
+            for row in rows:
+                if mode == 'upsert':
+                    unique[(row[0], row[1])] = row
+                else:
+                    unique.setdefault((row[0], row[1]), row)
+            rows = list(unique.values())
+        if not rows:
+            return 0
+
+        written = 0
+        with self.conn_manager.connection() as conn:
+            try:
+                with conn.cursor() as cursor:
+                    native_upsert = mode == 'upsert' and self._has_session_student_key(cursor)
+                    for start in range(0, len(rows), self.BULK_INSERT_ROWS):
+                        chunk = rows[start:start + self.BULK_INSERT_ROWS]
+                        params = [value for row in chunk for value in row]
+                        if mode == 'insert' or native_upsert:
+                            query = (f"INSERT INTO DiemDanh ({self._COLUMNS}) VALUES "
+                                     + ", ".join(["(%s, %s, %s, %s, %s)"] * len(chunk)))
+                            if native_upsert:
+                                query += (" ON DUPLICATE KEY UPDATE ThoiGian = VALUES(ThoiGian),"
+                                          " TrangThai = VALUES(TrangThai),"
+                                          " HinhAnh = COALESCE(VALUES(HinhAnh), HinhAnh)")
+                            written += cursor.execute(query, params)
+                            continue
+
+                        values = self._values_table(len(chunk))
+                        if mode == 'upsert':
+                            # Chưa có khóa UNIQUE(MaBuoiHoc_FK, MaSV_FK): cập nhật bản ghi đã có rồi thêm phần còn lại
+                            written += 2 * cursor.execute(
+                                f"UPDATE DiemDanh dd JOIN ({values}) AS v"
+                                " ON dd.MaBuoiHoc_FK = v.MaBuoiHoc_FK AND dd.MaSV_FK = v.MaSV_FK"
+                                " SET dd.ThoiGian = v.ThoiGian, dd.TrangThai = v.TrangThai,"
+                                " dd.HinhAnh = COALESCE(v.HinhAnh, dd.HinhAnh)", params)
+                        written += cursor.execute(
+                            f"INSERT INTO DiemDanh ({self._COLUMNS})"
+                            f" SELECT v.MaBuoiHoc_FK, v.MaSV_FK, v.ThoiGian, v.TrangThai, v.HinhAnh"
+                            f" FROM ({values}) AS v"
+                            " WHERE NOT EXISTS (SELECT 1 FROM DiemDanh dd"
+                            " WHERE dd.MaBuoiHoc_FK = v.MaBuoiHoc_FK AND dd.MaSV_FK = v.MaSV_FK)", params)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return written
+
+    @staticmethod
+    def _values_table(count):
+        """Bảng dẫn xuất (SELECT ... UNION ALL SELECT ...) gồm count dòng tham số"""
+        first = ("SELECT %s AS MaBuoiHoc_FK, %s AS MaSV_FK, %s AS ThoiGian,"
+                 " %s AS TrangThai, %s AS HinhAnh")
+        return " UNION ALL ".join([first] + ["SELECT %s, %s, %s, %s, %s"] * (count - 1))
+
+    @classmethod
+    def _has_session_student_key(cls, cursor):
+        """DiemDanh có khóa UNIQUE trên (MaBuoiHoc_FK, MaSV_FK) không (ON DUPLICATE KEY UPDATE cần khóa này)"""
+        now = time.monotonic()
+        if cls._session_student_key is None or now - cls._session_student_key_checked >= cls.SESSION_KEY_RECHECK:
+            cls._session_student_key_checked = now
+            cursor.execute("""
+                SELECT INDEX_NAME, GROUP_CONCAT(COLUMN_NAME ORDER BY SEQ_IN_INDEX) AS cols
+                FROM information_schema.STATISTICS
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'DiemDanh' AND NON_UNIQUE = 0
+                GROUP BY INDEX_NAME
+            """)
+            rows = cursor.fetchall()
+            cls._session_student_key = any(
+                (row["cols"] if isinstance(row, dict) else row[1]).lower() == "mabuoihoc_fk,masv_fk"
+                for row in rows)
+            if not cls._session_student_key:
+                print("⚠️ DiemDanh chưa có khóa UNIQUE(MaBuoiHoc_FK, MaSV_FK), upsert dùng UPDATE + INSERT.")
+        return cls._session_student_key
+
     def get_attendance_records(self, MaBuoiHoc=None, MaSV=None, Ngay=None, TrangThai=None):
         """
         Lấy các bản ghi điểm danh dựa trên các tiêu chí lọc.
@@ -48,9 +178,8 @@ class AttendanceRepository(BaseRepository):
             base_query += " AND dd.MaSV_FK = %s"
             params.append(MaSV)
         if Ngay:
-            base_query += " AND DATE(dd.ThoiGian) = %s"
-            ngay_str = Ngay.strftime('%Y-%m-%d') if isinstance(Ngay, datetime.date) else Ngay
-            params.append(ngay_str)
+            base_query += " AND dd.ThoiGian >= %s AND dd.ThoiGian < %s"
+            params.extend(_day_range(Ngay))
         if TrangThai:
             base_query += " AND dd.TrangThai = %s"
             params.append(TrangThai)
@@ -59,7 +188,7 @@ class AttendanceRepository(BaseRepository):
         return self.fetch_all(base_query, tuple(params))
 
     def get_all_attendance(self):
-        """ Lấy tất cả bản ghi điểm danh"""
+        """ Lấy tất cả bản ghi điểm danh (nạp cả bảng vào bộ nhớ; bảng lớn dùng iter_attendance)"""
         query = """
             SELECT ID_DiemDanh, MaBuoiHoc_FK, MaSV_FK, ThoiGian, TrangThai, HinhAnh
             FROM DiemDanh
@@ -67,6 +196,99 @@ class AttendanceRepository(BaseRepository):
         """
         return self.fetch_all(query)
 
+    def get_attendance_page(self, after=None, limit=None):
+        """
+        Một trang bản ghi điểm danh, mới nhất trước, phân trang theo khóa (ThoiGian, ID_DiemDanh):
+        trang sau bắt đầu ngay sau dòng cuối của trang trước nên chi phí mỗi trang không tăng
+        theo số trang đã đọc như LIMIT/OFFSET (dùng chỉ mục idx_DiemDanh_ThoiGian).
+
+        Args:
+            after (tuple): (ThoiGian, ID_DiemDanh) của dòng cuối trang trước, None = trang đầu
+            limit (int): Số dòng tối đa (mặc định PAGE_SIZE)
+
+        Returns:
+            list: Các dòng dict như get_all_attendance
+        """
+        query = """
+                SELECT ID_DiemDanh, MaBuoiHoc_FK, MaSV_FK, ThoiGian, TrangThai, HinhAnh
+                FROM DiemDanh \
+                """
+        params = []
+        if after is not None:
+            # Dạng mở rộng của (ThoiGian, ID_DiemDanh) < (%s, %s): điều kiện ThoiGian <= %s đứng
+            # riêng để MySQL quét theo khoảng trên chỉ mục
+            query += " WHERE ThoiGian <= %s AND (ThoiGian < %s OR ID_DiemDanh < %s)"
+            params.extend([after[0], after[0], after[1]])
+        query += " ORDER BY ThoiGian DESC, ID_DiemDanh DESC LIMIT %s"
+        params.append(int(limit or self.PAGE_SIZE))
+        return self.fetch_all(query, tuple(params))
+
+    @staticmethod
+    def page_cursor(page):
+        """Khóa (ThoiGian, ID_DiemDanh) của dòng cuối trang, dùng làm after cho trang tiếp theo"""
+        if not page:
+            return None
+        last = page[-1]
+        return last["ThoiGian"], last["ID_DiemDanh"]
+
+    def iter_attendance(self, page_size=None, unbuffered=False):
+        """
+        Duyệt toàn bộ bản ghi điểm danh (mới nhất trước) mà bộ nhớ không tăng theo kích thước bảng.
+
+        Args:
+            page_size (int): Số dòng mỗi lần đọc (mặc định PAGE_SIZE)
+            unbuffered (bool):
+                False: từng trang get_attendance_page, mượn kết nối ngắn cho mỗi trang
+                       (an toàn khi người gọi xử lý lâu giữa các dòng)
+                True : một truy vấn duy nhất với SSDictCursor, dòng được đọc dần từ máy chủ; nhanh
+                       nhất cho xuất dữ liệu nhưng giữ riêng một kết nối tới khi duyệt xong
+
+        Yields:
+            dict: Từng dòng như get_all_attendance
+        """
+        page_size = int(page_size or self.PAGE_SIZE)
+        if unbuffered:
+            yield from self._iter_attendance_unbuffered(page_size)
+            return
+
+        after = None
+        while True:
+            page = self.get_attendance_page(after, page_size)
+            yield from page
+            if len(page) < page_size:
+                return
+            after = self.page_cursor(page)
+
+    def _iter_attendance_unbuffered(self, batch_size):
+        # Kết nối riêng (không dùng connection()): trong lúc đang đọc dở kết quả, kết nối
+        # không chạy được truy vấn khác, còn người gọi vẫn có thể dùng repository như thường
+        conn = self.conn_manager.checkout()
+        cursor = conn.cursor(pymysql.cursors.SSDictCursor)
+        finished = False
+        try:
+            cursor.execute("""
+                SELECT ID_DiemDanh, MaBuoiHoc_FK, MaSV_FK, ThoiGian, TrangThai, HinhAnh
+                FROM DiemDanh
+                ORDER BY ThoiGian DESC, ID_DiemDanh DESC
+            """)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+            finished = True
+        finally:
+            if finished:
+                cursor.close()
+            else:
+                # Dừng giữa chừng: đóng kết nối thay vì đọc nốt phần còn lại của kết quả
+                # (SSCursor.close() phải nhận hết các dòng còn lại từ máy chủ)
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            self.conn_manager.checkin(conn)
+
     def get_attendance_by_id(self, IdDiemDanh):
         """ Lấy các bản ghi theo Id"""
         query = """
@@ -83,15 +305,14 @@ class AttendanceRepository(BaseRepository):
 
     def get_attendance_today(self):
         """Lấy tất cả các bản ghi điểm danh thuộc ngày hôm nay"""
-        today_str = date.today().strftime("%Y-%m-%d")
-
         query = """
                 SELECT ID_DiemDanh, MaBuoiHoc_FK, MaSV_FK, ThoiGian, TrangThai, HinhAnh
                 FROM DiemDanh
-                WHERE DATE (ThoiGian) = %s
+                WHERE ThoiGian >= %s
+                  AND ThoiGian < %s
                 ORDER BY ThoiGian DESC \
                 """
-        return self.fetch_all(query, (today_str,))
+        return self.fetch_all(query, _day_range(date.today()))
 
     def get_daily_attendance_summary(self, Ngay=None, MaBuoiHoc=None):
         """
@@ -111,9 +332,8 @@ class AttendanceRepository(BaseRepository):
         params = []
 
         if Ngay:
-            query += " AND DATE(dd.ThoiGian) = %s"
-            ngay_str = Ngay.strftime('%Y-%m-%d') if isinstance(Ngay, datetime.date) else Ngay
-            params.append(ngay_str)
+            query += " AND dd.ThoiGian >= %s AND dd.ThoiGian < %s"
+            params.extend(_day_range(Ngay))
 
         if MaBuoiHoc:
             query += " AND dd.MaBuoiHoc_FK = %s"
@@ -122,38 +342,34 @@ class AttendanceRepository(BaseRepository):
         query += " GROUP BY dd.TrangThai"
 
         results = self.fetch_all(query, tuple(params))
-        return {status: count for status, count in results} if results else {}
+        return {row['TrangThai']: row['SoLuong'] for row in results} if results else {}
 
     def check_student_attended_today(self, MaSV_FK, MaBuoiHoc_FK):
         """
         Kiểm tra xem sinh viên đã điểm danh (dù trạng thái nào) trong buổi học này chưa.
         """
         query = """
-                SELECT COUNT(*)
+                SELECT COUNT(*) AS total
                 FROM DiemDanh
                 WHERE MaSV_FK = %s
                   AND MaBuoiHoc_FK = %s \
                 """
         params = (MaSV_FK, MaBuoiHoc_FK)
         result = self.fetch_one(query, params)
-        return bool(result and result[0] > 0)
+        total = (result.get('total', 0) if isinstance(result, dict) else result[0]) if result else 0
+        return total > 0
 
     def count_attendance_today(self):
         """
         Đếm số lượt điểm danh trong ngày hôm nay.
         """
-        today = datetime.now().date()
-        tomorrow = today + timedelta(days=1)
-
         query = """
                 SELECT COUNT(*) AS total
                 FROM DiemDanh
                 WHERE ThoiGian >= %s \
                   AND ThoiGian < %s \
                 """
-        params = (today.strftime("%Y-%m-%d"), tomorrow.strftime("%Y-%m-%d"))
-
-        result = self.fetch_one(query, params)
+        result = self.fetch_one(query, _day_range(date.today()))
         return result.get('total', 0) if result else 0
 
     def mark_absent_students(self, ma_buoi_hoc, ma_lop_fk):
@@ -5,19 +5,23 @@ from database.connection_manager import ConnectionManager
 class BaseRepository:
     def __init__(self):
         self.conn_manager = ConnectionManager()
-        self.conn = self.conn_manager.get_connection()
-        self.cursor = self.conn_manager.get_cursor()
+
+    @property
+    def conn(self):
+        """Kết nối gắn với luồng đang gọi (repository có thể được dùng từ nhiều luồng)"""
+        return self.conn_manager.get_connection()
 
     def execute_query(self, query, params=None):
         try:
-            if not self.conn or not self.conn.open:
-                print("⚠️ Kết nối đã mất. Đang tái kết nối...")
-                self.conn = self.conn_manager.get_connection()
-
-            with self.conn.cursor() as cursor:
-                cursor.execute(query, params or ())
-                self.conn.commit()
-                return True
+            with self.conn_manager.connection() as conn:
+                try:
+                    with conn.cursor() as cursor:
+                        cursor.execute(query, params or ())
+                    conn.commit()
+                    return True
+                except Exception:
+                    conn.rollback()
+                    raise
 
         except pymysql.err.InterfaceError as e:
             print(f"❌ InterfaceError khi thực thi truy vấn: {e}")
@@ -26,13 +30,12 @@ class BaseRepository:
         except Exception as e:
             print(f"❌ Lỗi khác khi thực thi truy vấn: {e}")
 
-        self.conn.rollback()
         return False
 
     def fetch_all(self, query, params=None):
         try:
-            conn = self.conn_manager.get_connection()
-            with conn:  # đảm bảo connection tự động đóng đúng cách
+            # Mượn kết nối từ pool và trả lại ngay (không đóng kết nối)
+            with self.conn_manager.connection(transaction=False) as conn:
                 with conn.cursor() as cursor:
                     cursor.execute(query, params or ())
                     return cursor.fetchall()
@@ -41,11 +44,11 @@ class BaseRepository:
             raise
 
     def fetch_one(self, query, params=None):
-        self.conn = self.conn_manager.get_connection()
         try:
-            with self.conn.cursor() as cursor:
-                cursor.execute(query, params or ())
-                return cursor.fetchone()
+            with self.conn_manager.connection(transaction=False) as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(query, params or ())
+                    return cursor.fetchone()
         except Exception as e:
             print(f"❌ Lỗi khi fetch_one: {e}")
             return None
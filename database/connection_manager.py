@@ -1,9 +1,15 @@
-# Version 2
+# Version 3
 # database/connection_manager.py
-# Thay thế: import mysql.connector
-# Thay thế: from mysql.connector import Error
-import pymysql.cursors  # <-- THAY THẾ DÒNG NÀY
-from pymysql import Error  # <-- THAY THẾ DÒNG NÀY
+# Pool kết nối PyMySQL có giới hạn, an toàn đa luồng (thay cho một kết nối + một con trỏ dùng chung)
+import collections
+import contextlib
+import threading
+import time
+import weakref
+
+import pymysql.cursors
+from pymysql import Error
+from pymysql.constants import SERVER_STATUS
 
 import sys
 import os
@@ -13,103 +19,282 @@ project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
-from config import DB_CONFIG
+from config import DB_CONFIG, DB_POOL_CONFIG
+
+
+class PoolTimeoutError(Error):
+    """Hết thời gian chờ kết nối rảnh trong pool"""
+
+
+class _ThreadConnection:
+    """
+    Kết nối gắn với một luồng (get_connection). Khi luồng kết thúc, threading.local
+    giải phóng đối tượng này và kết nối được trả về pool.
+    """
+
+    def __init__(self, manager, conn):
+        self.conn = conn
+        self.last_used = time.monotonic()
+        self._finalizer = weakref.finalize(self, manager.checkin, conn)
+
+    def release(self):
+        self._finalizer()
 
 
 class ConnectionManager:
+    """
+    Singleton quản lý pool kết nối MySQL.
+
+    - Kết nối chạy ở chế độ autocommit: câu đọc không mở transaction nên không giữ snapshot
+      cũ và không cần rollback khi trả về pool (tiết kiệm một lượt gửi cho mỗi lần đọc).
+    - connection(): context manager mượn một kết nối rồi trả lại. Mặc định mở transaction
+      (BEGIN) cho người gọi tự commit; transaction=False cho các truy vấn chỉ đọc. Khi trả
+      về pool chỉ rollback nếu transaction vẫn còn mở. Lồng nhau trong cùng luồng thì
+      dùng lại cùng kết nối (và transaction của lần mượn ngoài). Không dùng kết nối gắn với luồng của get_connection(): kết nối
+      đó không bao giờ kết thúc transaction nên đọc qua nó sẽ thấy mãi snapshot cũ.
+    - get_connection(): kết nối gắn với luồng gọi (giữ tới khi luồng kết thúc), cho mã cũ
+      tự quản lý commit. Mỗi luồng có kết nối riêng nên các worker nền có thể truy vấn
+      song song.
+    - Tối đa DB_POOL_CONFIG['max_size'] kết nối; kết nối rảnh quá max_idle_seconds bị đóng,
+      kết nối rảnh quá ping_interval được ping trước khi giao.
+    """
     _instance = None  # Singleton instance
+    _instance_lock = threading.Lock()
 
     def __new__(cls):
-        if cls._instance is None:
-            cls._instance = super(ConnectionManager, cls).__new__(cls)
-            cls._instance.connection = None
-            cls._instance.cursor = None
+        with cls._instance_lock:
+            if cls._instance is None:
+                instance = super(ConnectionManager, cls).__new__(cls)
+                instance._init_pool()
+                cls._instance = instance
         return cls._instance
 
-    def connect(self):
-        """Kết nối đến cơ sở dữ liệu MySQL."""
-        if self.connection and self.connection.open:  # PyMySQL dùng .open thay vì .is_connected()
-            print("ConnectionManager: Đã có kết nối CSDL hoạt động, không cần kết nối lại.")
-            return True
+    def _init_pool(self):
+        self.max_size = max(1, DB_POOL_CONFIG['max_size'])
+        self.max_idle_seconds = DB_POOL_CONFIG['max_idle_seconds']
+        self.ping_interval = DB_POOL_CONFIG['ping_interval']
+        self.checkout_timeout = DB_POOL_CONFIG['checkout_timeout']
 
-        print("ConnectionManager: Đang cố gắng thiết lập kết nối CSDL...")
+        self._cond = threading.Condition()
+        self._idle = collections.deque()  # (conn, thời điểm trả về)
+        self._total = 0  # Số kết nối đang mở (rảnh + đang mượn)
+        self._local = threading.local()
+
+    # --- Tạo / kiểm tra kết nối ---
+    def _create_connection(self):
+        return pymysql.connect(
+            host=DB_CONFIG['host'],
+            user=DB_CONFIG['user'],
+            password=DB_CONFIG['password'],
+            database=DB_CONFIG['database'],
+            port=DB_CONFIG['port'],
+            cursorclass=pymysql.cursors.DictCursor,  # Trả về kết quả dưới dạng dict
+            connect_timeout=10,  # Đặt timeout 10 giây
+            autocommit=True  # Ghi nhiều câu trong một transaction: connection() gọi BEGIN
+        )
 
+    def _is_healthy(self, conn, idle_seconds):
+        if not conn.open:
+            return False
+        if idle_seconds < self.ping_interval:
+            return True
         try:
-            print("ConnectionManager: Gọi pymysql.connect()...")
-            self.connection = pymysql.connect(
-                host=DB_CONFIG['host'],
-                user=DB_CONFIG['user'],
-                password=DB_CONFIG['password'],
-                database=DB_CONFIG['database'],
-                port=DB_CONFIG['port'],
-                cursorclass=pymysql.cursors.DictCursor,  # Tùy chọn: trả về kết quả dưới dạng dict
-                connect_timeout=10  # Đặt timeout 10 giây
-            )
-
-            print("ConnectionManager: Đã gọi pymysql.connect(). Kiểm tra .open...")
-
-            if self.connection.open:  # PyMySQL dùng .open
-                print("ConnectionManager: Kết nối thành công!")
-                self.cursor = self.connection.cursor()  # Con trỏ đã được định nghĩa bởi cursorclass
-
-                # PyMySQL không có get_server_info() hay server_info trực tiếp như mysql.connector
-                # Có thể lấy thông tin version bằng cách khác nếu cần
-                print(f"ConnectionManager: Đã kết nối tới database: {DB_CONFIG['database']}")
-                return True
+            conn.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    # --- Mượn / trả ---
+    def checkout(self, timeout=None):
+        """
+        Mượn một kết nối từ pool (chờ tối đa timeout giây nếu pool đã đầy)
+
+        Raises:
+            PoolTimeoutError: Không có kết nối rảnh trong thời gian chờ
+            pymysql.Error: Không tạo được kết nối mới
+        """
+        timeout = self.checkout_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        while True:
+            candidate, stale = None, []
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    while self._idle:
+                        conn, returned_at = self._idle.pop()  # LIFO: kết nối mới dùng nhất còn "ấm"
+                        if now - returned_at <= self.max_idle_seconds:
+                            candidate = (conn, now - returned_at)
+                            break
+                        stale.append(conn)
+                        self._total -= 1
+                    if candidate is not None:
+                        break
+                    if self._total < self.max_size:
+                        self._total += 1
+                        break
+
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        for conn in stale:
+                            self._close_quietly(conn)
+                        raise PoolTimeoutError(f"Hết {timeout}s chờ kết nối CSDL (pool tối đa {self.max_size})")
+                    self._cond.wait(remaining)
+
+            # Đóng / ping / tạo kết nối đều là thao tác mạng: làm ngoài khóa để không chặn các luồng khác
+            for conn in stale:
+                self._close_quietly(conn)
+
+            if candidate is None:
+                try:
+                    return self._create_connection()
+                except Exception:
+                    with self._cond:
+                        self._total -= 1
+                        self._cond.notify()
+                    raise
+
+            conn, idle_seconds = candidate
+            if self._is_healthy(conn, idle_seconds):
+                return conn
+            self._close_quietly(conn)
+            with self._cond:
+                self._total -= 1
+                self._cond.notify()
+
+    def checkin(self, conn):
+        """Trả kết nối đã checkout() về pool; kết nối hỏng bị đóng và giải phóng chỗ"""
+        healthy = conn.open
+        # server_status được cập nhật theo gói OK (BEGIN/DML/COMMIT/ROLLBACK), không tốn lượt gửi
+        if healthy and conn.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+            try:
+                conn.rollback()  # Bỏ phần chưa commit để kết nối về pool không giữ transaction
+            except Exception:
+                healthy = False
+        with self._cond:
+            if healthy:
+                self._idle.append((conn, time.monotonic()))
             else:
-                print(
-                    "ConnectionManager: KHÔNG THỂ KẾT NỐI mặc dù không có ngoại lệ. Vui lòng kiểm tra CSDL/mạng hoặc config.")
-                self.connection = None
-                self.cursor = None
-                return False
-        except Error as e:  # PyMySQL.Error
+                self._close_quietly(conn)
+                self._total -= 1
+            self._cond.notify()
+
+    @contextlib.contextmanager
+    def connection(self, transaction=True):
+        """
+        Mượn kết nối trong phạm vi with:
+
+            with ConnectionManager().connection() as conn:
+                with conn.cursor() as cursor:
+                    ...
+                conn.commit()
+
+        Args:
+            transaction (bool): Mở transaction (BEGIN) cho các câu ghi; False cho truy vấn chỉ
+                                đọc (autocommit, không cần BEGIN/ROLLBACK)
+        """
+        borrowed = getattr(self._local, 'borrowed', None)
+        if borrowed is not None:
+            # Lồng nhau trong cùng luồng: dùng lại kết nối (và transaction) đang mượn; lần mượn
+            # ngoài chỉ đọc thì mở transaction tại đây, lần mượn ngoài rollback nếu chưa commit
+            if transaction and not borrowed.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+                borrowed.begin()
+            yield borrowed
+            return
+
+        conn = self.checkout()
+        self._local.borrowed = conn
+        try:
+            if transaction:
+                conn.begin()
+            yield conn
+        finally:
+            self._local.borrowed = None
+            self.checkin(conn)
+
+    def get_connection(self):
+        """
+        Kết nối gắn với luồng hiện tại (giữ tới khi luồng kết thúc hoặc disconnect()).
+
+        Returns:
+            pymysql.Connection hoặc None nếu không kết nối được
+        """
+        borrowed = getattr(self._local, 'borrowed', None)
+        if borrowed is not None:
+            return borrowed
+
+        pinned = getattr(self._local, 'pinned', None)
+        if pinned is not None:
+            idle_seconds = time.monotonic() - pinned.last_used
+            if self._is_healthy(pinned.conn, idle_seconds):
+                pinned.last_used = time.monotonic()
+                return pinned.conn
+            print("ConnectionManager: Kết nối của luồng đã mất, đang kết nối lại.")
+            self._release_pinned()
+
+        try:
+            conn = self.checkout()
+        except Exception as e:
             print(f"ConnectionManager: LỖI KẾT NỐI CSDL (PyMySQL): {e}")
-            # Các thuộc tính lỗi có thể khác một chút so với mysql.connector
-            # print(f"Mã lỗi: {e.errno}") # PyMySQL có thể không có
-            # print(f"Trạng thái SQL: {e.sqlstate}") # PyMySQL có thể không có
-            # print(f"Thông báo lỗi: {e.msg}") # PyMySQL có thể không có
-            self.connection = None
-            self.cursor = None
-            return False
+            return None
+        self._local.pinned = _ThreadConnection(self, conn)
+        return conn
+
+    def _release_pinned(self):
+        pinned = getattr(self._local, 'pinned', None)
+        if pinned is not None:
+            self._local.pinned = None
+            pinned.release()
+
+    # --- Giao diện cũ ---
+    @property
+    def connection_open(self):
+        pinned = getattr(self._local, 'pinned', None)
+        return pinned is not None and pinned.conn.open
+
+    def connect(self):
+        """Kiểm tra kết nối CSDL (mượn một kết nối rồi trả về pool, không gắn với luồng gọi)."""
+        print("ConnectionManager: Đang cố gắng thiết lập kết nối CSDL...")
+        try:
+            conn = self.checkout()
         except Exception as e:
-            print(f"ConnectionManager: LỖI KHÔNG MONG MUỐN KHÁC KHI KẾT NỐI CSDL: {e}")
-            self.connection = None
-            self.cursor = None
-            return False
+            print(f"ConnectionManager: LỖI KẾT NỐI CSDL (PyMySQL): {e}")
+            conn = None
+        if conn is not None:
+            healthy = conn.open
+            self.checkin(conn)
+            if healthy:
+                print(f"ConnectionManager: Đã kết nối tới database: {DB_CONFIG['database']}")
+                return True
+        print("ConnectionManager: KHÔNG THỂ KẾT NỐI. Vui lòng kiểm tra CSDL/mạng hoặc config.")
+        return False
 
     def disconnect(self):
-        """Ngắt kết nối đến cơ sở dữ liệu MySQL."""
-        if self.cursor:
-            try:
-                self.cursor.close()
-            except Error as e:
-                print(f"ConnectionManager: Lỗi khi đóng con trỏ: {e}")
-            self.cursor = None
-
-        if self.connection and self.connection.open:  # PyMySQL dùng .open
-            try:
-                self.connection.close()
-                self.connection = None
-                print("ConnectionManager: Đã ngắt kết nối MySQL.")
-            except Error as e:
-                print(f"ConnectionManager: Lỗi khi đóng kết nối: {e}")
+        """Trả kết nối của luồng hiện tại và đóng mọi kết nối rảnh trong pool."""
+        self._release_pinned()
+        with self._cond:
+            closed = len(self._idle)
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._close_quietly(conn)
+                self._total -= 1
+            self._cond.notify_all()
+        if closed:
+            print("ConnectionManager: Đã ngắt kết nối MySQL.")
         else:
             print("ConnectionManager: Không có kết nối để đóng.")
 
-    def get_connection(self):
-        if not self.connection or not self.connection.open:
-            print("ConnectionManager: Kết nối chưa tồn tại hoặc đã mất, đang cố gắng kết nối lại.")
-            self.connect()
-        return self.connection
-
     def get_cursor(self):
-        if not self.connection or not self.connection.open:
-            print("ConnectionManager: Kết nối chưa tồn tại hoặc đã mất, đang cố gắng kết nối lại.")
-            self.connect()
-        if self.connection and self.connection.open and self.cursor is None:
-            try:
-                self.cursor = self.connection.cursor()
-                print("ConnectionManager: Đã tạo lại con trỏ.")
-            except Error as e:
-                print(f"ConnectionManager: Lỗi khi tạo lại con trỏ: {e}")
-        return self.cursor
\ No newline at end of file
+        """Con trỏ mới trên kết nối của luồng hiện tại (người gọi tự đóng)"""
+        conn = self.get_connection()
+        return conn.cursor() if conn is not None else None
+
+    def stats(self):
+        with self._cond:
+            return {'max_size': self.max_size, 'open': self._total, 'idle': len(self._idle)}
@@ -0,0 +1,171 @@
+# database/migrations.py
+"""
+Migration schema có đánh số phiên bản cho CSDL đã tạo từ schema.sql cũ.
+
+Phiên bản đã áp dụng được lưu trong bảng PhienBanSchema; mỗi lần chạy chỉ áp dụng các
+migration có số lớn hơn. MySQL tự commit sau mỗi lệnh DDL nên migration không nằm trong
+transaction: mọi bước đều kiểm tra trước (chỉ mục đã có thì bỏ qua), chạy lại sau khi
+lỗi giữa chừng là an toàn.
+
+    python -m database.migrations           # Áp dụng các migration còn thiếu
+    python -m database.migrations --status  # Chỉ xem phiên bản hiện tại
+"""
+import logging
+import os
+import sys
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from database.connection_manager import ConnectionManager
+
+logger = logging.getLogger(__name__)
+
+
+def _index_exists(cursor, table, name):
+    cursor.execute("""
+        SELECT 1 FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+        LIMIT 1
+    """, (table, name))
+    return cursor.fetchone() is not None
+
+
+def _create_index(cursor, table, name, columns, unique=False):
+    """Tạo chỉ mục nếu chưa có. Returns: True nếu vừa tạo"""
+    if _index_exists(cursor, table, name):
+        return False
+    cursor.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX {name} ON {table} ({', '.join(columns)})")
+    logger.info(f"Đã tạo chỉ mục {table}.{name} ({', '.join(columns)})")
+    return True
+
+
+def _diemdanh_session_student_key(cursor):
+    # Không tự xóa dữ liệu điểm danh: nếu có bản ghi trùng (MaBuoiHoc, MaSV) thì dừng, phiên bản 1
+    # chưa được ghi nhận; xử lý bản ghi trùng rồi chạy lại migration
+    if _index_exists(cursor, 'DiemDanh', 'uq_DiemDanh_BuoiHoc_SV'):
+        return
+    cursor.execute("""
+        SELECT COUNT(*) AS total FROM (
+            SELECT 1 FROM DiemDanh GROUP BY MaBuoiHoc_FK, MaSV_FK HAVING COUNT(*) > 1
+        ) AS trung
+    """)
+    row = cursor.fetchone()
+    duplicates = row['total'] if isinstance(row, dict) else row[0]
+    if duplicates:
+        raise RuntimeError(
+            f"DiemDanh có {duplicates} cặp (MaBuoiHoc_FK, MaSV_FK) trùng, không thể tạo khóa UNIQUE "
+            "uq_DiemDanh_BuoiHoc_SV. Xóa/gộp các bản ghi trùng rồi chạy lại migration.")
+    _create_index(cursor, 'DiemDanh', 'uq_DiemDanh_BuoiHoc_SV', ['MaBuoiHoc_FK', 'MaSV_FK'], unique=True)
+
+
+def _diemdanh_time_indexes(cursor):
+    # InnoDB gắn khóa chính vào cuối chỉ mục phụ: (ThoiGian) thực chất là (ThoiGian, ID_DiemDanh),
+    # đủ cho sắp xếp/phân trang theo (ThoiGian, ID_DiemDanh)
+    _create_index(cursor, 'DiemDanh', 'idx_DiemDanh_ThoiGian', ['ThoiGian'])
+    _create_index(cursor, 'DiemDanh', 'idx_DiemDanh_SV_ThoiGian', ['MaSV_FK', 'ThoiGian'])
+
+
+def _buoihoc_date_teacher_index(cursor):
+    _create_index(cursor, 'BuoiHoc', 'idx_BuoiHoc_Ngay_GV', ['NgayHoc', 'MaGV_FK'])
+
+
+def _face_data_version(cursor):
+    # Bộ đếm cho cache gallery (StudentRepository.get_face_gallery_version). Thêm/xóa KhuonMat được
+    # StudentRepository tăng một lần mỗi transaction; trigger chỉ cho sửa KhuonMat và đổi tên SinhVien
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS PhienBanDuLieu (
+            Ten VARCHAR(50) PRIMARY KEY,
+            PhienBan BIGINT NOT NULL DEFAULT 0
+        )
+    """)
+    cursor.execute("INSERT IGNORE INTO PhienBanDuLieu (Ten, PhienBan) VALUES ('KhuonMat', 0)")
+    for name in ('trg_KhuonMat_ai', 'trg_KhuonMat_ad', 'trg_KhuonMat_au', 'trg_SinhVien_au'):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+    cursor.execute("""
+        CREATE TRIGGER trg_KhuonMat_au AFTER UPDATE ON KhuonMat FOR EACH ROW
+            UPDATE PhienBanDuLieu SET PhienBan = PhienBan + 1 WHERE Ten = 'KhuonMat'
+    """)
+    cursor.execute("""
+        CREATE TRIGGER trg_SinhVien_au AFTER UPDATE ON SinhVien FOR EACH ROW
+            UPDATE PhienBanDuLieu SET PhienBan = PhienBan + 1
+            WHERE Ten = 'KhuonMat' AND NOT (OLD.TenSV <=> NEW.TenSV)
+    """)
+    logger.info("Đã tạo bộ đếm PhienBanDuLieu và trigger trên KhuonMat/SinhVien")
+
+
+# (phiên bản, mô tả, hàm nhận cursor); chỉ thêm vào cuối, không sửa migration đã phát hành
+MIGRATIONS = [
+    (1, "DiemDanh: khóa (MaBuoiHoc_FK, MaSV_FK)", _diemdanh_session_student_key),
+    (2, "DiemDanh: chỉ mục (ThoiGian), (MaSV_FK, ThoiGian)", _diemdanh_time_indexes),
+    (3, "BuoiHoc: chỉ mục (NgayHoc, MaGV_FK)", _buoihoc_date_teacher_index),
+    (4, "PhienBanDuLieu: bộ đếm thay đổi dữ liệu khuôn mặt", _face_data_version),
+]
+
+
+def _ensure_version_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS PhienBanSchema (
+            PhienBan INT PRIMARY KEY,
+            MoTa VARCHAR(255) NOT NULL,
+            ThoiGianApDung DATETIME NOT NULL
+        )
+    """)
+
+
+def current_version(cursor):
+    _ensure_version_table(cursor)
+    cursor.execute("SELECT MAX(PhienBan) AS version FROM PhienBanSchema")
+    row = cursor.fetchone()
+    version = row['version'] if isinstance(row, dict) else row[0]
+    return version or 0
+
+
+def migrate(target=None):
+    """
+    Áp dụng các migration còn thiếu theo thứ tự
+
+    Args:
+        target (int): Dừng ở phiên bản này (None = mới nhất)
+
+    Returns:
+        list: Các phiên bản vừa áp dụng
+    """
+    applied = []
+    with ConnectionManager().connection() as conn:
+        with conn.cursor() as cursor:
+            version = current_version(cursor)
+            for number, description, apply in MIGRATIONS:
+                if number <= version or (target is not None and number > target):
+                    continue
+                logger.info(f"Áp dụng migration {number}: {description}")
+                apply(cursor)
+                cursor.execute("INSERT INTO PhienBanSchema (PhienBan, MoTa, ThoiGianApDung) VALUES (%s, %s, NOW())",
+                               (number, description))
+                conn.commit()
+                applied.append(number)
+    return applied
+
+
+if __name__ == '__main__':
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    parser = argparse.ArgumentParser(description="Migration schema CSDL điểm danh")
+    parser.add_argument('--status', action='store_true', help="Chỉ in phiên bản schema hiện tại")
+    parser.add_argument('--target', type=int, default=None, help="Dừng ở phiên bản này")
+    args = parser.parse_args()
+
+    if args.status:
+        with ConnectionManager().connection(transaction=False) as conn:
+            with conn.cursor() as cursor:
+                version = current_version(cursor)
+        print(f"Phiên bản schema: {version} (mới nhất: {MIGRATIONS[-1][0]})")
+    else:
+        try:
+            done = migrate(args.target)
+        except RuntimeError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+        print(f"✅ Đã áp dụng migration {done}" if done else "Schema đã ở phiên bản mới nhất.")
@@ -1,4 +1,5 @@
 -- schema.sql
+-- CSDL tạo từ bản schema cũ hơn: chạy python -m database.migrations để thêm các khóa/chỉ mục mới
 
 CREATE TABLE IF NOT EXISTS SinhVien (
     MaSV VARCHAR(10) PRIMARY KEY,
@@ -62,6 +63,9 @@ CREATE TABLE IF NOT EXISTS DiemDanh (
     ThoiGian DATETIME NOT NULL,
     TrangThai VARCHAR(20) NOT NULL,  -- Ví dụ: 'Có mặt', 'Muộn 15 phút', 'Vắng mặt'
     HinhAnh VARCHAR(255),            -- Đường dẫn đến file ảnh lưu trên máy
+    UNIQUE KEY uq_DiemDanh_BuoiHoc_SV (MaBuoiHoc_FK, MaSV_FK),  -- Mỗi sinh viên một bản ghi mỗi buổi (upsert)
+    INDEX idx_DiemDanh_ThoiGian (ThoiGian),                     -- Lọc theo ngày (khoảng ThoiGian), phân trang
+    INDEX idx_DiemDanh_SV_ThoiGian (MaSV_FK, ThoiGian),        -- Lịch sử điểm danh của một sinh viên
     FOREIGN KEY (MaBuoiHoc_FK) REFERENCES BuoiHoc(MaBuoiHoc),
     FOREIGN KEY (MaSV_FK) REFERENCES SinhVien(MaSV)
 );
@@ -76,7 +80,32 @@ CREATE TABLE BuoiHoc (
     PhongHoc VARCHAR(20),
     MaLop_FK VARCHAR(20),
     TrangThaiBuoiHoc VARCHAR(20) DEFAULT 'Scheduled',
+    INDEX idx_BuoiHoc_Ngay_GV (NgayHoc, MaGV_FK),
     FOREIGN KEY (MaGV_FK) REFERENCES GiaoVien(MaGV),
     FOREIGN KEY (MaMonHoc_FK) REFERENCES MonHoc(MaMon),
     FOREIGN KEY (MaLop_FK) REFERENCES LopHoc(MaLop)
-);
\ No newline at end of file
+);
+
+-- Bộ đếm thay đổi dữ liệu khuôn mặt: cache gallery trên đĩa chỉ làm mới khi giá trị này đổi.
+-- Thêm/xóa KhuonMat: StudentRepository tăng bộ đếm MỘT lần mỗi transaction (trigger FOR EACH ROW
+-- sẽ cập nhật cùng một dòng N lần khi thêm hàng loạt). CSDL cũ: python -m database.migrations
+CREATE TABLE IF NOT EXISTS PhienBanDuLieu (
+    Ten VARCHAR(50) PRIMARY KEY,
+    PhienBan BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT IGNORE INTO PhienBanDuLieu (Ten, PhienBan) VALUES ('KhuonMat', 0);
+
+DROP TRIGGER IF EXISTS trg_KhuonMat_ai;
+DROP TRIGGER IF EXISTS trg_KhuonMat_ad;
+
+-- Sửa KhuonMat trực tiếp (hiếm) vẫn được ghi nhận
+DROP TRIGGER IF EXISTS trg_KhuonMat_au;
+CREATE TRIGGER trg_KhuonMat_au AFTER UPDATE ON KhuonMat FOR EACH ROW
+    UPDATE PhienBanDuLieu SET PhienBan = PhienBan + 1 WHERE Ten = 'KhuonMat';
+
+-- Tên sinh viên nằm trong file kèm theo của cache nên đổi tên cũng phải làm mới
+DROP TRIGGER IF EXISTS trg_SinhVien_au;
+CREATE TRIGGER trg_SinhVien_au AFTER UPDATE ON SinhVien FOR EACH ROW
+    UPDATE PhienBanDuLieu SET PhienBan = PhienBan + 1
+    WHERE Ten = 'KhuonMat' AND NOT (OLD.TenSV <=> NEW.TenSV);
@@ -60,6 +60,7 @@ class SessionRepository(BaseRepository):
                     MH.MaMon,          
                     MH.TenMon,
                     BH.PhongHoc,
+                    BH.MaLop_FK AS MaLop,
                     BH.TrangThaiBuoiHoc
                 FROM BuoiHoc BH 
                 JOIN GiangVien GV ON BH.MaGV_FK = GV.MaGV
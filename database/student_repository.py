@@ -1,17 +1,49 @@
 # database/student_repository.py
 from database.base_repository import BaseRepository
 from database.connection_manager import ConnectionManager
+import hashlib
 import pymysql
 import numpy as np
 import logging
+import weakref
+from config import EMBEDDING_STORAGE
+from face_recognition_module.face_quantization import BLOB_SIZES, decode_blob, encode_blob
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 class StudentRepository(BaseRepository):
+    # Các gallery khuôn mặt trong bộ nhớ (FaceRecognizer, FaceEmbedder...) đăng ký ở đây
+    # để được cập nhật tăng dần khi thêm embedding hoặc xóa sinh viên.
+    # Dùng WeakSet để không giữ đối tượng sống lâu hơn cần thiết.
+    _face_listeners = weakref.WeakSet()
+
+    # Số dòng tối đa mỗi câu INSERT nhiều dòng (~0.5 KB/dòng, nằm xa dưới max_allowed_packet)
+    BULK_INSERT_ROWS = 500
+
     def __init__(self):
         super().__init__()
 
+    @classmethod
+    def add_face_listener(cls, listener):
+        """
+        Đăng ký đối tượng nhận thông báo thay đổi dữ liệu khuôn mặt.
+        listener cần có on_face_embeddings_added(ma_sv, embeddings) và on_student_deleted(ma_sv).
+        """
+        cls._face_listeners.add(listener)
+
+    @classmethod
+    def remove_face_listener(cls, listener):
+        cls._face_listeners.discard(listener)
+
+    @classmethod
+    def _notify_face_listeners(cls, event, *args):
+        for listener in list(cls._face_listeners):
+            try:
+                getattr(listener, event)(*args)
+            except Exception as e:
+                logger.warning(f"⚠️ Lỗi khi cập nhật gallery ({event}): {e}")
+
     def add_student(self, MaSV, TenSV, NgaySinh, GioiTinh, DiaChi, Email, SDT):
         query = """
         INSERT INTO SinhVien (MaSV, TenSV, NgaySinh, GioiTinh, DiaChi, Email, SDT)
@@ -27,13 +59,11 @@ class StudentRepository(BaseRepository):
     def get_student_by_id(self, ma_sv):
         query = "SELECT MaSV, TenSV FROM SinhVien WHERE MaSV = %s"
 
-        # Tạo kết nối mới mỗi lần truy vấn
-        conn = self.conn_manager.get_connection()
-        with conn.cursor(cursor=pymysql.cursors.DictCursor) as cursor:
-            cursor.execute(query, (ma_sv,))
-            result = cursor.fetchone()
-        conn.close()
-        return result
+        # Mượn kết nối từ pool (không đóng kết nối dùng chung)
+        with self.conn_manager.connection(transaction=False) as conn:
+            with conn.cursor(cursor=pymysql.cursors.DictCursor) as cursor:
+                cursor.execute(query, (ma_sv,))
+                return cursor.fetchone()
 
     def update_student(self, MaSV, TenSV, NgaySinh, GioiTinh, DiaChi, Email, SDT):
         query = """
@@ -46,29 +76,31 @@ class StudentRepository(BaseRepository):
 
     def delete_student(self, student_id):
         try:
-            conn = self.conn_manager.get_connection()
-            cursor = conn.cursor()
+            with self.conn_manager.connection() as conn:
+                try:
+                    with conn.cursor() as cursor:
+                        # Xoá dữ liệu khuôn mặt
+                        cursor.execute("DELETE FROM KHUONMAT WHERE MaSV_FK = %s", (student_id,))
 
-            # Xoá dữ liệu khuôn mặt
-            cursor.execute("DELETE FROM KHUONMAT WHERE MaSV_FK = %s", (student_id,))
+                        # Xoá dữ liệu điểm danh
+                        cursor.execute("DELETE FROM DIEMDANH WHERE MaSV_FK = %s", (student_id,))
 
-            # Xoá dữ liệu điểm danh
-            cursor.execute("DELETE FROM DIEMDANH WHERE MaSV_FK = %s", (student_id,))
+                        # Xóa dữ liệu lop_mon_sinhvien
+                        cursor.execute("DELETE FROM lop_mon_sinhvien WHERE MaSV_FK = %s", (student_id,))
 
-            # Xóa dữ liệu lop_mon_sinhvien
-            cursor.execute("DELETE FROM lop_mon_sinhvien WHERE MaSV_FK = %s", (student_id,))
+                        # Sau đó xoá sinh viên
+                        cursor.execute("DELETE FROM SINHVIEN WHERE MaSV = %s", (student_id,))
+                        self._bump_face_version(cursor)
 
-            # Sau đó xoá sinh viên
-            cursor.execute("DELETE FROM SINHVIEN WHERE MaSV = %s", (student_id,))
-
-            conn.commit()
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+            self._notify_face_listeners("on_student_deleted", student_id)
             return True
         except Exception as e:
             print("Lỗi khi xóa sinh viên:", e)
             return False
-        finally:
-            cursor.close()
-            conn.close()
 
     def get_total_students(self):
         query = "SELECT COUNT(*) FROM SinhVien"
@@ -81,9 +113,13 @@ class StudentRepository(BaseRepository):
 
     # KhuonMat related methods
     def add_face_embedding(self, MaSV_FK, DuongDanAnh, DuLieuMaHoa):
+        """
+        Lưu một embedding khuôn mặt. Mảng numpy được mã hóa theo EMBEDDING_STORAGE['database']
+        (float32 512 byte, float16 256 byte hoặc int8 132 byte); bytes phải đúng một trong các độ dài này.
+        """
         try:
             if isinstance(DuLieuMaHoa, np.ndarray):
-                DuLieuMaHoa = DuLieuMaHoa.astype(np.float32).tobytes()
+                DuLieuMaHoa = encode_blob(DuLieuMaHoa, EMBEDDING_STORAGE['database'])
             elif isinstance(DuLieuMaHoa, memoryview):
                 DuLieuMaHoa = DuLieuMaHoa.tobytes()
 
@@ -91,8 +127,9 @@ class StudentRepository(BaseRepository):
                 logger.error("❌ DuLieuMaHoa không phải bytes. Không thể lưu vào BLOB.")
                 return False
 
-            if len(DuLieuMaHoa) != 512:
-                logger.error(f"❌ DuLieuMaHoa không đúng 512 bytes: {len(DuLieuMaHoa)}")
+            if len(DuLieuMaHoa) not in BLOB_SIZES:
+                logger.error(f"❌ DuLieuMaHoa không đúng định dạng ({', '.join(map(str, BLOB_SIZES))} bytes): "
+                             f"{len(DuLieuMaHoa)}")
                 return False
 
             query = """
@@ -101,9 +138,11 @@ class StudentRepository(BaseRepository):
                     """
             params = (MaSV_FK, DuongDanAnh, DuLieuMaHoa)
 
-            success = self.execute_query(query, params)
+            success = self._execute_face_change(query, params)
             if success:
                 print("✅ Dữ liệu đã lưu vào DB")
+                embedding = decode_blob(DuLieuMaHoa).reshape(1, -1)
+                self._notify_face_listeners("on_face_embeddings_added", MaSV_FK, embedding)
             else:
                 print("❌ Không lưu được dữ liệu vào DB")
             return success
@@ -112,6 +151,158 @@ class StudentRepository(BaseRepository):
             logger.exception(f"❌ Lỗi khi thêm khuôn mặt: {e}")
             return False
 
+    def add_face_embeddings_bulk(self, rows=None, MaSV_FK=None, embeddings=None, DuongDanAnh=None):
+        """
+        Lưu nhiều embedding trong MỘT transaction bằng các câu INSERT nhiều dòng
+        (VALUES (...), (...), ... tối đa BULK_INSERT_ROWS dòng mỗi câu), thay vì một lần
+        gửi + commit cho mỗi embedding như add_face_embedding.
+
+        Hai cách gọi:
+            add_face_embeddings_bulk([(MaSV, DuongDanAnh, embedding), ...])
+            add_face_embeddings_bulk(MaSV_FK='SV001', embeddings=ma_tran_Nx128, DuongDanAnh=[...])
+        Với cách thứ hai, MaSV_FK/DuongDanAnh có thể là một giá trị chung hoặc danh sách N phần tử.
+        embedding là numpy array (mã hóa theo EMBEDDING_STORAGE['database']) hoặc bytes.
+
+        Returns:
+            list: ID_KhuonMat của các dòng đã thêm theo đúng thứ tự đầu vào,
+                  hoặc None nếu lỗi (đã rollback, không ghi dòng nào)
+        """
+        if rows is None:
+            rows = self._bulk_rows(MaSV_FK, embeddings, DuongDanAnh)
+            if rows is None:
+                return None
+        if len(rows) == 0:
+            return []
+
+        params = []
+        for ma_sv, duong_dan, data in rows:
+            if isinstance(data, np.ndarray):
+                data = encode_blob(data, EMBEDDING_STORAGE['database'])
+            elif isinstance(data, memoryview):
+                data = data.tobytes()
+            if not isinstance(data, (bytes, bytearray)) or len(data) not in BLOB_SIZES:
+                logger.error(f"❌ Embedding của {ma_sv} ({duong_dan}) không đúng định dạng. Hủy lô.")
+                return None
+            params.append((ma_sv, duong_dan, bytes(data)))
+
+        try:
+            with self.conn_manager.connection() as conn:
+                try:
+                    with conn.cursor() as cursor:
+                        ids = self._insert_face_rows(cursor, params)
+                        self._bump_face_version(cursor)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+        except Exception as e:
+            logger.exception(f"❌ Lỗi khi thêm {len(params)} embedding: {e}")
+            return None
+
+        logger.info(f"✅ Đã thêm {len(ids)} embedding trong một transaction.")
+
+        # Cập nhật gallery theo từng sinh viên
+        by_student = {}
+        for ma_sv, _, data in params:
+            by_student.setdefault(ma_sv, []).append(decode_blob(data))
+        for ma_sv, student_embeddings in by_student.items():
+            self._notify_face_listeners("on_face_embeddings_added", ma_sv, np.vstack(student_embeddings))
+        return ids
+
+    def _execute_face_change(self, query, params):
+        """Như execute_query, kèm tăng bộ đếm PhienBanDuLieu trong cùng transaction"""
+        try:
+            with self.conn_manager.connection() as conn:
+                try:
+                    with conn.cursor() as cursor:
+                        cursor.execute(query, params)
+                        self._bump_face_version(cursor)
+                    conn.commit()
+                    return True
+                except Exception:
+                    conn.rollback()
+                    raise
+        except pymysql.MySQLError as e:
+            print(f"❌ MySQL Error: {e}")
+        return False
+
+    @staticmethod
+    def _bump_face_version(cursor):
+        """
+        Tăng bộ đếm dữ liệu khuôn mặt MỘT lần cho cả câu lệnh/lô (không dùng trigger FOR EACH ROW:
+        thêm N dòng sẽ cập nhật cùng một dòng N lần). Gọi ngay trước commit để giữ khóa dòng
+        bộ đếm ngắn nhất.
+        """
+        try:
+            cursor.execute("UPDATE PhienBanDuLieu SET PhienBan = PhienBan + 1 WHERE Ten = 'KhuonMat'")
+        except pymysql.err.ProgrammingError:
+            pass  # Chưa chạy migration 4: get_face_gallery_version dùng dấu vân tay COUNT/MAX/SUM
+
+    @staticmethod
+    def _bulk_rows(ma_sv, embeddings, duong_dan):
+        """Chuyển dạng (MaSV, ma trận N×128, đường dẫn) thành danh sách bộ (MaSV, đường dẫn, embedding)"""
+        if embeddings is None:
+            logger.error("❌ Thiếu rows hoặc embeddings.")
+            return None
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        if matrix.ndim == 1:
+            matrix = matrix.reshape(1, -1)
+        count = matrix.shape[0]
+        ids = [ma_sv] * count if isinstance(ma_sv, str) else list(ma_sv or [])
+        paths = [duong_dan] * count if duong_dan is None or isinstance(duong_dan, str) else list(duong_dan)
+        if len(ids) != count or len(paths) != count:
+            logger.error(f"❌ Số MaSV ({len(ids)}) / đường dẫn ({len(paths)}) không khớp số embedding ({count}).")
+            return None
+        return list(zip(ids, paths, matrix))
+
+    def _insert_face_rows(self, cursor, params):
+        """
+        Chèn các dòng KhuonMat bằng câu INSERT nhiều dòng và trả về ID theo thứ tự đầu vào.
+
+        ID của một câu INSERT nhiều dòng chỉ chắc chắn liên tiếp khi innodb_autoinc_lock_mode
+        là 0/1 và auto_increment_increment = 1. Để không phụ thuộc cấu hình server (MySQL 8 mặc
+        định chế độ 2), ID được đọc lại ngay trong cùng transaction: mọi dòng của câu lệnh có
+        ID >= LAST_INSERT_ID() (ID dòng đầu tiên), và được ghép với đầu vào theo
+        (MaSV, DuongDanAnh, MD5(DuLieuMaHoa)); các dòng trùng khóa nhận ID theo thứ tự tăng dần.
+        Mỗi lô tốn hai lượt gửi (INSERT + SELECT) thay vì một lượt cho mỗi dòng.
+        """
+        ids = []
+        for start in range(0, len(params), self.BULK_INSERT_ROWS):
+            chunk = params[start:start + self.BULK_INSERT_ROWS]
+            query = ("INSERT INTO KhuonMat (MaSV_FK, DuongDanAnh, DuLieuMaHoa) VALUES "
+                     + ", ".join(["(%s, %s, %s)"] * len(chunk)))
+            cursor.execute(query, [value for row in chunk for value in row])
+            first_id = cursor.lastrowid
+
+            students = list(dict.fromkeys(ma_sv for ma_sv, _, _ in chunk))
+            cursor.execute(
+                "SELECT ID_KhuonMat, MaSV_FK, DuongDanAnh, MD5(DuLieuMaHoa) AS digest FROM KhuonMat"
+                " WHERE ID_KhuonMat >= %s AND MaSV_FK IN (" + ", ".join(["%s"] * len(students)) + ")"
+                " ORDER BY ID_KhuonMat", [first_id] + students)
+            inserted = {}
+            for row in cursor.fetchall():
+                if not isinstance(row, dict):
+                    row = dict(zip(("ID_KhuonMat", "MaSV_FK", "DuongDanAnh", "digest"), row))
+                key = (row["MaSV_FK"], row["DuongDanAnh"], row["digest"])
+                inserted.setdefault(key, []).append(row["ID_KhuonMat"])
+
+            for ma_sv, duong_dan, data in chunk:
+                candidates = inserted.get((ma_sv, duong_dan, hashlib.md5(data).hexdigest()))
+                if not candidates:
+                    raise pymysql.err.InternalError(f"Không đọc lại được ID embedding vừa thêm của {ma_sv}")
+                ids.append(candidates.pop(0))
+        return ids
+
+    def get_student_ids(self):
+        """Tập MaSV của toàn bộ sinh viên"""
+        rows = self.fetch_all("SELECT MaSV FROM SinhVien")
+        return {row["MaSV"] if isinstance(row, dict) else row[0] for row in rows or []}
+
+    def get_student_ids_with_faces(self):
+        """Tập MaSV đã có ít nhất một embedding khuôn mặt"""
+        rows = self.fetch_all("SELECT DISTINCT MaSV_FK FROM KhuonMat")
+        return {row["MaSV_FK"] if isinstance(row, dict) else row[0] for row in rows or []}
+
     def get_all_face_embeddings(self):
         """
         Lấy embedding từ DB, đảm bảo dữ liệu là bytes đúng chuẩn để convert sang numpy.
@@ -120,9 +311,10 @@ class StudentRepository(BaseRepository):
         query = "SELECT MaSV_FK, DuLieuMaHoa FROM KhuonMat"
         try:
             # Dùng DictCursor để dễ debug
-            with self.conn.cursor(cursor=pymysql.cursors.DictCursor) as cursor:
-                cursor.execute(query)
-                raw_results = cursor.fetchall()
+            with self.conn_manager.connection(transaction=False) as conn:
+                with conn.cursor(cursor=pymysql.cursors.DictCursor) as cursor:
+                    cursor.execute(query)
+                    raw_results = cursor.fetchall()
 
             processed_results = []
             for row in raw_results:
@@ -141,8 +333,8 @@ class StudentRepository(BaseRepository):
                         f"⚠️ MaSV_FK {ma_sv}: DuLieuMaHoa kiểu không xác định ({type(embedding_data)}). Bỏ qua.")
                     continue
 
-                # Kiểm tra kích thước đúng chuẩn (128 float32 = 512 bytes)
-                if len(embedding_bytes) != 512:
+                # Kiểm tra kích thước đúng chuẩn (float32 512 / float16 256 / int8 132 bytes)
+                if len(embedding_bytes) not in BLOB_SIZES:
                     logger.warning(
                         f"⚠️ MaSV_FK {ma_sv}: DuLieuMaHoa không đúng độ dài (được {len(embedding_bytes)} byte). Bỏ qua.")
                     continue
@@ -160,6 +352,69 @@ class StudentRepository(BaseRepository):
             logger.exception(f"❌ Lỗi khi lấy embedding từ DB: {e}")
             return []
 
+    def iter_face_gallery(self, batch_size=1000):
+        """
+        Duyệt toàn bộ KhuonMat kèm tên sinh viên bằng MỘT truy vấn JOIN duy nhất.
+        Dùng server-side cursor (SSCursor) để stream dữ liệu theo từng lô, không nạp
+        toàn bộ kết quả vào bộ nhớ và không mở/đóng kết nối cho từng sinh viên.
+
+        Generator mượn một kết nối riêng từ pool trong suốt quá trình duyệt (SSCursor giữ
+        kết nối bận tới khi đọc hết), nên các truy vấn khác vẫn chạy song song được.
+
+        Yields:
+            tuple: (MaSV, TenSV, DuLieuMaHoa) với DuLieuMaHoa là bytes hoặc giá trị gốc từ DB
+        """
+        query = """
+                SELECT km.MaSV_FK, sv.TenSV, km.DuLieuMaHoa
+                FROM KhuonMat km
+                JOIN SinhVien sv ON km.MaSV_FK = sv.MaSV
+                """
+        conn = self.conn_manager.checkout()
+        try:
+            with conn.cursor(pymysql.cursors.SSCursor) as cursor:
+                cursor.execute(query)
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for ma_sv, ten_sv, embedding_data in rows:
+                        if isinstance(embedding_data, memoryview):
+                            embedding_data = embedding_data.tobytes()
+                        yield ma_sv, ten_sv, embedding_data
+        finally:
+            self.conn_manager.checkin(conn)
+
+    def get_face_gallery_version(self):
+        """
+        Phiên bản dữ liệu khuôn mặt phía CSDL, dùng để biết cache gallery trên đĩa còn hợp lệ không.
+
+        Ưu tiên bộ đếm PhienBanDuLieu (tăng khi thêm/xóa khuôn mặt, sửa KhuonMat hoặc đổi tên
+        sinh viên; tạo bởi migration 4). Nếu CSDL chưa có bảng này thì dùng dấu vân tay COUNT/MAX/SUM(ID_KhuonMat) — phát hiện được
+        thêm/xóa khuôn mặt nhưng không phát hiện đổi tên sinh viên.
+
+        Returns:
+            str: Chuỗi phiên bản, hoặc None nếu không truy vấn được (khi đó không dùng cache)
+        """
+        try:
+            with self.conn_manager.connection(transaction=False) as conn, \
+                    conn.cursor(pymysql.cursors.Cursor) as cursor:
+                try:
+                    cursor.execute("SELECT PhienBan FROM PhienBanDuLieu WHERE Ten = 'KhuonMat'")
+                    row = cursor.fetchone()
+                    if row is not None:
+                        return f"counter:{row[0]}"
+                except pymysql.err.ProgrammingError:
+                    logger.warning("⚠️ Chưa có bảng PhienBanDuLieu (chạy python -m database.migrations): "
+                                   "cache gallery không phát hiện được đổi tên sinh viên.")
+
+                cursor.execute(
+                    "SELECT COUNT(*), COALESCE(MAX(ID_KhuonMat), 0), COALESCE(SUM(ID_KhuonMat), 0) FROM KhuonMat")
+                count, max_id, sum_id = cursor.fetchone()
+                return f"rows:{count}:{max_id}:{sum_id}"
+        except Exception as e:
+            logger.warning(f"⚠️ Không lấy được phiên bản dữ liệu khuôn mặt: {e}")
+            return None
+
     def get_face_embeddings_by_student_id(self, MaSV_FK):
         query = "SELECT DuLieuMaHoa FROM KhuonMat WHERE MaSV_FK = %s"
         return self.fetch_all(query, (MaSV_FK,))
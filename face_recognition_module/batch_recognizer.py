@@ -0,0 +1,361 @@
+# face_recognition_module\batch_recognizer.py
+"""
+Nhận diện hàng loạt (offline) trên thư mục ảnh và video bài giảng đã ghi.
+
+Gallery được nạp từ CSDL một lần ở tiến trình chính rồi đặt vào shared memory; mỗi
+tiến trình trong pool dựng FaceRecognizer không kết nối CSDL trên vùng nhớ đó. Ảnh
+được xử lý từng file, video được chia thành các đoạn frame để nhiều tiến trình cùng
+xử lý một file dài. Kết quả được ghi dần ra CSV/JSONL ngay khi từng tác vụ xong và
+có thể ghi bổ sung điểm danh cho một buổi học (MaBuoiHoc).
+
+Ví dụ:
+    python -m face_recognition_module.batch_recognizer recordings/ -o ket_qua.csv --workers 8
+    python -m face_recognition_module.batch_recognizer lop_A.mp4 -o ket_qua.jsonl --session BH001
+"""
+import csv
+import datetime
+import json
+import logging
+import multiprocessing as mp
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from face_recognition_module.face_gallery import share_gallery
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mkv', '.mov', '.webm')
+
+RESULT_FIELDS = ['source', 'frame', 'timestamp', 'student_id', 'student_name', 'confidence',
+                 'top', 'right', 'bottom', 'left']
+
+# Trạng thái riêng của mỗi tiến trình trong pool (khởi tạo bởi _init_worker)
+_worker = {}
+
+
+def _init_worker(gallery_spec, roster, threshold, detection_config):
+    """Khởi tạo tiến trình con: dựng FaceRecognizer trên gallery dùng chung"""
+    from face_recognition_module.face_detector import FaceDetector
+    from face_recognition_module.face_gallery import attach_gallery
+    from face_recognition_module.face_recognizer import FaceRecognizer
+
+    # Giữ tham chiếu SharedMemory sống cùng tiến trình, tránh bị giải phóng khi gallery còn dùng
+    shm, gallery = attach_gallery(gallery_spec)
+    recognizer = FaceRecognizer(threshold, detector=FaceDetector(**detection_config), gallery=gallery)
+    if roster:
+        recognizer.set_session_roster(roster)
+    _worker['shm'] = shm
+    _worker['recognizer'] = recognizer
+
+
+def _frame_records(source, frame_index, timestamp, frame):
+    records = []
+    for ma_sv, ten_sv, (top, right, bottom, left), confidence, _ in \
+            _worker['recognizer'].recognize_faces_in_frame(frame):
+        records.append({
+            'source': source,
+            'frame': frame_index,
+            'timestamp': timestamp,
+            'student_id': ma_sv,
+            'student_name': ten_sv,
+            'confidence': round(float(confidence), 2),
+            'top': top, 'right': right, 'bottom': bottom, 'left': left,
+        })
+    return records
+
+
+def _process_task(task):
+    """
+    Xử lý một tác vụ trong tiến trình con
+
+    Args:
+        task (tuple): ('image', path) hoặc ('video', path, start_frame, end_frame, frame_step)
+
+    Returns:
+        tuple: (task, records, error)
+    """
+    kind, path = task[0], task[1]
+    try:
+        if kind == 'image':
+            frame = cv2.imread(path)
+            if frame is None:
+                return task, [], "Không đọc được ảnh"
+            return task, _frame_records(path, None, None, frame), None
+
+        _, _, start_frame, end_frame, frame_step = task
+        cap = cv2.VideoCapture(path)
+        if not cap.isOpened():
+            return task, [], "Không mở được video"
+        try:
+            fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+            records = []
+            frame_index = start_frame
+            while frame_index < end_frame:
+                # grab() bỏ qua giải mã đầy đủ cho các frame không lấy mẫu
+                if not cap.grab():
+                    break
+                if (frame_index - start_frame) % frame_step == 0:
+                    ok, frame = cap.retrieve()
+                    if ok:
+                        records.extend(_frame_records(path, frame_index, round(frame_index / fps, 3), frame))
+                frame_index += 1
+            return task, records, None
+        finally:
+            cap.release()
+
+    except Exception as e:
+        return task, [], str(e)
+
+
+def collect_tasks(inputs, frame_step=25, chunk_frames=1500):
+    """
+    Liệt kê tác vụ từ các file/thư mục đầu vào
+
+    Args:
+        inputs (list): Đường dẫn ảnh, video hoặc thư mục (duyệt đệ quy)
+        frame_step (int): Lấy mẫu mỗi N frame của video
+        chunk_frames (int): Số frame mỗi đoạn video giao cho một tiến trình
+
+    Returns:
+        list: Danh sách tác vụ cho _process_task
+    """
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, files in os.walk(item):
+                paths.extend(os.path.join(root, name) for name in sorted(files))
+        else:
+            paths.append(item)
+
+    frame_step = max(1, int(frame_step))
+    chunk_frames = max(frame_step, int(chunk_frames) // frame_step * frame_step)
+
+    tasks = []
+    for path in paths:
+        ext = os.path.splitext(path)[1].lower()
+        if ext in IMAGE_EXTENSIONS:
+            tasks.append(('image', path))
+        elif ext in VIDEO_EXTENSIONS:
+            cap = cv2.VideoCapture(path)
+            total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) if cap.isOpened() else 0
+            cap.release()
+            if total <= 0:
+                # Không biết số frame (một số container): xử lý cả file trong một tác vụ
+                tasks.append(('video', path, 0, sys.maxsize, frame_step))
+                continue
+            for start in range(0, total, chunk_frames):
+                tasks.append(('video', path, start, min(start + chunk_frames, total), frame_step))
+    return tasks
+
+
+class ResultWriter:
+    """Ghi kết quả dần ra CSV hoặc JSONL (chọn theo phần mở rộng của file)"""
+
+    def __init__(self, path):
+        self.path = path
+        self.jsonl = path.lower().endswith(('.jsonl', '.json'))
+        self._file = open(path, 'w', newline='', encoding='utf-8')
+        self._csv = None
+        if not self.jsonl:
+            self._csv = csv.DictWriter(self._file, fieldnames=RESULT_FIELDS)
+            self._csv.writeheader()
+
+    def write(self, records):
+        for record in records:
+            if self.jsonl:
+                self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            else:
+                self._csv.writerow(record)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def run_batch(inputs, output, face_recognizer, workers=None, frame_step=25, chunk_frames=1500,
+              roster=None, progress=True):
+    """
+    Nhận diện hàng loạt bằng process pool
+
+    Args:
+        inputs (list): Ảnh, video hoặc thư mục
+        output (str): File kết quả (.csv hoặc .jsonl)
+        face_recognizer (FaceRecognizer): Nguồn gallery, ngưỡng và cấu hình phát hiện
+        workers (int): Số tiến trình (mặc định = số nhân CPU)
+        frame_step (int): Lấy mẫu mỗi N frame của video
+        chunk_frames (int): Số frame mỗi đoạn video
+        roster (list): Chỉ so khớp với các sinh viên này (None = toàn bộ gallery)
+        progress (bool): In tiến độ
+
+    Returns:
+        dict: {tasks, failed, faces, seconds, students} — students: {ma_sv: {...}} tốt nhất theo sinh viên
+    """
+    tasks = collect_tasks(inputs, frame_step, chunk_frames)
+    summary = {'tasks': len(tasks), 'failed': [], 'faces': 0, 'seconds': 0.0, 'students': {}}
+    if not tasks:
+        return summary
+
+    detector = face_recognizer.detector
+    detection_config = {'scale': detector.scale, 'upsample': detector.upsample,
+                        'min_face_size': detector.min_face_size, 'model': detector.model}
+
+    start = time.perf_counter()
+    shm, gallery_spec = share_gallery(face_recognizer.gallery)
+    writer = ResultWriter(output)
+    try:
+        # spawn: an toàn với dlib/OpenCV đã khởi tạo luồng ở tiến trình cha
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), mp_context=mp.get_context('spawn'),
+                                 initializer=_init_worker,
+                                 initargs=(gallery_spec, list(roster or []),
+                                           face_recognizer.recognition_threshold, detection_config)) as pool:
+            futures = [pool.submit(_process_task, task) for task in tasks]
+            for done, future in enumerate(as_completed(futures), 1):
+                task, records, error = future.result()
+                if error:
+                    summary['failed'].append((task[1], error))
+                    logger.warning(f"Lỗi khi xử lý {task[1]}: {error}")
+
+                writer.write(records)
+                summary['faces'] += len(records)
+                for record in records:
+                    _merge_student(summary['students'], record)
+
+                if progress:
+                    print(f"\r[{done}/{len(tasks)}] {summary['faces']} khuôn mặt", end='', flush=True)
+    finally:
+        writer.close()
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+
+    if progress:
+        print()
+    summary['seconds'] = round(time.perf_counter() - start, 2)
+    return summary
+
+
+def _merge_student(students, record):
+    """Giữ lần xuất hiện sớm nhất và độ tin cậy cao nhất của mỗi sinh viên"""
+    ma_sv = record['student_id']
+    if not ma_sv:
+        return
+    entry = students.get(ma_sv)
+    if entry is None:
+        students[ma_sv] = {
+            'student_id': ma_sv,
+            'student_name': record['student_name'],
+            'source': record['source'],
+            'timestamp': record['timestamp'] or 0.0,
+            'best_confidence': record['confidence'],
+        }
+        return
+    entry['best_confidence'] = max(entry['best_confidence'], record['confidence'])
+    if (record['timestamp'] or 0.0) < entry['timestamp']:
+        entry['timestamp'] = record['timestamp'] or 0.0
+        entry['source'] = record['source']
+
+
+def write_session_attendance(session_id, students, min_confidence=75.0, status="Có mặt"):
+    """
+    Ghi điểm danh cho buổi học từ kết quả nhận diện hàng loạt
+
+    ThoiGian = giờ bắt đầu buổi học + thời điểm xuất hiện đầu tiên trong video (ảnh: +0).
+    Sinh viên đã có bản ghi trong buổi học được bỏ qua. Toàn bộ bản ghi được ghi trong một
+    transaction (add_attendance_records_bulk). HinhAnh để NULL: không có ảnh khuôn mặt riêng,
+    đường dẫn video/ảnh nguồn không phải ảnh khuôn mặt.
+
+    Returns:
+        tuple: (số bản ghi đã thêm, số sinh viên đã có bản ghi trong buổi,
+                số sinh viên bị loại vì độ tin cậy < min_confidence)
+    """
+    from database.attendance_repository import AttendanceRepository
+    from database.session_repository import SessionRepository
+
+    session_info = SessionRepository().get_session_by_id(session_id)
+    if not session_info:
+        raise ValueError(f"Không tìm thấy buổi học {session_id}")
+
+    gio = (datetime.datetime.min + session_info["GioBatDau"]).time()
+    session_start = datetime.datetime.combine(session_info["NgayHoc"], gio)
+
+    records = []
+    for entry in students.values():
+        if entry['best_confidence'] < min_confidence:
+            continue
+        thoi_gian = session_start + datetime.timedelta(seconds=entry['timestamp'])
+        records.append((session_id, entry['student_id'], thoi_gian.strftime("%Y-%m-%d %H:%M:%S"),
+                        status, None))
+
+    added = AttendanceRepository().add_attendance_records_bulk(records, mode='skip')
+    return added, len(records) - added, len(students) - len(records)
+
+
+def load_session_roster(session_id):
+    """Danh sách MaSV của lớp-môn thuộc buổi học (rỗng nếu không xác định được)"""
+    from database.class_subject_repository import ClassSubjectRepository
+    from database.session_repository import SessionRepository
+
+    session_info = SessionRepository().get_session_by_id(session_id) or {}
+    ma_lop, ma_mon = session_info.get("MaLop"), session_info.get("MaMon")
+    if not ma_lop or not ma_mon:
+        return []
+    students = ClassSubjectRepository().get_students_in_class_subject(ma_lop, ma_mon) or []
+    return [s["MaSV"] if isinstance(s, dict) else s[0] for s in students]
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Nhận diện khuôn mặt hàng loạt trên ảnh/video")
+    parser.add_argument('inputs', nargs='+', help="Ảnh, video hoặc thư mục (duyệt đệ quy)")
+    parser.add_argument('-o', '--output', required=True, help="File kết quả .csv hoặc .jsonl")
+    parser.add_argument('--workers', type=int, default=None, help="Số tiến trình (mặc định: số nhân CPU)")
+    parser.add_argument('--frame-step', type=int, default=25, help="Lấy mẫu mỗi N frame video")
+    parser.add_argument('--chunk-frames', type=int, default=1500, help="Số frame mỗi đoạn video/tác vụ")
+    parser.add_argument('--threshold', type=float, default=None,
+                        help="Ngưỡng khoảng cách nhận diện (mặc định: như màn hình điểm danh)")
+    parser.add_argument('--session', help="MaBuoiHoc: chỉ so khớp sinh viên của lớp và ghi điểm danh")
+    parser.add_argument('--no-roster', action='store_true', help="Với --session: vẫn so khớp toàn trường")
+    parser.add_argument('--dry-run', action='store_true', help="Với --session: không ghi điểm danh")
+    parser.add_argument('--min-confidence', type=float, default=75.0, help="Độ tin cậy tối thiểu (%%) để ghi điểm danh")
+    args = parser.parse_args()
+
+    from face_recognition_module.face_recognizer import FaceRecognizer
+
+    # Cùng ngưỡng mặc định với FaceRecognizer của ứng dụng để kết quả hàng loạt khớp điểm danh trực tiếp
+    recognizer = FaceRecognizer() if args.threshold is None else FaceRecognizer(recognition_threshold=args.threshold)
+    if len(recognizer.gallery) == 0:
+        print("Gallery rỗng, không có gì để so khớp.")
+        sys.exit(1)
+
+    session_roster = None
+    if args.session and not args.no_roster:
+        session_roster = load_session_roster(args.session)
+        print(f"Buổi học {args.session}: so khớp với {len(session_roster)} sinh viên của lớp.")
+
+    result = run_batch(args.inputs, args.output, recognizer, workers=args.workers,
+                       frame_step=args.frame_step, chunk_frames=args.chunk_frames, roster=session_roster)
+
+    print(f"✅ {result['tasks']} tác vụ, {result['faces']} khuôn mặt, "
+          f"{len(result['students'])} sinh viên trong {result['seconds']}s -> {args.output}")
+    for path, error in result['failed']:
+        print(f"❌ {path}: {error}")
+
+    if args.session and not args.dry_run:
+        try:
+            added, existing, low_confidence = write_session_attendance(args.session, result['students'],
+                                                                       args.min_confidence)
+            print(f"Điểm danh buổi {args.session}: thêm {added}, đã có {existing}, "
+                  f"độ tin cậy < {args.min_confidence}%: {low_confidence}.")
+        except Exception as e:
+            print(f"❌ Không ghi được điểm danh buổi {args.session} (không bản ghi nào được thêm): {e}")
@@ -0,0 +1,272 @@
+# face_recognition_module\bulk_enrollment.py
+"""
+Đăng ký khuôn mặt hàng loạt từ thư mục ảnh thẻ.
+
+Cấu trúc đầu vào: mỗi sinh viên một thư mục con đặt tên theo MaSV
+    anh_the/
+        SV001/ 1.jpg 2.jpg
+        SV002/ anh.png
+(ảnh đặt thẳng trong thư mục gốc cũng được nhận, MaSV lấy từ tên file: SV003.jpg, SV003_2.jpg).
+
+Giải mã, phát hiện, chấm điểm chất lượng và mã hóa chạy trong process pool; mỗi tác vụ là
+một nhóm sinh viên. Khi một nhóm xong, toàn bộ embedding của nhóm được ghi bằng một lần
+add_face_embeddings_bulk (một transaction). Kết quả được báo cáo theo từng sinh viên.
+
+Ví dụ:
+    python -m face_recognition_module.bulk_enrollment anh_the/ --workers 8 --report dang_ky.csv
+    python -m face_recognition_module.bulk_enrollment anh_the/ --skip-existing --max-per-student 3
+"""
+import csv
+import logging
+import multiprocessing as mp
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from face_recognition_module.batch_recognizer import IMAGE_EXTENSIONS
+
+logger = logging.getLogger(__name__)
+
+REPORT_FIELDS = ['student_id', 'photos', 'enrolled', 'status', 'errors']
+
+# Ảnh thẻ thường rất lớn; thu nhỏ cạnh dài về mức này trước khi phát hiện/mã hóa
+MAX_IMAGE_SIDE = 1280
+
+# Trạng thái riêng của mỗi tiến trình trong pool (khởi tạo bởi _init_worker)
+_worker = {}
+
+
+def _init_worker(detection_config, num_jitters):
+    from face_recognition_module.face_detector import FaceDetector
+    from face_recognition_module.face_quality import FaceQualityScorer
+
+    _worker['detector'] = FaceDetector(**detection_config)
+    _worker['quality'] = FaceQualityScorer()
+    _worker['num_jitters'] = num_jitters
+
+
+def _encode_photo(path):
+    """
+    Mã hóa khuôn mặt lớn nhất trong một ảnh
+
+    Returns:
+        tuple: (encoding, score, None) hoặc (None, None, lý do lỗi)
+    """
+    import face_recognition
+
+    image = cv2.imread(path)
+    if image is None:
+        return None, None, "Không đọc được ảnh"
+
+    height, width = image.shape[:2]
+    if max(height, width) > MAX_IMAGE_SIDE:
+        ratio = MAX_IMAGE_SIDE / float(max(height, width))
+        image = cv2.resize(image, (0, 0), fx=ratio, fy=ratio, interpolation=cv2.INTER_AREA)
+    rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+    locations = _worker['detector'].detect(rgb)
+    if not locations:
+        return None, None, "Không tìm thấy khuôn mặt"
+    # Ảnh thẻ: lấy khuôn mặt lớn nhất, bỏ qua người phía sau
+    location = max(locations, key=lambda b: (b[2] - b[0]) * (b[1] - b[3]))
+
+    quality = _worker['quality'].score(rgb, location)
+    if not quality.ok:
+        return None, None, f"Chất lượng thấp ({quality.reason})"
+
+    encodings = face_recognition.face_encodings(rgb, [location], num_jitters=_worker['num_jitters'])
+    if not encodings:
+        return None, None, "Không mã hóa được khuôn mặt"
+    return encodings[0].astype('float32'), quality.score, None
+
+
+def _process_group(group, max_per_student):
+    """
+    Xử lý một nhóm sinh viên trong tiến trình con
+
+    Args:
+        group (list): [(ma_sv, [đường dẫn ảnh, ...]), ...]
+        max_per_student (int): Giữ tối đa N ảnh điểm cao nhất mỗi sinh viên (0 = tất cả)
+
+    Returns:
+        list: [(ma_sv, số ảnh, [(đường dẫn, encoding), ...], [(đường dẫn, lỗi), ...]), ...]
+    """
+    results = []
+    for ma_sv, paths in group:
+        encoded, errors = [], []
+        for path in paths:
+            try:
+                encoding, score, error = _encode_photo(path)
+            except Exception as e:
+                encoding, score, error = None, None, str(e)
+            if error:
+                errors.append((path, error))
+            else:
+                encoded.append((score, path, encoding))
+
+        encoded.sort(key=lambda item: item[0], reverse=True)
+        if max_per_student:
+            encoded = encoded[:max_per_student]
+        results.append((ma_sv, len(paths), [(path, encoding) for _, path, encoding in encoded], errors))
+    return results
+
+
+def collect_photos(root):
+    """
+    Gom ảnh theo MaSV
+
+    Returns:
+        dict: {ma_sv: [đường dẫn ảnh, ...]} (thứ tự ổn định theo tên)
+    """
+    photos = {}
+    for name in sorted(os.listdir(root)):
+        path = os.path.join(root, name)
+        if os.path.isdir(path):
+            for sub_root, _, files in os.walk(path):
+                for file_name in sorted(files):
+                    if file_name.lower().endswith(IMAGE_EXTENSIONS):
+                        photos.setdefault(name, []).append(os.path.join(sub_root, file_name))
+        elif name.lower().endswith(IMAGE_EXTENSIONS):
+            ma_sv = os.path.splitext(name)[0].split('_')[0]
+            photos.setdefault(ma_sv, []).append(path)
+    return photos
+
+
+def run_enrollment(root, student_repo, workers=None, group_size=20, max_per_student=0,
+                   skip_existing=False, detection_config=None, num_jitters=1, progress=True):
+    """
+    Đăng ký khuôn mặt hàng loạt
+
+    Args:
+        root (str): Thư mục ảnh
+        student_repo (StudentRepository): Dùng để kiểm tra MaSV và ghi embedding
+        workers (int): Số tiến trình (mặc định = số nhân CPU)
+        group_size (int): Số sinh viên mỗi tác vụ / mỗi transaction
+        max_per_student (int): Giữ tối đa N ảnh tốt nhất mỗi sinh viên (0 = tất cả)
+        skip_existing (bool): Bỏ qua sinh viên đã có embedding
+        detection_config (dict): Tham số cho FaceDetector (None = theo config)
+        num_jitters (int): num_jitters của face_encodings
+        progress (bool): In tiến độ
+
+    Returns:
+        dict: {students: {ma_sv: {student_id, photos, enrolled, status, errors}},
+               enrolled (số embedding), failed (số sinh viên lỗi), seconds}
+    """
+    start = time.perf_counter()
+    photos = collect_photos(root)
+    report = {}
+
+    known = student_repo.get_student_ids()
+    existing = student_repo.get_student_ids_with_faces() if skip_existing else set()
+    pending = []
+    for ma_sv, paths in photos.items():
+        entry = {'student_id': ma_sv, 'photos': len(paths), 'enrolled': 0, 'status': '', 'errors': []}
+        report[ma_sv] = entry
+        if ma_sv not in known:
+            entry['status'] = 'unknown_student'
+        elif ma_sv in existing:
+            entry['status'] = 'skipped_existing'
+        else:
+            pending.append((ma_sv, paths))
+
+    group_size = max(1, int(group_size))
+    groups = [pending[i:i + group_size] for i in range(0, len(pending), group_size)]
+    summary = {'students': report, 'enrolled': 0, 'failed': 0, 'seconds': 0.0}
+
+    if groups:
+        # spawn: an toàn với dlib/OpenCV đã khởi tạo luồng ở tiến trình cha
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), mp_context=mp.get_context('spawn'),
+                                 initializer=_init_worker,
+                                 initargs=(detection_config or {}, num_jitters)) as pool:
+            futures = [pool.submit(_process_group, group, max_per_student) for group in groups]
+            for done, future in enumerate(as_completed(futures), 1):
+                try:
+                    results = future.result()
+                except Exception as e:
+                    logger.error(f"Lỗi tiến trình đăng ký: {e}")
+                    continue
+                _write_group(student_repo, results, report)
+                if progress:
+                    enrolled = sum(1 for e in report.values() if e['status'] == 'enrolled')
+                    print(f"\r[{done}/{len(groups)}] {enrolled} sinh viên đã đăng ký", end='', flush=True)
+        if progress:
+            print()
+
+    # Nhóm bị lỗi cả tiến trình không kịp ghi trạng thái
+    for entry in report.values():
+        if not entry['status']:
+            entry['status'] = 'failed'
+    summary['enrolled'] = sum(e['enrolled'] for e in report.values())
+    summary['failed'] = sum(1 for e in report.values() if e['status'] not in ('enrolled', 'skipped_existing'))
+    summary['seconds'] = round(time.perf_counter() - start, 2)
+    return summary
+
+
+def _write_group(student_repo, results, report):
+    """Ghi embedding của cả nhóm trong một transaction và cập nhật báo cáo"""
+    rows = []
+    for ma_sv, _, encoded, errors in results:
+        report[ma_sv]['errors'] = errors
+        rows.extend((ma_sv, path, encoding) for path, encoding in encoded)
+
+    written = student_repo.add_face_embeddings_bulk(rows)  # Danh sách ID, None nếu lỗi
+    for ma_sv, _, encoded, _ in results:
+        entry = report[ma_sv]
+        if not encoded:
+            entry['status'] = 'no_usable_photo'
+        elif written is None:
+            entry['status'] = 'db_error'
+        else:
+            entry['enrolled'] = len(encoded)
+            entry['status'] = 'enrolled'
+
+
+def write_report(path, students):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        for entry in students.values():
+            writer.writerow(dict(entry, errors='; '.join(f"{os.path.basename(p)}: {e}" for p, e in entry['errors'])))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Đăng ký khuôn mặt hàng loạt từ thư mục ảnh theo MaSV")
+    parser.add_argument('root', help="Thư mục chứa thư mục con <MaSV>/ hoặc ảnh <MaSV>[_n].jpg")
+    parser.add_argument('--workers', type=int, default=None, help="Số tiến trình (mặc định: số nhân CPU)")
+    parser.add_argument('--group-size', type=int, default=20, help="Số sinh viên mỗi tác vụ/transaction")
+    parser.add_argument('--max-per-student', type=int, default=0, help="Giữ tối đa N ảnh tốt nhất (0 = tất cả)")
+    parser.add_argument('--skip-existing', action='store_true', help="Bỏ qua sinh viên đã có dữ liệu khuôn mặt")
+    parser.add_argument('--jitters', type=int, default=1, help="num_jitters khi mã hóa")
+    parser.add_argument('--report', help="Ghi báo cáo theo sinh viên ra file CSV")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.root):
+        print(f"Không tìm thấy thư mục {args.root}")
+        sys.exit(1)
+
+    from database.student_repository import StudentRepository
+
+    result = run_enrollment(args.root, StudentRepository(), workers=args.workers, group_size=args.group_size,
+                            max_per_student=args.max_per_student, skip_existing=args.skip_existing,
+                            num_jitters=args.jitters)
+
+    enrolled_students = sum(1 for e in result['students'].values() if e['status'] == 'enrolled')
+    print(f"✅ Đã thêm {result['enrolled']} embedding cho {enrolled_students} sinh viên "
+          f"trong {result['seconds']}s ({result['failed']} sinh viên lỗi)")
+    for entry in result['students'].values():
+        if entry['status'] not in ('enrolled', 'skipped_existing'):
+            reasons = '; '.join(error for _, error in entry['errors'][:3])
+            print(f"❌ {entry['student_id']}: {entry['status']}" + (f" ({reasons})" if reasons else ""))
+
+    if args.report:
+        write_report(args.report, result['students'])
+        print(f"Báo cáo: {args.report}")
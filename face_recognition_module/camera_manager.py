@@ -0,0 +1,274 @@
+# face_recognition_module\camera_manager.py
+"""
+Điểm danh nhiều camera: mỗi luồng camera chạy nhận diện trong một tiến trình riêng.
+
+Gallery embedding được đặt một lần vào shared memory và các tiến trình con chỉ đọc
+trên cùng vùng nhớ đó (không sao chép, không kết nối CSDL). Kết quả nhận diện từ các
+camera được gộp theo buổi học: mỗi sinh viên chỉ được báo một lần, kèm độ tin cậy
+tốt nhất và danh sách camera đã thấy.
+
+Vì mỗi camera là một tiến trình, thông lượng tăng theo số nhân CPU thay vì bị GIL giới hạn.
+"""
+import logging
+import multiprocessing as mp
+import os
+import queue
+import sys
+import time
+
+import cv2
+import numpy as np
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from face_recognition_module.face_gallery import share_gallery
+
+logger = logging.getLogger(__name__)
+
+# Chỉ số camera của camera xem trước (nhận diện trong tiến trình GUI) trong DetectionMerger;
+# camera phụ dùng chỉ số 0..N-1 theo CameraManager.sources
+PRIMARY_CAMERA = -1
+
+
+def _stream_worker(camera_index, source, gallery_spec, roster, roster_fallback, threshold,
+                   detection_config, detect_every, result_queue, stop_event):
+    """Tiến trình con: đọc một nguồn camera, nhận diện và gửi kết quả về tiến trình chính"""
+    from face_recognition_module.face_detector import FaceDetector
+    from face_recognition_module.face_gallery import attach_gallery
+    from face_recognition_module.face_recognizer import FaceRecognizer
+    from face_recognition_module.face_tracker import FaceTracker
+
+    shm = None
+    cap = None
+    try:
+        shm, gallery = attach_gallery(gallery_spec)
+
+        recognizer = FaceRecognizer(threshold, detector=FaceDetector(**detection_config), gallery=gallery)
+        if roster:
+            recognizer.set_session_roster(roster, fallback_to_global=roster_fallback)
+        tracker = FaceTracker(recognizer, detect_every=detect_every)
+
+        cap = cv2.VideoCapture(source)
+        if not cap.isOpened():
+            result_queue.put(('error', camera_index, f"Không thể mở camera {source}"))
+            return
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+        while not stop_event.is_set():
+            ret, frame = cap.read()
+            if not ret:
+                if isinstance(source, str) and not source.startswith(('rtsp://', 'http://', 'https://')):
+                    break  # Hết file video
+                time.sleep(0.05)
+                continue
+
+            detections = []
+            for ma_sv, ten_sv, face_location, confidence, face_img in tracker.process(frame):
+                if not ma_sv:
+                    continue
+                ok, face_jpg = cv2.imencode('.jpg', face_img) if face_img is not None and face_img.size else (False, None)
+                detections.append((ma_sv, ten_sv, face_location, confidence, face_jpg.tobytes() if ok else None))
+
+            if detections:
+                result_queue.put(('detections', camera_index, time.time(), detections))
+
+    except Exception as e:
+        result_queue.put(('error', camera_index, str(e)))
+    finally:
+        if cap is not None:
+            cap.release()
+        if shm is not None:
+            shm.close()
+        result_queue.put(('stopped', camera_index))
+
+
+class DetectionMerger:
+    """Gộp kết quả nhận diện từ nhiều camera theo sinh viên trong một buổi học"""
+
+    def __init__(self, min_confidence=75.0):
+        self.min_confidence = min_confidence
+        self.students = {}
+
+    def reset(self):
+        self.students = {}
+
+    def add(self, camera_index, timestamp, ma_sv, ten_sv, confidence, face_jpg=None):
+        """
+        Ghi nhận một lần nhận diện
+
+        Returns:
+            bool: True nếu đây là lần đầu sinh viên được nhận diện đủ tin cậy trong buổi học
+        """
+        if confidence < self.min_confidence:
+            return False
+
+        entry = self.students.get(ma_sv)
+        if entry is None:
+            self.students[ma_sv] = {
+                'student_id': ma_sv,
+                'student_name': ten_sv,
+                'first_seen': timestamp,
+                'best_confidence': confidence,
+                'cameras': {camera_index},
+                'face_jpg': face_jpg,
+            }
+            return True
+
+        entry['cameras'].add(camera_index)
+        if confidence > entry['best_confidence']:
+            entry['best_confidence'] = confidence
+            if face_jpg is not None:
+                entry['face_jpg'] = face_jpg
+        return False
+
+
+class CameraManager:
+    """Quản lý N nguồn camera, mỗi nguồn một tiến trình nhận diện"""
+
+    def __init__(self, sources, face_recognizer, detect_every=5, min_confidence=75.0, detection_config=None):
+        """
+        Args:
+            sources (list): Chỉ số camera hoặc đường dẫn/URL video
+            face_recognizer (FaceRecognizer): Nguồn gallery, ngưỡng và danh sách lớp hiện tại
+            detect_every (int): Chu kỳ phát hiện đầy đủ của FaceTracker trong mỗi tiến trình
+            min_confidence (float): Độ tin cậy tối thiểu (%) để ghi nhận sinh viên
+            detection_config (dict): Tham số FaceDetector (mặc định lấy từ bộ nhận diện chính)
+        """
+        self.sources = list(sources)
+        self.face_recognizer = face_recognizer
+        self.detect_every = detect_every
+        self.detection_config = detection_config or {
+            'scale': face_recognizer.detector.scale,
+            'upsample': face_recognizer.detector.upsample,
+            'min_face_size': face_recognizer.detector.min_face_size,
+            'model': face_recognizer.detector.model,
+        }
+        self.merger = DetectionMerger(min_confidence)
+
+        # spawn: an toàn khi tiến trình cha đang chạy Qt và nhiều luồng
+        self._ctx = mp.get_context('spawn')
+        self._processes = []
+        self._result_queue = None
+        self._stop_event = None
+        self._shm = None
+
+    @property
+    def is_running(self):
+        return any(p.is_alive() for p in self._processes)
+
+    def start(self):
+        """Chụp snapshot gallery vào shared memory và khởi động một tiến trình cho mỗi nguồn"""
+        if self._processes:
+            return
+
+        self._shm, gallery_spec = share_gallery(self.face_recognizer.gallery)
+
+        roster = sorted(self.face_recognizer.session_roster or [])
+        self._result_queue = self._ctx.Queue()
+        self._stop_event = self._ctx.Event()
+        self.merger.reset()
+
+        for camera_index, source in enumerate(self.sources):
+            process = self._ctx.Process(
+                target=_stream_worker,
+                args=(camera_index, source, gallery_spec, roster, self.face_recognizer.roster_fallback,
+                      self.face_recognizer.recognition_threshold, self.detection_config,
+                      self.detect_every, self._result_queue, self._stop_event),
+                daemon=True)
+            process.start()
+            self._processes.append(process)
+
+        logger.info(f"Đã khởi động {len(self._processes)} tiến trình camera "
+                    f"(gallery {gallery_spec['shape'][0]} mẫu dùng chung).")
+
+    def add_primary_detection(self, ma_sv, ten_sv, confidence, face_jpg=None):
+        """
+        Gộp kết quả của camera xem trước vào cùng bộ gộp với các camera phụ
+
+        Returns:
+            bool: True nếu sinh viên chưa được camera nào báo trong buổi học
+        """
+        return self.merger.add(PRIMARY_CAMERA, time.time(), ma_sv, ten_sv, confidence, face_jpg)
+
+    def poll(self):
+        """
+        Lấy các kết quả mới từ tiến trình con (không chặn)
+
+        Returns:
+            list: Thông tin các sinh viên lần đầu được nhận diện (dict từ DetectionMerger)
+        """
+        newly_seen = []
+        if self._result_queue is None:
+            return newly_seen
+
+        while True:
+            try:
+                message = self._result_queue.get_nowait()
+            except queue.Empty:
+                break
+
+            kind = message[0]
+            if kind == 'detections':
+                _, camera_index, timestamp, detections = message
+                for ma_sv, ten_sv, face_location, confidence, face_jpg in detections:
+                    if self.merger.add(camera_index, timestamp, ma_sv, ten_sv, confidence, face_jpg):
+                        newly_seen.append(self.merger.students[ma_sv])
+            elif kind == 'error':
+                logger.error(f"Camera {self.sources[message[1]]}: {message[2]}")
+
+        return newly_seen
+
+    def restart(self):
+        """
+        Dừng và khởi động lại các tiến trình với snapshot gallery/danh sách lớp hiện tại
+
+        Tiến trình con nhận danh sách lớp một lần lúc khởi động, nên cần gọi khi đổi buổi học.
+        Kết quả đã gộp của buổi cũ bị xóa.
+        """
+        running = bool(self._processes)
+        self.stop()
+        self.merger.reset()
+        if running:
+            self.start()
+
+    def stop(self, timeout=5.0):
+        """Dừng toàn bộ tiến trình và giải phóng shared memory"""
+        if self._stop_event is not None:
+            self._stop_event.set()
+
+        # Tiến trình con chỉ thoát khi dữ liệu đã put() được đẩy hết vào pipe: đọc bỏ các
+        # kết quả còn lại trong lúc chờ, nếu không join() có thể chặn đến hết timeout
+        deadline = time.monotonic() + timeout
+        while self._result_queue is not None and time.monotonic() < deadline:
+            if not any(p.is_alive() for p in self._processes):
+                break
+            try:
+                self._result_queue.get(timeout=0.05)
+            except queue.Empty:
+                pass
+
+        for process in self._processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.terminate()
+                process.join(1.0)
+        self._processes = []
+
+        if self._result_queue is not None:
+            self._result_queue.close()
+            self._result_queue.cancel_join_thread()
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+        self._result_queue = None
+        self._stop_event = None
+
+
+def decode_face_image(face_jpg):
+    """Giải mã ảnh khuôn mặt JPEG nhận từ tiến trình con"""
+    if not face_jpg:
+        return None
+    return cv2.imdecode(np.frombuffer(face_jpg, dtype=np.uint8), cv2.IMREAD_COLOR)
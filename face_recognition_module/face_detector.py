@@ -0,0 +1,149 @@
+# face_recognition_module\face_detector.py
+"""
+Bộ phát hiện khuôn mặt dùng chung cho FaceRecognizer và FaceEmbedder.
+
+Phát hiện (HOG) chạy trên frame đã thu nhỏ theo tỉ lệ cấu hình, tọa độ được quy đổi
+về frame gốc để bước mã hóa vẫn chạy ở độ phân giải đầy đủ.
+"""
+import logging
+import os
+import sys
+import time
+
+import cv2
+import face_recognition
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from config import FACE_DETECTION_CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+class FaceDetector:
+    def __init__(self, scale=None, upsample=None, min_face_size=None, model=None):
+        """
+        Args:
+            scale (float): Tỉ lệ thu nhỏ frame trước khi phát hiện (0 < scale <= 1)
+            upsample (int): Số lần upsample của dlib (number_of_times_to_upsample)
+            min_face_size (int): Cạnh nhỏ nhất (pixel, theo frame gốc) để giữ lại khuôn mặt
+            model (str): 'hog' hoặc 'cnn'
+
+        Tham số None sẽ lấy giá trị trong config.FACE_DETECTION_CONFIG.
+        """
+        self.scale = FACE_DETECTION_CONFIG['scale'] if scale is None else scale
+        self.upsample = FACE_DETECTION_CONFIG['upsample'] if upsample is None else upsample
+        self.min_face_size = FACE_DETECTION_CONFIG['min_face_size'] if min_face_size is None else min_face_size
+        self.model = model or FACE_DETECTION_CONFIG['model']
+
+        if not 0.0 < self.scale <= 1.0:
+            raise ValueError(f"scale phải nằm trong (0, 1], nhận được {self.scale}")
+
+    def detect(self, rgb_frame):
+        """
+        Phát hiện khuôn mặt trong frame RGB
+
+        Args:
+            rgb_frame (numpy.array): Frame RGB độ phân giải gốc
+
+        Returns:
+            list: [(top, right, bottom, left), ...] theo tọa độ frame gốc
+        """
+        if self.scale < 1.0:
+            small_frame = cv2.resize(rgb_frame, (0, 0), fx=self.scale, fy=self.scale,
+                                     interpolation=cv2.INTER_AREA)
+        else:
+            small_frame = rgb_frame
+
+        face_locations = face_recognition.face_locations(
+            small_frame,
+            number_of_times_to_upsample=self.upsample,
+            model=self.model
+        )
+        if not face_locations:
+            return []
+
+        height, width = rgb_frame.shape[:2]
+        inv = 1.0 / self.scale
+        results = []
+        for (top, right, bottom, left) in face_locations:
+            # Scale lại tọa độ về kích thước gốc
+            top = max(0, int(round(top * inv)))
+            right = min(width, int(round(right * inv)))
+            bottom = min(height, int(round(bottom * inv)))
+            left = max(0, int(round(left * inv)))
+
+            if min(bottom - top, right - left) < self.min_face_size:
+                continue
+            results.append((top, right, bottom, left))
+        return results
+
+
+def benchmark_scales(frames, scales=(1.0, 0.75, 0.5, 0.33, 0.25), upsample=1, iou_threshold=0.5):
+    """
+    Đo độ trễ và recall phát hiện ở từng tỉ lệ, so với phát hiện ở độ phân giải gốc
+
+    Args:
+        frames (list): Danh sách frame RGB
+        scales (tuple): Các tỉ lệ cần đo
+        upsample (int): Số lần upsample dùng cho mọi tỉ lệ
+        iou_threshold (float): IoU tối thiểu để coi là cùng một khuôn mặt
+
+    Returns:
+        list: Mỗi phần tử là dict {scale, ms_per_frame, faces, recall}
+    """
+    from face_recognition_module.face_tracker import iou
+
+    reference = FaceDetector(scale=1.0, upsample=upsample, min_face_size=0)
+    reference_faces = [reference.detect(frame) for frame in frames]
+    total_reference = sum(len(faces) for faces in reference_faces)
+
+    report = []
+    for scale in scales:
+        detector = FaceDetector(scale=scale, upsample=upsample, min_face_size=0)
+        start = time.perf_counter()
+        detected = [detector.detect(frame) for frame in frames]
+        elapsed = time.perf_counter() - start
+
+        hits = 0
+        for ref_boxes, boxes in zip(reference_faces, detected):
+            hits += sum(1 for ref in ref_boxes if any(iou(ref, box) >= iou_threshold for box in boxes))
+
+        report.append({
+            'scale': scale,
+            'ms_per_frame': round(elapsed * 1000 / max(len(frames), 1), 2),
+            'faces': sum(len(boxes) for boxes in detected),
+            'recall': round(hits / total_reference, 4) if total_reference else None,
+        })
+    return report
+
+
+# --- Benchmark độ trễ / recall theo tỉ lệ phát hiện ---
+# python -m face_recognition_module.face_detector assets/attendance
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Đo độ trễ/recall phát hiện khuôn mặt theo tỉ lệ")
+    parser.add_argument('image_dir', help="Thư mục chứa ảnh (.jpg/.png) để đo")
+    parser.add_argument('--scales', type=float, nargs='+', default=[1.0, 0.75, 0.5, 0.33, 0.25])
+    parser.add_argument('--upsample', type=int, default=1)
+    args = parser.parse_args()
+
+    image_frames = []
+    for root, _, files in os.walk(args.image_dir):
+        for name in sorted(files):
+            if name.lower().endswith(('.jpg', '.jpeg', '.png')):
+                image = cv2.imread(os.path.join(root, name))
+                if image is not None:
+                    image_frames.append(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+
+    if not image_frames:
+        print(f"Không tìm thấy ảnh trong {args.image_dir}")
+        sys.exit(1)
+
+    print(f"Đo trên {len(image_frames)} ảnh, upsample={args.upsample}")
+    print(f"{'scale':>6} {'ms/frame':>10} {'faces':>6} {'recall':>7}")
+    for row in benchmark_scales(image_frames, args.scales, args.upsample):
+        print(f"{row['scale']:>6} {row['ms_per_frame']:>10} {row['faces']:>6} {str(row['recall']):>7}")
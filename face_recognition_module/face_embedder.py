@@ -20,7 +20,12 @@ if project_root not in sys.path:
 
 try:
     from database.student_repository import StudentRepository
-    from config import DB_CONFIG
+    from face_recognition_module.face_detector import FaceDetector
+    from face_recognition_module.face_gallery import FaceGallery
+    from face_recognition_module.face_quality import FaceQualityScorer
+    from face_recognition_module.gallery_cache import default_cache, load_gallery
+    from config import (DB_CONFIG, EMBEDDING_STORAGE, FACE_DETECTION_CONFIG, FACE_QUALITY_CONFIG,
+                        FACE_SEARCH_CONFIG)
 except ImportError as e:
     logger.error(f"Không thể import module cần thiết: {e}")
     raise
@@ -31,8 +36,8 @@ class FaceEmbedder:
         """Khởi tạo FaceEmbedder với các cấu hình tối ưu"""
         try:
             self.student_repo = StudentRepository()
-            self.known_face_encodings = []
-            self.known_face_ids = []
+            self.gallery = FaceGallery(storage=EMBEDDING_STORAGE['gallery'])
+            self.gallery_cache = default_cache()
 
             # Cấu hình camera
             self.camera_width = 640
@@ -41,47 +46,60 @@ class FaceEmbedder:
 
             # Cấu hình face recognition
             self.face_detection_model = 'hog'  # 'hog' nhanh hơn 'cnn' nhưng ít chính xác hơn
+            # Khi đăng ký khuôn mặt ở gần camera: phát hiện trên frame thu nhỏ như trước
+            self.detector = FaceDetector(scale=FACE_DETECTION_CONFIG['enroll_scale'], model=self.face_detection_model)
             self.num_jitters = 1  # Giảm từ mặc định để tăng tốc độ
             self.tolerance = 0.6  # Độ chính xác nhận diện
+            self.min_margin = FACE_SEARCH_CONFIG['min_margin']
+
+            # Cổng chất lượng: bỏ khuôn mặt nhỏ/nhòe/nghiêng trước khi mã hóa
+            self.quality = FaceQualityScorer()
+            # Cổng tắt thì mọi mẫu cùng điểm, thu thêm ứng viên chỉ làm chậm đăng ký
+            self.enroll_candidates = max(1, FACE_QUALITY_CONFIG['enroll_candidates']) if self.quality.enabled else 1
 
             # Threading cho việc xử lý ảnh
             self.processing_lock = threading.Lock()
 
             self.load_known_faces()
 
+            # Embedding mới lưu qua StudentRepository được thêm thẳng vào gallery
+            StudentRepository.add_face_listener(self)
+
         except Exception as e:
             logger.error(f"Lỗi khởi tạo FaceEmbedder: {e}")
             raise
 
+    @property
+    def known_face_encodings(self) -> np.ndarray:
+        return self.gallery.embeddings
+
+    @property
+    def known_face_ids(self) -> List[str]:
+        return self.gallery.student_ids
+
     def load_known_faces(self):
         """
-        Load tất cả embedding khuôn mặt đã lưu từ database vào bộ nhớ.
+        Load tất cả embedding khuôn mặt đã lưu vào bộ nhớ (từ cache trên đĩa nếu còn hợp lệ).
         """
-        self.known_face_encodings = []
-        self.known_face_ids = []
-
         try:
-            raw_data = self.student_repo.get_all_face_embeddings()
-
-            for student_id, embedding_blob in raw_data:
-                try:
-                    embedding_array = np.frombuffer(embedding_blob, dtype=np.float32)
-
-                    if embedding_array.shape != (128,):
-                        logger.warning(f"Embedding sai định dạng cho {student_id}: {embedding_array.shape}")
-                        continue
+            loaded, skipped, source = load_gallery(self.gallery, self.student_repo, self.gallery_cache)
+            if skipped:
+                logger.warning(f"Bỏ qua {skipped} embedding sai định dạng.")
 
-                    self.known_face_encodings.append(embedding_array)
-                    self.known_face_ids.append(student_id)
-
-                except Exception as e:
-                    logger.warning(f"Lỗi khi xử lý embedding cho sinh viên {student_id}: {e}")
-
-            logger.info(f"Đã load {len(self.known_face_encodings)} khuôn mặt từ database.")
+            logger.info(f"Đã load {loaded} khuôn mặt từ {source}.")
 
         except Exception as e:
             logger.error(f"Lỗi khi load known faces từ database: {e}")
 
+    def on_face_embeddings_added(self, student_id: str, embeddings: np.ndarray):
+        """Callback từ StudentRepository: thêm embedding mới mà không load lại toàn bộ"""
+        name = self.gallery.get_student_name(student_id) or student_id
+        self.gallery.add_student(student_id, name, embeddings)
+
+    def on_student_deleted(self, student_id: str):
+        """Callback từ StudentRepository: xóa embedding của sinh viên khỏi gallery"""
+        self.gallery.remove_student(student_id)
+
     def _initialize_camera(self, camera_index: int = 0) -> Optional[cv2.VideoCapture]:
         """
         Khởi tạo camera với các cấu hình tối ưu
@@ -108,38 +126,84 @@ class FaceEmbedder:
 
     def detect_and_encode_faces(self, rgb_frame: np.ndarray) -> List[np.ndarray]:
         """
-        Phát hiện và mã hóa khuôn mặt từ frame RGB
+        Phát hiện và mã hóa khuôn mặt từ frame RGB (chỉ các khuôn mặt qua cổng chất lượng)
         """
-        try:
-            # Giảm kích thước ảnh để tăng tốc độ xử lý
-            small_frame = cv2.resize(rgb_frame, (0, 0), fx=0.5, fy=0.5)
+        return [face['encoding'] for face in self.analyze_frame(rgb_frame, encode='all')
+                if face['encoding'] is not None]
 
-            # Tìm vị trí khuôn mặt
-            face_locations = face_recognition.face_locations(
-                small_frame,
-                model=self.face_detection_model
-            )
+    def analyze_frame(self, rgb_frame: np.ndarray, encode: str = 'best') -> List[dict]:
+        """
+        Một lượt xử lý duy nhất cho mỗi frame: phát hiện (trên ảnh thu nhỏ), điểm mốc 5 điểm
+        (chỉ khi cổng chất lượng bật), chấm điểm chất lượng và mã hóa. Kết quả dùng chung cho việc vẽ khung và lấy mẫu,
+        không cần gọi face_locations lần thứ hai ở độ phân giải đầy đủ.
 
+        Args:
+            rgb_frame: Frame RGB
+            encode: 'best' (chỉ khuôn mặt đạt chất lượng có điểm cao nhất),
+                    'all' (mọi khuôn mặt đạt chất lượng) hoặc 'none'
+
+        Returns:
+            list: [{'location', 'landmarks', 'quality', 'encoding'}, ...]; encoding None nếu không mã hóa
+        """
+        try:
+            face_locations = self.detector.detect(rgb_frame)
             if not face_locations:
                 return []
 
-            # Scale lại tọa độ về kích thước gốc
-            face_locations = [(top * 2, right * 2, bottom * 2, left * 2) for (top, right, bottom, left) in
-                              face_locations]
-
-            # Mã hóa khuôn mặt
-            face_encodings = face_recognition.face_encodings(
-                rgb_frame,
-                face_locations,
-                num_jitters=self.num_jitters
-            )
+            # Điểm mốc chỉ dùng cho ước lượng góc quay của cổng chất lượng
+            if self.quality.enabled and self.quality.check_pose:
+                landmarks = face_recognition.face_landmarks(rgb_frame, face_locations, model='small')
+            else:
+                landmarks = [None] * len(face_locations)
+            qualities = self.quality.score_faces(rgb_frame, face_locations, landmarks)
+            faces = [{'location': loc, 'landmarks': points, 'quality': q, 'encoding': None}
+                     for loc, points, q in zip(face_locations, landmarks, qualities)]
+
+            passed = [face for face in faces if face['quality'].ok]
+            if encode == 'best' and passed:
+                to_encode = [max(passed, key=lambda face: face['quality'].score)]
+            elif encode == 'all':
+                to_encode = passed
+            else:
+                to_encode = []
 
-            return face_encodings
+            if to_encode:
+                encodings = face_recognition.face_encodings(
+                    rgb_frame, [face['location'] for face in to_encode], num_jitters=self.num_jitters)
+                for face, encoding in zip(to_encode, encodings):
+                    face['encoding'] = encoding
+            return faces
 
         except Exception as e:
             logger.error(f"Lỗi khi xử lý khuôn mặt: {e}")
             return []
 
+    def detect_and_encode_best_face(self, rgb_frame: np.ndarray):
+        """
+        Phát hiện khuôn mặt, chấm điểm chất lượng và chỉ mã hóa khuôn mặt tốt nhất
+
+        Returns:
+            tuple: (encoding, quality, face_location) hoặc None nếu không có khuôn mặt đạt
+        """
+        for face in self.analyze_frame(rgb_frame, encode='best'):
+            if face['encoding'] is not None:
+                return face['encoding'], face['quality'], face['location']
+        return None
+
+    @staticmethod
+    def select_best_samples(candidates: list, count: int) -> list:
+        """
+        Chọn các mẫu có điểm chất lượng cao nhất
+
+        Args:
+            candidates (list): [(score, ...), ...]
+            count (int): Số mẫu cần giữ
+
+        Returns:
+            list: Tối đa count mẫu, điểm giảm dần
+        """
+        return sorted(candidates, key=lambda item: item[0], reverse=True)[:count]
+
     def _save_sample_image(self, frame: np.ndarray, student_id: str, sample_num: int, save_path: str) -> str:
         """
         Lưu ảnh mẫu với xử lý lỗi
@@ -198,10 +262,11 @@ class FaceEmbedder:
         if not video_capture:
             return None
 
-        face_embeddings = []
-        samples_collected = 0
+        # Thu nhiều ứng viên hơn số mẫu cần (score, encoding, frame), cuối cùng chỉ lưu các mẫu tốt nhất
+        candidates = []
+        num_candidates = num_samples * self.enroll_candidates
         last_capture_time = 0
-        capture_interval = 1.0  # Khoảng cách tối thiểu giữa các lần chụp (giây)
+        capture_interval = 1.0 / self.enroll_candidates  # Khoảng cách tối thiểu giữa các lần chụp (giây)
 
         logger.info(f"Bắt đầu thu thập {num_samples} mẫu khuôn mặt cho sinh viên {student_id}")
         print(f"\n=== THU THẬP KHUÔN MẶT ===")
@@ -214,7 +279,7 @@ class FaceEmbedder:
         print("- Tự động chụp khi phát hiện khuôn mặt rõ ràng\n")
 
         try:
-            while samples_collected < num_samples:
+            while len(candidates) < num_candidates:
                 ret, frame = video_capture.read()
                 if not ret:
                     logger.error("Không thể đọc khung hình từ camera")
@@ -225,52 +290,41 @@ class FaceEmbedder:
                 # Chuyển đổi màu BGR sang RGB
                 rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
 
-                # Phát hiện và mã hóa khuôn mặt
-                face_encodings = self.detect_and_encode_faces(rgb_frame)
-                face_locations = face_recognition.face_locations(rgb_frame, model=self.face_detection_model)
+                # Một lượt phát hiện + điểm mốc + chất lượng cho cả vẽ khung và lấy mẫu;
+                # chỉ mã hóa khi đã đến lúc chụp ứng viên tiếp theo
+                capture_due = current_time - last_capture_time >= capture_interval
+                faces = self.analyze_frame(rgb_frame, encode='best' if capture_due else 'none')
+                passed = [face for face in faces if face['quality'].ok]
+                best_face = max(passed, key=lambda face: face['quality'].score) if passed else None
 
                 # Vẽ khung hình và thông tin
                 display_frame = frame.copy()
 
-                # Vẽ hình chữ nhật quanh khuôn mặt
-                for (top, right, bottom, left) in face_locations:
-                    cv2.rectangle(display_frame, (left, top), (right, bottom), (0, 255, 0), 2)
-                    cv2.putText(display_frame, "Face Detected", (left, top - 10),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+                # Vẽ hình chữ nhật quanh khuôn mặt (đỏ: không đạt chất lượng)
+                for face in faces:
+                    top, right, bottom, left = face['location']
+                    quality = face['quality']
+                    color = (0, 255, 0) if quality.ok else (0, 0, 255)
+                    label = "Face Detected" if quality.ok else f"Chat luong thap ({quality.reason})"
+                    cv2.rectangle(display_frame, (left, top), (right, bottom), color, 2)
+                    cv2.putText(display_frame, label, (left, top - 10),
+                                cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
 
                 # Hiển thị thông tin trạng thái
-                status_text = f"Mau: {samples_collected}/{num_samples}"
+                status_text = f"Ung vien: {len(candidates)}/{num_candidates}"
                 cv2.putText(display_frame, status_text, (20, 30),
                             cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
 
-                if face_encodings and len(face_encodings) > 0:
-                    cv2.putText(display_frame, "Khuon mat phat hien!", (20, 60),
+                if best_face is not None:
+                    face_encoding, quality = best_face['encoding'], best_face['quality']
+                    cv2.putText(display_frame, f"Khuon mat phat hien! (chat luong {quality.score:.2f})", (20, 60),
                                 cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
 
                     # Tự động chụp nếu đủ thời gian chờ
-                    if current_time - last_capture_time >= capture_interval:
-                        face_encoding = face_encodings[0]  # Lấy khuôn mặt đầu tiên
-
-                        if face_encoding.size == 128:  # Kiểm tra kích thước encoding hợp lệ
-                            # Lưu ảnh
-                            image_path = self._save_sample_image(frame, student_id,
-                                                                 samples_collected + 1, save_path)
-
-                            if image_path:
-                                # Lưu embedding vào CSDL
-                                face_encoding = face_encoding.astype(np.float32)
-                                embedding_blob = face_encoding.tobytes()
-
-                                with self.processing_lock:
-                                    if self.student_repo.add_face_embedding(student_id, image_path, embedding_blob):
-                                        face_embeddings.append(face_encoding)
-                                        samples_collected += 1
-                                        last_capture_time = current_time
-
-                                        print(f"✓ Đã thu thập mẫu {samples_collected}/{num_samples}")
-                                        logger.info(f"Đã lưu embedding mẫu {samples_collected} vào CSDL")
-                                    else:
-                                        logger.error(f"Lỗi khi lưu embedding mẫu {samples_collected + 1} vào CSDL")
+                    if capture_due and face_encoding is not None and face_encoding.size == 128:
+                        candidates.append((quality.score, face_encoding.astype(np.float32), frame.copy()))
+                        last_capture_time = current_time
+                        print(f"✓ Ứng viên {len(candidates)}/{num_candidates} (điểm {quality.score:.2f})")
                 else:
                     cv2.putText(display_frame, "Khong tim thay khuon mat", (20, 60),
                                 cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
@@ -283,7 +337,7 @@ class FaceEmbedder:
                 if key == ord('q'):
                     logger.info("Người dùng đã hủy quá trình thu thập")
                     break
-                elif key == ord('c') and face_encodings:  # Chụp thủ công
+                elif key == ord('c') and best_face is not None:  # Chụp thủ công
                     if current_time - last_capture_time >= 0.5:  # Tránh chụp liên tục
                         logger.info("Chụp thủ công được kích hoạt")
 
@@ -296,14 +350,28 @@ class FaceEmbedder:
             video_capture.release()
             cv2.destroyAllWindows()
 
+        # Chỉ lưu các mẫu có điểm chất lượng cao nhất
+        face_embeddings = []
+        for score, face_encoding, sample_frame in self.select_best_samples(candidates, num_samples):
+            image_path = self._save_sample_image(sample_frame, student_id, len(face_embeddings) + 1, save_path)
+            if not image_path:
+                continue
+            with self.processing_lock:
+                if self.student_repo.add_face_embedding(student_id, image_path, face_encoding.tobytes()):
+                    face_embeddings.append(face_encoding)
+                    logger.info(f"Đã lưu embedding mẫu {len(face_embeddings)} (điểm {score:.2f}) vào CSDL")
+                else:
+                    logger.error(f"Lỗi khi lưu embedding mẫu {len(face_embeddings) + 1} vào CSDL")
+        samples_collected = len(face_embeddings)
+
         # Báo cáo kết quả
         if samples_collected > 0:
             print(f"\n=== KẾT QUÁ ===")
             print(f"✓ Hoàn tất thu thập {samples_collected}/{num_samples} mẫu khuôn mặt cho {student_id}")
             logger.info(f"Thu thập thành công {samples_collected} mẫu khuôn mặt")
 
-            # Cập nhật lại danh sách khuôn mặt đã biết
-            self.load_known_faces()
+            # Gallery đã được cập nhật tăng dần qua StudentRepository.add_face_embedding,
+            # không cần load lại toàn bộ dữ liệu từ database
             return face_embeddings
         else:
             print(f"\n=== THẤT BẠI ===")
@@ -313,7 +381,7 @@ class FaceEmbedder:
 
     def recognize_face(self, face_encoding: np.ndarray) -> Optional[str]:
         """
-        Nhận diện khuôn mặt từ encoding
+        Nhận diện khuôn mặt từ encoding (sinh viên GẦN NHẤT đạt ngưỡng, không phải mẫu khớp đầu tiên)
 
         Args:
             face_encoding: Encoding của khuôn mặt cần nhận diện
@@ -321,34 +389,34 @@ class FaceEmbedder:
         Returns:
             str: Mã sinh viên nếu nhận diện được, None nếu không
         """
-        if not self.known_face_encodings:
-            logger.warning("Chưa có dữ liệu khuôn mặt nào để so sánh")
-            return None
+        results = self.recognize_faces([face_encoding])
+        return results[0] if results else None
 
-        try:
-            # So sánh với tất cả khuôn mặt đã biết
-            matches = face_recognition.compare_faces(
-                self.known_face_encodings,
-                face_encoding,
-                tolerance=self.tolerance
-            )
+    def recognize_faces(self, face_encodings) -> List[Optional[str]]:
+        """
+        Nhận diện cả lô encoding bằng một lần tìm kiếm trên gallery
 
-            if True in matches:
-                match_index = matches.index(True)
-                return self.known_face_ids[match_index]
+        Returns:
+            list: Mã sinh viên (hoặc None) cho mỗi encoding
+        """
+        if len(self.gallery) == 0:
+            logger.warning("Chưa có dữ liệu khuôn mặt nào để so sánh")
+            return [None] * len(face_encodings)
 
-            return None
+        try:
+            results = self.gallery.search(face_encodings, 1, self.tolerance, self.min_margin)
+            return [result.match[0] if result.match else None for result in results]
 
         except Exception as e:
             logger.error(f"Lỗi trong quá trình nhận diện: {e}")
-            return None
+            return [None] * len(face_encodings)
 
     def get_stats(self) -> dict:
         """
         Trả về thống kê về dữ liệu khuôn mặt đã lưu
         """
         return {
-            'total_faces': len(self.known_face_encodings),
+            'total_faces': len(self.gallery),
             'unique_students': len(set(self.known_face_ids)),
             'students_list': list(set(self.known_face_ids))
         }
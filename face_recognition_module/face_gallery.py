@@ -0,0 +1,552 @@
+# face_recognition_module\face_gallery.py
+import logging
+import threading
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from face_recognition_module.face_index import IVFIndex, exact_search
+from face_recognition_module.face_quantization import (
+    EMBEDDING_DIM, STORAGE_DTYPES, check_storage, dequantize, fit_int8_scale, quantize,
+    quantized_dot, row_norms_sq, decode_blob)
+
+logger = logging.getLogger(__name__)
+
+# Số dòng tối thiểu lấy cho mỗi ứng viên cần tìm: mỗi sinh viên có nhiều mẫu, top-k theo dòng
+# phải đủ rộng để còn k sinh viên khác nhau sau khi gộp (xem FaceGallery._search_rows)
+_SEARCH_OVERSAMPLE = 8
+
+
+class SearchResult:
+    """
+    Kết quả tìm kiếm open-set cho một khuôn mặt
+
+    Attributes:
+        candidates (list): Tối đa k ứng viên (ma_sv, ten_sv, distance), mỗi sinh viên một lần, gần nhất trước
+        margin (float): Khoảng cách ứng viên thứ hai trừ ứng viên tốt nhất (inf nếu chỉ có một sinh viên)
+        match (tuple): Ứng viên tốt nhất nếu đạt ngưỡng và margin, ngược lại None (người lạ / mơ hồ)
+    """
+    __slots__ = ('candidates', 'margin', 'match')
+
+    def __init__(self, candidates, margin, match):
+        self.candidates = candidates
+        self.margin = margin
+        self.match = match
+
+    @property
+    def best(self):
+        return self.candidates[0] if self.candidates else None
+
+
+class FaceGallery:
+    """
+    Kho embedding khuôn mặt trong bộ nhớ.
+
+    Toàn bộ embedding được giữ trong một ma trận float32 liên tục kích thước N×128,
+    kèm theo bình phương chuẩn (norm²) của từng dòng được tính sẵn. Nhờ vậy việc so
+    khớp nhiều khuôn mặt cùng lúc chỉ cần một phép nhân ma trận thay vì lặp Python.
+
+    Ma trận được cấp phát dư (capacity) để thêm/xóa embedding của một sinh viên
+    chỉ tốn O(số mẫu) thay vì dựng lại toàn bộ gallery.
+
+    Có thể lưu ở dạng lượng tử 'float16' hoặc 'int8' (xem face_quantization) để giảm
+    2–4 lần bộ nhớ; khoảng cách khi đó được tính trực tiếp trên mã lượng tử.
+    """
+
+    def __init__(self, dim=EMBEDDING_DIM, storage='float32'):
+        self.dim = dim
+        self.storage = check_storage(storage)
+        self.lock = threading.RLock()
+        self._matrix = np.empty((0, dim), dtype=STORAGE_DTYPES[storage])
+        self._scale = None  # Scale theo chiều khi lưu int8
+        self._owns_matrix = True
+        self._norms_sq = np.empty((0,), dtype=np.float32)
+        self._size = 0
+        self._rows_by_student = {}
+        self.student_ids = []
+        self.student_names = []
+
+        # Chỉ mục ANN tùy chọn; chỉ dùng khi được dựng trên đúng phiên bản dữ liệu hiện tại
+        self.version = 0
+        self.index = None
+        self._index_version = None
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, ma_sv):
+        return ma_sv in self._rows_by_student
+
+    @property
+    def embeddings(self):
+        """
+        Ma trận N×128 float32. Với float32 là view trên vùng nhớ đã cấp phát;
+        với kiểu lượng tử là bản giải nén (sao chép) — dùng codes nếu không cần float32.
+        """
+        if self.storage == 'float32':
+            return self._matrix[:self._size]
+        return dequantize(self._matrix[:self._size], self._scale)
+
+    @property
+    def codes(self):
+        """Ma trận N×128 đúng kiểu lưu trữ (float32/float16/int8)"""
+        return self._matrix[:self._size]
+
+    @property
+    def scale(self):
+        """Scale theo chiều (chỉ khi lưu int8, ngược lại None)"""
+        return self._scale
+
+    @property
+    def norms_sq(self):
+        return self._norms_sq[:self._size]
+
+    def set_data(self, student_ids, student_names, embeddings):
+        """
+        Thay thế toàn bộ dữ liệu của gallery
+
+        Args:
+            student_ids (list): Mã sinh viên tương ứng với từng dòng
+            student_names (list): Tên sinh viên tương ứng với từng dòng
+            embeddings (array-like): Ma trận N×128 hoặc danh sách vector 128 chiều
+        """
+        matrix = self._as_matrix(embeddings)
+        scale = fit_int8_scale(matrix) if self.storage == 'int8' and matrix.shape[0] else None
+        self.set_codes(student_ids, student_names, quantize(matrix, self.storage, scale), scale)
+
+    def set_codes(self, student_ids, student_names, codes, scale=None):
+        """
+        Thay thế toàn bộ dữ liệu bằng ma trận mã đã lượng tử sẵn (không lượng tử lại)
+
+        Args:
+            codes (numpy.ndarray): Ma trận N×128 đúng kiểu lưu trữ của gallery
+            scale (numpy.ndarray): Scale theo chiều (bắt buộc với int8)
+        """
+        if codes.dtype != STORAGE_DTYPES[self.storage] or codes.ndim != 2 or codes.shape[1] != self.dim:
+            raise ValueError(f"Ma trận mã phải là N×{self.dim} kiểu {self.storage}, "
+                             f"nhận được {codes.dtype} {codes.shape}")
+        if self.storage == 'int8' and scale is None and codes.shape[0]:
+            raise ValueError("Lưu trữ int8 cần scale theo chiều")
+
+        if not (codes.shape[0] == len(student_ids) == len(student_names)):
+            raise ValueError(
+                f"Số dòng không khớp: {codes.shape[0]} embedding, "
+                f"{len(student_ids)} mã SV, {len(student_names)} tên")
+
+        with self.lock:
+            self._matrix = codes
+            self._owns_matrix = False
+            self._scale = None if scale is None else np.asarray(scale, dtype=np.float32)
+            self._norms_sq = row_norms_sq(codes, self._scale)
+            self._size = codes.shape[0]
+            self.student_ids = list(student_ids)
+            self.student_names = list(student_names)
+            self._rows_by_student = {}
+            for row, ma_sv in enumerate(self.student_ids):
+                self._rows_by_student.setdefault(ma_sv, []).append(row)
+            self.version += 1
+
+    def add_student(self, ma_sv, ten_sv, embeddings):
+        """
+        Thêm embedding của một sinh viên vào cuối gallery (không dựng lại phần còn lại)
+
+        Args:
+            ma_sv (str): Mã sinh viên
+            ten_sv (str): Tên sinh viên
+            embeddings (array-like): Một hoặc nhiều vector 128 chiều
+
+        Returns:
+            int: Số embedding đã thêm
+        """
+        new_rows = self._as_matrix(embeddings)
+        count = new_rows.shape[0]
+        if count == 0:
+            return 0
+
+        with self.lock:
+            if self.storage == 'int8':
+                if self._scale is None:
+                    self._scale = fit_int8_scale(new_rows)
+                elif np.any(np.abs(new_rows).max(axis=0) > 127.0 * self._scale):
+                    # Giá trị mới vượt biên của scale hiện có: nới scale (kèm headroom) và lượng tử
+                    # lại các dòng cũ thay vì cắt ở ±127. Chỉ xảy ra khi dữ liệu vượt biên nên
+                    # chi phí O(N) được chia đều cho nhiều lần thêm.
+                    self._requantize(np.maximum(self._scale, fit_int8_scale(new_rows)))
+            new_codes = quantize(new_rows, self.storage, self._scale)
+
+            self._reserve(self._size + count)
+            start, end = self._size, self._size + count
+            self._matrix[start:end] = new_codes
+            self._norms_sq[start:end] = row_norms_sq(new_codes, self._scale)
+            self._size = end
+
+            self.student_ids.extend([ma_sv] * count)
+            self.student_names.extend([ten_sv] * count)
+            self._rows_by_student.setdefault(ma_sv, []).extend(range(start, end))
+            self.version += 1
+        return count
+
+    def remove_student(self, ma_sv):
+        """
+        Xóa toàn bộ embedding của một sinh viên
+
+        Các dòng bị xóa được lấp bằng dòng cuối cùng của gallery (swap-remove),
+        nên chi phí chỉ phụ thuộc vào số mẫu của sinh viên đó.
+
+        Returns:
+            int: Số embedding đã xóa
+        """
+        with self.lock:
+            rows = self._rows_by_student.pop(ma_sv, None)
+            if not rows:
+                return 0
+            if not self._owns_matrix:
+                # Ma trận do bên ngoài cấp (mảng của người gọi, memory-map cache, shared memory):
+                # sao chép trước khi sửa tại chỗ
+                self._matrix = self._matrix[:self._size].copy()
+                self._owns_matrix = True
+
+            for row in sorted(rows, reverse=True):
+                last = self._size - 1
+                if row != last:
+                    moved_id = self.student_ids[last]
+                    self._matrix[row] = self._matrix[last]
+                    self._norms_sq[row] = self._norms_sq[last]
+                    self.student_ids[row] = moved_id
+                    self.student_names[row] = self.student_names[last]
+
+                    moved_rows = self._rows_by_student[moved_id]
+                    moved_rows[moved_rows.index(last)] = row
+                self.student_ids.pop()
+                self.student_names.pop()
+                self._size = last
+            self.version += 1
+            return len(rows)
+
+    def replace_student(self, ma_sv, ten_sv, embeddings):
+        """Thay thế toàn bộ embedding của một sinh viên bằng tập mới"""
+        with self.lock:
+            self.remove_student(ma_sv)
+            return self.add_student(ma_sv, ten_sv, embeddings)
+
+    def subset(self, student_ids):
+        """
+        Tạo gallery con chỉ gồm embedding của các sinh viên cho trước
+
+        Chỉ sao chép các dòng liên quan (O(số mẫu của các sinh viên này)),
+        dùng cho gallery theo danh sách lớp của một buổi học.
+
+        Args:
+            student_ids (iterable): Mã sinh viên cần giữ lại
+
+        Returns:
+            FaceGallery: Gallery con (sinh viên chưa có khuôn mặt sẽ bị bỏ qua)
+        """
+        with self.lock:
+            rows = []
+            for ma_sv in dict.fromkeys(student_ids):
+                rows.extend(self._rows_by_student.get(ma_sv, ()))
+
+            sub = FaceGallery(self.dim, self.storage)
+            sub.set_codes([self.student_ids[r] for r in rows],
+                          [self.student_names[r] for r in rows],
+                          self._matrix[np.asarray(rows, dtype=np.int64)], self._scale)
+            return sub
+
+    def get_student_name(self, ma_sv):
+        """Trả về tên sinh viên nếu đã có trong gallery, ngược lại None"""
+        with self.lock:
+            rows = self._rows_by_student.get(ma_sv)
+            return self.student_names[rows[0]] if rows else None
+
+    def build_index(self, **index_options):
+        """
+        Dựng chỉ mục IVF (tùy chọn PQ) trên dữ liệu hiện tại của gallery
+
+        Args:
+            **index_options: Tham số truyền cho IVFIndex (nlist, nprobe, pq_m, rerank...)
+
+        Returns:
+            IVFIndex: Chỉ mục vừa dựng
+        """
+        with self.lock:
+            index = IVFIndex(**index_options)
+            index.build(self.embeddings)
+            self.index = index
+            self._index_version = self.version
+            return index
+
+    def set_index(self, index):
+        """
+        Gắn một chỉ mục đã dựng sẵn (ví dụ tải từ file)
+
+        Raises:
+            ValueError: Nếu chỉ mục không được dựng trên đúng dữ liệu gallery hiện tại
+        """
+        with self.lock:
+            if index is not None and not index.matches(self.embeddings):
+                raise ValueError("Chỉ mục không khớp với dữ liệu gallery hiện tại")
+            self.index = index
+            self._index_version = self.version
+
+    @property
+    def index_is_current(self):
+        return self.index is not None and self._index_version == self.version
+
+    def _nearest(self, q, k):
+        """k lân cận gần nhất: dùng chỉ mục nếu còn hợp lệ, ngược lại tìm kiếm chính xác"""
+        if self.index_is_current:
+            return self.index.search(q, self.codes, self.norms_sq, k, scale=self._scale)
+        if self.index is not None:
+            logger.debug("Chỉ mục ANN đã cũ so với gallery, dùng tìm kiếm chính xác.")
+        return exact_search(q, self.codes, self.norms_sq, k, scale=self._scale)
+
+    def _requantize(self, scale):
+        """Lượng tử lại toàn bộ gallery int8 theo scale mới"""
+        scale = np.asarray(scale, dtype=np.float32)
+        codes = quantize(dequantize(self._matrix[:self._size], self._scale), 'int8', scale)
+        capacity = self._matrix.shape[0] if self._owns_matrix else self._size
+        matrix = np.empty((capacity, self.dim), dtype=np.int8)
+        norms_sq = np.empty((capacity,), dtype=np.float32)
+        matrix[:self._size] = codes
+        norms_sq[:self._size] = row_norms_sq(codes, scale)
+        self._matrix = matrix
+        self._owns_matrix = True
+        self._norms_sq = norms_sq
+        self._scale = scale
+        self.version += 1
+
+    def _reserve(self, capacity):
+        if capacity <= self._matrix.shape[0]:
+            return
+        new_capacity = max(capacity, 2 * self._matrix.shape[0], 64)
+        matrix = np.empty((new_capacity, self.dim), dtype=self._matrix.dtype)
+        norms_sq = np.empty((new_capacity,), dtype=np.float32)
+        matrix[:self._size] = self._matrix[:self._size]
+        norms_sq[:self._size] = self._norms_sq[:self._size]
+        self._matrix = matrix
+        self._owns_matrix = True
+        self._norms_sq = norms_sq
+
+    def load_rows(self, rows):
+        """
+        Dựng lại gallery trong một lượt duyệt từ các dòng (MaSV, TenSV, DuLieuMaHoa)
+
+        Các BLOB được nối vào một bytearray rồi chuyển thành ma trận một lần duy nhất,
+        tránh tạo hàng nghìn mảng nhỏ riêng lẻ. BLOB lượng tử (float16/int8, xem
+        face_quantization.decode_blob) được giải mã về float32 trước khi nối.
+
+        Args:
+            rows (iterable): Các dòng (ma_sv, ten_sv, embedding_bytes)
+
+        Returns:
+            tuple: (số dòng nạp thành công, số dòng bị bỏ qua)
+        """
+        row_bytes = self.dim * 4
+        buffer = bytearray()
+        student_ids = []
+        student_names = []
+        skipped = 0
+
+        for ma_sv, ten_sv, blob in rows:
+            if not isinstance(blob, (bytes, bytearray)):
+                logger.warning(f"⚠️ MaSV_FK {ma_sv}: DuLieuMaHoa không hợp lệ. Bỏ qua.")
+                skipped += 1
+                continue
+            if len(blob) != row_bytes:
+                vector = decode_blob(blob) if self.dim == EMBEDDING_DIM else None
+                if vector is None:
+                    logger.warning(f"⚠️ MaSV_FK {ma_sv}: DuLieuMaHoa không hợp lệ. Bỏ qua.")
+                    skipped += 1
+                    continue
+                blob = vector.tobytes()
+            buffer += blob
+            student_ids.append(ma_sv)
+            student_names.append(ten_sv)
+
+        matrix = np.frombuffer(buffer, dtype=np.float32).reshape(-1, self.dim)
+        self.set_data(student_ids, student_names, matrix)
+        return len(student_ids), skipped
+
+    def clear(self):
+        """Xóa toàn bộ dữ liệu trong gallery"""
+        self.set_data([], [], np.empty((0, self.dim), dtype=np.float32))
+
+    def distances(self, queries):
+        """
+        Tính khoảng cách Euclid giữa các khuôn mặt cần tìm và toàn bộ gallery
+
+        Dùng khai triển ||q - g||² = ||q||² + ||g||² - 2·q·g để gom thành một phép GEMM
+        (trên mã lượng tử nếu gallery lưu float16/int8).
+
+        Args:
+            queries (array-like): Ma trận Q×128 (hoặc một vector 128 chiều)
+
+        Returns:
+            numpy.ndarray: Ma trận khoảng cách Q×N (float32)
+        """
+        q = self._as_matrix(queries)
+        with self.lock:
+            if q.shape[0] == 0 or len(self) == 0:
+                return np.empty((q.shape[0], len(self)), dtype=np.float32)
+
+            q_norms_sq = np.einsum('ij,ij->i', q, q)
+            d2 = quantized_dot(q, self.codes, self._scale)
+            d2 *= -2.0
+            d2 += q_norms_sq[:, None]
+            d2 += self.norms_sq[None, :]
+        # Sai số làm tròn có thể cho giá trị âm rất nhỏ
+        np.maximum(d2, 0.0, out=d2)
+        return np.sqrt(d2, out=d2)
+
+    def search(self, queries, k=1, threshold=None, min_margin=0.0):
+        """
+        Tìm kiếm open-set cho nhiều khuôn mặt cùng lúc: top-k sinh viên gần nhất kèm margin
+
+        Một phép tính khoảng cách (GEMM hoặc chỉ mục ANN) cho cả lô query; các dòng gần
+        nhất được gộp theo sinh viên để ứng viên thứ hai là một người KHÁC, nhờ vậy
+        margin đo được mức mơ hồ giữa hai sinh viên chứ không phải giữa hai mẫu.
+
+        Args:
+            queries (array-like): Ma trận Q×128 (hoặc một vector 128 chiều)
+            k (int): Số sinh viên ứng viên trả về cho mỗi query
+            threshold (float): Khoảng cách tối đa để chấp nhận (None = luôn nhận ứng viên tốt nhất)
+            min_margin (float): Margin tối thiểu giữa ứng viên tốt nhất và thứ hai để chấp nhận
+
+        Returns:
+            list: SearchResult cho mỗi query
+        """
+        q = self._as_matrix(queries)
+        k = max(1, int(k))
+        with self.lock:
+            if q.shape[0] == 0:
+                return []
+            if len(self) == 0:
+                return [SearchResult([], float('inf'), None) for _ in range(q.shape[0])]
+
+            # Luôn tìm ít nhất 2 sinh viên để margin có nghĩa kể cả khi k=1 / min_margin=0
+            needed = max(k, 2)
+            idx, dist = self._nearest(q, self._search_rows(needed))
+
+            results = []
+            for row_idx, row_dist in zip(idx.tolist(), dist.tolist()):
+                candidates = []
+                seen = set()
+                for i, d in zip(row_idx, row_dist):
+                    if i < 0:
+                        break
+                    ma_sv = self.student_ids[i]
+                    if ma_sv in seen:
+                        continue
+                    seen.add(ma_sv)
+                    candidates.append((ma_sv, self.student_names[i], d))
+                    if len(candidates) == needed:
+                        break
+
+                margin = candidates[1][2] - candidates[0][2] if len(candidates) > 1 else float('inf')
+                best = candidates[0] if candidates else None
+                accepted = (best is not None and (threshold is None or best[2] < threshold)
+                            and margin >= min_margin)
+                results.append(SearchResult(candidates[:k], margin, best if accepted else None))
+            return results
+
+    def _search_rows(self, students):
+        """
+        Số dòng top-k cần lấy để chắc chắn có đủ `students` sinh viên khác nhau: trường hợp xấu
+        nhất các dòng gần nhất thuộc về (students - 1) sinh viên có nhiều mẫu nhất
+        """
+        most_samples = max((len(rows) for rows in self._rows_by_student.values()), default=1)
+        return min(len(self), max(students * _SEARCH_OVERSAMPLE, (students - 1) * most_samples + 1))
+
+    def match(self, queries, threshold, min_margin=0.0):
+        """
+        Tìm khuôn mặt gần nhất trong gallery cho nhiều khuôn mặt cùng lúc
+
+        Args:
+            queries (array-like): Ma trận Q×128 các embedding cần nhận diện
+            threshold (float): Ngưỡng khoảng cách tối đa để chấp nhận
+            min_margin (float): Margin tối thiểu so với sinh viên gần thứ hai (0 = không xét)
+
+        Returns:
+            list: Với mỗi query, (ma_sv, ten_sv, distance) nếu được chấp nhận, ngược lại None
+        """
+        return [result.match for result in self.search(queries, 1, threshold, min_margin)]
+
+    def _as_matrix(self, data):
+        matrix = np.asarray(data, dtype=np.float32)
+        if matrix.ndim == 1:
+            matrix = matrix.reshape(-1, self.dim) if matrix.size else matrix.reshape(0, self.dim)
+        if matrix.ndim != 2 or matrix.shape[1] != self.dim:
+            raise ValueError(f"Embedding phải có {self.dim} chiều, nhận được shape {matrix.shape}")
+        return np.ascontiguousarray(matrix)
+
+
+def share_gallery(gallery):
+    """
+    Sao chép gallery vào shared memory để các tiến trình con đọc chung (không sao chép lại)
+
+    Returns:
+        tuple: (SharedMemory hoặc None, spec) — spec là dict picklable truyền cho attach_gallery;
+               tiến trình cha phải close() và unlink() SharedMemory khi xong
+    """
+    with gallery.lock:
+        codes = gallery.codes
+        spec = {
+            'shm_name': None,
+            'shape': codes.shape,
+            'storage': gallery.storage,
+            'scale': None if gallery.scale is None else gallery.scale.tolist(),
+            'student_ids': list(gallery.student_ids),
+            'student_names': list(gallery.student_names),
+        }
+        shm = None
+        if codes.size:
+            shm = shared_memory.SharedMemory(create=True, size=codes.nbytes)
+            np.ndarray(codes.shape, dtype=codes.dtype, buffer=shm.buf)[:] = codes
+            spec['shm_name'] = shm.name
+    return shm, spec
+
+
+_attach_lock = threading.Lock()
+
+
+def _attach_shared_memory(name):
+    """
+    Mở vùng shared memory do tiến trình khác sở hữu mà không đăng ký với resource_tracker
+
+    Trước Python 3.13, SharedMemory(name=...) luôn đăng ký vùng nhớ với resource_tracker; nếu
+    tracker thuộc riêng tiến trình con, vùng nhớ có thể bị unlink (kèm cảnh báo "leaked
+    shared_memory") khi tiến trình con thoát trong khi tiến trình cha vẫn dùng. Không gọi
+    unregister sau khi mở: với spawn, tiến trình con dùng chung tracker của cha nên unregister
+    sẽ xóa luôn đăng ký của cha.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        pass
+    with _attach_lock:
+        register = resource_tracker.register
+        resource_tracker.register = lambda *args: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+def attach_gallery(spec):
+    """
+    Dựng FaceGallery trên vùng shared memory do share_gallery tạo (chỉ đọc, không sao chép)
+
+    Returns:
+        tuple: (SharedMemory hoặc None, FaceGallery) — tiến trình con close() SharedMemory khi xong
+    """
+    storage = spec.get('storage', 'float32')
+    gallery = FaceGallery(storage=storage)
+    if not spec['shm_name']:
+        return None, gallery
+
+    shm = _attach_shared_memory(spec['shm_name'])
+    codes = np.ndarray(spec['shape'], dtype=STORAGE_DTYPES[storage], buffer=shm.buf)
+    scale = None if spec.get('scale') is None else np.asarray(spec['scale'], dtype=np.float32)
+    gallery.set_codes(spec['student_ids'], spec['student_names'], codes, scale)
+    return shm, gallery
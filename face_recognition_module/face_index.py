@@ -0,0 +1,371 @@
+# face_recognition_module\face_index.py
+"""
+Chỉ mục tìm kiếm lân cận gần đúng (ANN) cho gallery khuôn mặt lớn.
+
+IVFIndex chia không gian embedding thành nlist cụm bằng k-means (coarse quantizer),
+mỗi cụm giữ một danh sách đảo (inverted list) các dòng thuộc cụm đó. Khi tìm kiếm
+chỉ quét nprobe cụm gần nhất thay vì toàn bộ gallery. Tùy chọn nén thêm bằng
+product quantization (PQ) rồi xếp hạng lại chính xác (re-rank) các ứng viên tốt nhất
+trên ma trận float32 gốc.
+
+Chỉ dùng NumPy, không phụ thuộc thư viện ngoài.
+"""
+import json
+import logging
+import time
+
+import numpy as np
+
+from face_recognition_module.face_quantization import dequantize, quantized_dot
+
+logger = logging.getLogger(__name__)
+
+# Số dòng tối đa mỗi lần gán cụm, tránh tạo ma trận khoảng cách quá lớn
+_ASSIGN_CHUNK = 16384
+
+
+def _squared_distances(data, centroids, centroid_norms_sq=None):
+    if centroid_norms_sq is None:
+        centroid_norms_sq = np.einsum('ij,ij->i', centroids, centroids)
+    d2 = data @ centroids.T
+    d2 *= -2.0
+    d2 += np.einsum('ij,ij->i', data, data)[:, None]
+    d2 += centroid_norms_sq[None, :]
+    np.maximum(d2, 0.0, out=d2)
+    return d2
+
+
+def _assign(data, centroids):
+    """Gán mỗi dòng của data vào centroid gần nhất (xử lý theo từng khối)"""
+    centroid_norms_sq = np.einsum('ij,ij->i', centroids, centroids)
+    labels = np.empty(data.shape[0], dtype=np.int64)
+    for start in range(0, data.shape[0], _ASSIGN_CHUNK):
+        chunk = data[start:start + _ASSIGN_CHUNK]
+        labels[start:start + chunk.shape[0]] = np.argmin(
+            _squared_distances(chunk, centroids, centroid_norms_sq), axis=1)
+    return labels
+
+
+def kmeans(data, k, n_iter=15, seed=0, max_train_points=None):
+    """
+    Phân cụm k-means (Lloyd) thuần NumPy
+
+    Args:
+        data (numpy.ndarray): Ma trận N×D float32
+        k (int): Số cụm
+        n_iter (int): Số vòng lặp
+        seed (int): Seed cho bộ sinh ngẫu nhiên
+        max_train_points (int): Giới hạn số điểm dùng để huấn luyện (lấy mẫu ngẫu nhiên)
+
+    Returns:
+        numpy.ndarray: Ma trận centroid k×D float32
+    """
+    rng = np.random.default_rng(seed)
+    n = data.shape[0]
+    k = max(1, min(k, n))
+
+    if max_train_points and n > max_train_points:
+        data = data[rng.choice(n, max_train_points, replace=False)]
+        n = data.shape[0]
+
+    centroids = data[rng.choice(n, k, replace=False)].astype(np.float32, copy=True)
+
+    for _ in range(n_iter):
+        labels = _assign(data, centroids)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, data)
+
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # Cụm rỗng được khởi tạo lại bằng một điểm ngẫu nhiên
+        if empty.any():
+            centroids[empty] = data[rng.choice(n, int(empty.sum()), replace=False)]
+
+    return centroids
+
+
+class IVFIndex:
+    """
+    Chỉ mục IVF (inverted file) với tùy chọn nén PQ và re-rank chính xác
+
+    Chỉ mục lưu chỉ số dòng của gallery, không sở hữu dữ liệu float32 gốc:
+    ma trận embedding được truyền vào khi tìm kiếm để re-rank.
+    """
+
+    def __init__(self, nlist=None, nprobe=8, pq_m=0, rerank=64, n_iter=15, seed=0):
+        """
+        Args:
+            nlist (int): Số cụm thô (mặc định ~4·sqrt(N))
+            nprobe (int): Số cụm được quét khi tìm kiếm
+            pq_m (int): Số sub-quantizer PQ (0 = không nén, phải chia hết 128)
+            rerank (int): Số ứng viên PQ được xếp hạng lại bằng khoảng cách chính xác
+            n_iter (int): Số vòng lặp k-means
+            seed (int): Seed ngẫu nhiên
+        """
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.pq_m = pq_m
+        self.rerank = rerank
+        self.n_iter = n_iter
+        self.seed = seed
+
+        self.size = 0
+        self.fingerprint = 0.0
+        self.centroids = None
+        self.list_offsets = None
+        self.list_ids = None
+        self.pq_codebooks = None
+        self.pq_codes = None
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def build(self, vectors):
+        """
+        Huấn luyện coarse quantizer (và PQ nếu bật) rồi dựng danh sách đảo
+
+        Args:
+            vectors (numpy.ndarray): Ma trận N×128 float32 của gallery
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        n, dim = vectors.shape
+        if n == 0:
+            raise ValueError("Không thể dựng chỉ mục cho gallery rỗng")
+
+        start = time.perf_counter()
+        nlist = self.nlist or int(4 * np.sqrt(n))
+        nlist = max(1, min(nlist, n))
+        self.nlist = nlist
+
+        self.centroids = kmeans(vectors, nlist, self.n_iter, self.seed,
+                                max_train_points=max(256 * nlist, 10000))
+        labels = _assign(vectors, self.centroids)
+
+        order = np.argsort(labels, kind='stable')
+        counts = np.bincount(labels, minlength=nlist)
+        self.list_offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        self.list_ids = order.astype(np.int64)
+
+        if self.pq_m:
+            self._train_pq(vectors)
+            self.pq_codes = self._encode_pq(vectors[self.list_ids])
+
+        self.size = n
+        self.fingerprint = self.compute_fingerprint(vectors)
+        logger.info(f"Đã dựng IVFIndex: {n} vector, {nlist} cụm, PQ m={self.pq_m} "
+                    f"({time.perf_counter() - start:.2f}s)")
+
+    def search(self, queries, vectors, norms_sq, k=1, scale=None):
+        """
+        Tìm k lân cận gần nhất cho nhiều query
+
+        Args:
+            queries (numpy.ndarray): Ma trận Q×128 float32
+            vectors (numpy.ndarray): Ma trận N×128 của gallery (float32 hoặc mã lượng tử, dùng để re-rank)
+            norms_sq (numpy.ndarray): Bình phương chuẩn của từng dòng gallery
+            k (int): Số lân cận cần lấy
+            scale (numpy.ndarray): Scale theo chiều nếu vectors là int8
+
+        Returns:
+            tuple: (indices Q×k int64, distances Q×k float32); thiếu ứng viên thì index = -1, distance = inf
+        """
+        num_queries = queries.shape[0]
+        out_idx = np.full((num_queries, k), -1, dtype=np.int64)
+        out_dist = np.full((num_queries, k), np.inf, dtype=np.float32)
+        if num_queries == 0:
+            return out_idx, out_dist
+
+        nprobe = min(self.nprobe, self.nlist)
+        coarse = _squared_distances(queries, self.centroids)
+        probes = np.argpartition(coarse, nprobe - 1, axis=1)[:, :nprobe]
+        q_norms_sq = np.einsum('ij,ij->i', queries, queries)
+
+        for qi in range(num_queries):
+            positions = np.concatenate([
+                np.arange(self.list_offsets[c], self.list_offsets[c + 1]) for c in probes[qi]])
+            if positions.size == 0:
+                continue
+
+            if self.pq_codes is not None:
+                approx = self._adc_distances(queries[qi], self.pq_codes[positions])
+                keep = min(max(self.rerank, k), positions.size)
+                positions = positions[np.argpartition(approx, keep - 1)[:keep]]
+
+            candidates = self.list_ids[positions]
+            candidate_vectors = vectors[candidates]
+            if candidate_vectors.dtype != np.float32:
+                candidate_vectors = dequantize(candidate_vectors, scale)
+            d2 = q_norms_sq[qi] + norms_sq[candidates] - 2.0 * (candidate_vectors @ queries[qi])
+            np.maximum(d2, 0.0, out=d2)
+
+            top = min(k, candidates.size)
+            best = np.argpartition(d2, top - 1)[:top]
+            best = best[np.argsort(d2[best])]
+            out_idx[qi, :top] = candidates[best]
+            out_dist[qi, :top] = np.sqrt(d2[best])
+
+        return out_idx, out_dist
+
+    # --- Product quantization ---
+    def _train_pq(self, vectors):
+        dim = vectors.shape[1]
+        if dim % self.pq_m:
+            raise ValueError(f"pq_m={self.pq_m} phải chia hết số chiều {dim}")
+        dsub = dim // self.pq_m
+        ksub = min(256, vectors.shape[0])
+
+        self.pq_codebooks = np.stack([
+            kmeans(np.ascontiguousarray(vectors[:, j * dsub:(j + 1) * dsub]), ksub, self.n_iter,
+                   self.seed + j, max_train_points=256 * ksub)
+            for j in range(self.pq_m)])
+
+    def _encode_pq(self, vectors):
+        dsub = self.pq_codebooks.shape[2]
+        codes = np.empty((vectors.shape[0], self.pq_m), dtype=np.uint8)
+        for j in range(self.pq_m):
+            sub = np.ascontiguousarray(vectors[:, j * dsub:(j + 1) * dsub])
+            codes[:, j] = _assign(sub, self.pq_codebooks[j])
+        return codes
+
+    def _adc_distances(self, query, codes):
+        """Khoảng cách bất đối xứng (ADC): tra bảng thay vì giải nén vector"""
+        dsub = self.pq_codebooks.shape[2]
+        sub_queries = query.reshape(self.pq_m, 1, dsub)
+        table = ((self.pq_codebooks - sub_queries) ** 2).sum(axis=2)  # m×ksub
+        return table[np.arange(self.pq_m), codes].sum(axis=1)
+
+    # --- Lưu / tải ---
+    @staticmethod
+    def compute_fingerprint(vectors):
+        """Dấu vân tay rẻ của gallery để phát hiện chỉ mục không còn khớp dữ liệu"""
+        return float(np.asarray(vectors, dtype=np.float64).sum())
+
+    def save(self, path):
+        """Lưu chỉ mục ra file .npz"""
+        if not self.is_trained:
+            raise ValueError("Chỉ mục chưa được dựng")
+
+        meta = {
+            'nlist': self.nlist, 'nprobe': self.nprobe, 'pq_m': self.pq_m, 'rerank': self.rerank,
+            'n_iter': self.n_iter, 'seed': self.seed, 'size': self.size, 'fingerprint': self.fingerprint,
+        }
+        arrays = {
+            'meta': np.array(json.dumps(meta)),
+            'centroids': self.centroids,
+            'list_offsets': self.list_offsets,
+            'list_ids': self.list_ids,
+        }
+        if self.pq_codes is not None:
+            arrays['pq_codebooks'] = self.pq_codebooks
+            arrays['pq_codes'] = self.pq_codes
+        np.savez(path, **arrays)
+        logger.info(f"Đã lưu IVFIndex vào {path}")
+
+    @classmethod
+    def load(cls, path):
+        """Tải chỉ mục từ file .npz đã lưu bằng save()"""
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            index = cls(nlist=meta['nlist'], nprobe=meta['nprobe'], pq_m=meta['pq_m'],
+                        rerank=meta['rerank'], n_iter=meta['n_iter'], seed=meta['seed'])
+            index.size = meta['size']
+            index.fingerprint = meta['fingerprint']
+            index.centroids = data['centroids']
+            index.list_offsets = data['list_offsets']
+            index.list_ids = data['list_ids']
+            if 'pq_codes' in data:
+                index.pq_codebooks = data['pq_codebooks']
+                index.pq_codes = data['pq_codes']
+        return index
+
+    def matches(self, vectors):
+        """Kiểm tra chỉ mục có được dựng trên đúng ma trận gallery này không"""
+        return (self.is_trained and vectors.shape[0] == self.size
+                and np.isclose(self.compute_fingerprint(vectors), self.fingerprint, rtol=1e-9))
+
+
+def exact_search(queries, vectors, norms_sq, k=1, scale=None):
+    """Tìm kiếm chính xác (brute-force); vectors có thể là mã lượng tử float16/int8 (kèm scale)"""
+    d2 = quantized_dot(queries, vectors, scale)
+    d2 *= -2.0
+    d2 += np.einsum('ij,ij->i', queries, queries)[:, None]
+    d2 += norms_sq[None, :]
+    np.maximum(d2, 0.0, out=d2)
+    rows = np.arange(queries.shape[0])[:, None]
+    if k == 1:
+        idx = np.argmin(d2, axis=1)[:, None]
+        return idx, np.sqrt(d2[rows, idx])
+
+    k = min(k, vectors.shape[0])
+    idx = np.argpartition(d2, k - 1, axis=1)[:, :k]
+    order = np.argsort(d2[rows, idx], axis=1)
+    idx = idx[rows, order]
+    return idx, np.sqrt(d2[rows, idx])
+
+
+def evaluate_index(index, vectors, queries, k=1, repeats=3):
+    """
+    So sánh recall và độ trễ của chỉ mục với tìm kiếm chính xác
+
+    Returns:
+        dict: recall@k, thời gian trung bình mỗi query (ms) của hai phương pháp và tỉ lệ tăng tốc
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    norms_sq = np.einsum('ij,ij->i', vectors, vectors)
+
+    def timed(fn):
+        best = float('inf')
+        result = None
+        for _ in range(repeats):
+            start = time.perf_counter()
+            result = fn()
+            best = min(best, time.perf_counter() - start)
+        return result, best
+
+    (exact_idx, _), exact_time = timed(lambda: exact_search(queries, vectors, norms_sq, k))
+    (ann_idx, _), ann_time = timed(lambda: index.search(queries, vectors, norms_sq, k))
+
+    hits = sum(len(set(exact_idx[i]) & set(ann_idx[i])) for i in range(queries.shape[0]))
+    num_queries = max(queries.shape[0], 1)
+    return {
+        'gallery_size': vectors.shape[0],
+        'queries': queries.shape[0],
+        'k': k,
+        'nlist': index.nlist,
+        'nprobe': index.nprobe,
+        'pq_m': index.pq_m,
+        'recall': round(hits / (num_queries * k), 4),
+        'exact_ms_per_query': round(exact_time * 1000 / num_queries, 4),
+        'index_ms_per_query': round(ann_time * 1000 / num_queries, 4),
+        'speedup': round(exact_time / ann_time, 2) if ann_time else None,
+    }
+
+
+# --- Báo cáo recall/độ trễ trên gallery tổng hợp ---
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="So sánh IVFIndex với tìm kiếm chính xác")
+    parser.add_argument('--size', type=int, default=200000, help="Số embedding trong gallery")
+    parser.add_argument('--queries', type=int, default=200, help="Số query")
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[4, 8, 16])
+    parser.add_argument('--pq-m', type=int, default=0, help="Số sub-quantizer PQ (0 = tắt)")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    # Gallery giả lập: mỗi "sinh viên" có 5 mẫu quanh một tâm
+    num_students = max(1, args.size // 5)
+    centers = rng.normal(0, 0.1, (num_students, 128)).astype(np.float32)
+    gallery = np.repeat(centers, 5, axis=0)[:args.size]
+    gallery += rng.normal(0, 0.02, gallery.shape).astype(np.float32)
+    query_set = gallery[rng.choice(gallery.shape[0], args.queries, replace=False)]
+    query_set = query_set + rng.normal(0, 0.02, query_set.shape).astype(np.float32)
+
+    ivf = IVFIndex(pq_m=args.pq_m)
+    ivf.build(gallery)
+    for nprobe in args.nprobe:
+        ivf.nprobe = nprobe
+        print(evaluate_index(ivf, gallery, query_set, k=1))
@@ -0,0 +1,136 @@
+# face_recognition_module\face_quality.py
+"""
+Chấm điểm chất lượng khuôn mặt trước khi mã hóa.
+
+Mã hóa (face_encodings) là bước tốn kém thứ hai sau phát hiện, trong khi khuôn mặt quá
+nhỏ, bị nhòe hoặc quay nghiêng gần như không bao giờ khớp tốt. FaceQualityScorer kiểm
+tra rẻ trước theo thứ tự chi phí tăng dần:
+    1. Kích thước khung (so sánh số nguyên)
+    2. Độ nét: phương sai Laplacian trên ảnh xám đã chuẩn hóa kích thước
+    3. Góc quay ngang (yaw) ước lượng từ 5 điểm mốc (mũi lệch so với trung điểm hai mắt)
+Khuôn mặt không đạt bị bỏ qua / hoãn sang frame sau; khi đăng ký, điểm tổng hợp được
+dùng để chỉ giữ các mẫu tốt nhất.
+"""
+import os
+import sys
+
+import cv2
+import face_recognition
+import numpy as np
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from config import FACE_QUALITY_CONFIG
+
+# Kích thước chuẩn hóa trước khi đo độ nét, để ngưỡng không phụ thuộc kích thước khuôn mặt
+_BLUR_SIZE = 96
+
+
+class FaceQuality:
+    """Kết quả chấm điểm một khuôn mặt"""
+    __slots__ = ('ok', 'score', 'size', 'blur', 'yaw', 'reason')
+
+    def __init__(self, ok, score, size, blur=None, yaw=None, reason=None):
+        self.ok = ok
+        self.score = score
+        self.size = size
+        self.blur = blur
+        self.yaw = yaw
+        self.reason = reason
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class FaceQualityScorer:
+    def __init__(self, enabled=None, min_face_size=None, min_blur=None, max_yaw=None, check_pose=None):
+        """
+        Args:
+            enabled (bool): Tắt để mọi khuôn mặt đều đạt (giữ hành vi cũ)
+            min_face_size (int): Cạnh ngắn nhất của khung (pixel)
+            min_blur (float): Phương sai Laplacian tối thiểu (càng nhỏ càng nhòe)
+            max_yaw (float): Độ lệch mũi/khoảng cách hai mắt tối đa (~0 nhìn thẳng, >0.5 gần nghiêng hẳn)
+            check_pose (bool): Ước lượng góc quay bằng điểm mốc (tốn thêm ~1 ms mỗi khuôn mặt)
+
+        Tham số None sẽ lấy giá trị trong config.FACE_QUALITY_CONFIG.
+        """
+        config = FACE_QUALITY_CONFIG
+        self.enabled = config['enabled'] if enabled is None else enabled
+        self.min_face_size = config['min_face_size'] if min_face_size is None else min_face_size
+        self.min_blur = config['min_blur'] if min_blur is None else min_blur
+        self.max_yaw = config['max_yaw'] if max_yaw is None else max_yaw
+        self.check_pose = config['check_pose'] if check_pose is None else check_pose
+
+    def score(self, rgb_frame, face_location, landmarks=None):
+        """
+        Chấm điểm một khuôn mặt
+
+        Args:
+            rgb_frame (numpy.array): Frame RGB
+            face_location (tuple): (top, right, bottom, left)
+            landmarks (dict): Điểm mốc 5 điểm đã tính sẵn (face_landmarks(model='small')),
+                              None thì tự tính khi cần ước lượng góc quay
+
+        Returns:
+            FaceQuality: ok=False kèm lý do nếu không đạt; score trong [0, 1]
+        """
+        top, right, bottom, left = face_location
+        size = min(bottom - top, right - left)
+        if not self.enabled:
+            return FaceQuality(True, 1.0, size)
+
+        if size < self.min_face_size:
+            return FaceQuality(False, 0.0, size, reason='small')
+
+        crop = rgb_frame[max(top, 0):bottom, max(left, 0):right]
+        if crop.size == 0:
+            return FaceQuality(False, 0.0, size, reason='small')
+        gray = cv2.cvtColor(crop, cv2.COLOR_RGB2GRAY)
+        gray = cv2.resize(gray, (_BLUR_SIZE, _BLUR_SIZE), interpolation=cv2.INTER_AREA)
+        blur = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+        if blur < self.min_blur:
+            return FaceQuality(False, 0.0, size, blur=round(blur, 1), reason='blur')
+
+        yaw = None
+        if self.check_pose:
+            if landmarks is None:
+                found = face_recognition.face_landmarks(rgb_frame, [face_location], model='small')
+                landmarks = found[0] if found else None
+            yaw = yaw_from_landmarks(landmarks)
+            if yaw is not None and abs(yaw) > self.max_yaw:
+                return FaceQuality(False, 0.0, size, round(blur, 1), round(yaw, 3), reason='pose')
+
+        # Điểm tổng hợp: mỗi thành phần bão hòa ở mức gấp đôi ngưỡng
+        size_term = min(1.0, size / (2.0 * max(self.min_face_size, 1)))
+        blur_term = min(1.0, blur / (2.0 * max(self.min_blur, 1e-6)))
+        pose_term = 1.0 if yaw is None else max(0.0, 1.0 - abs(yaw) / max(self.max_yaw, 1e-6))
+        score = size_term * blur_term * (0.5 + 0.5 * pose_term)
+        return FaceQuality(True, round(score, 4), size, round(blur, 1),
+                           None if yaw is None else round(yaw, 3))
+
+    def score_faces(self, rgb_frame, face_locations, landmarks=None):
+        """Chấm điểm nhiều khuôn mặt, trả về danh sách FaceQuality theo cùng thứ tự"""
+        landmarks = landmarks or [None] * len(face_locations)
+        return [self.score(rgb_frame, location, points) for location, points in zip(face_locations, landmarks)]
+
+
+def yaw_from_landmarks(points):
+    """
+    Yaw xấp xỉ = (x mũi - x trung điểm hai mắt) / khoảng cách hai mắt, từ mô hình 5 điểm
+    của dlib. Trả về None nếu không có điểm mốc.
+    """
+    if not points:
+        return None
+    try:
+        left_eye = np.mean(points['left_eye'], axis=0)
+        right_eye = np.mean(points['right_eye'], axis=0)
+        nose = np.mean(points['nose_tip'], axis=0)
+    except KeyError:
+        return None
+
+    eye_distance = float(np.linalg.norm(right_eye - left_eye))
+    if eye_distance < 1.0:
+        return None
+    return float(nose[0] - (left_eye[0] + right_eye[0]) / 2.0) / eye_distance
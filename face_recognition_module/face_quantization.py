@@ -0,0 +1,235 @@
+# face_recognition_module\face_quantization.py
+"""
+Lưu trữ và so khớp embedding khuôn mặt ở dạng lượng tử hóa.
+
+Hỗ trợ ba kiểu lưu trữ cho gallery trong bộ nhớ:
+    - 'float32': 512 byte/mẫu (mặc định, như trước)
+    - 'float16': 256 byte/mẫu
+    - 'int8'   : 128 byte/mẫu, mỗi chiều d có hệ số scale[d] riêng (x ≈ code * scale)
+
+Phép so khớp làm việc trực tiếp trên mã lượng tử: với int8, q·g = (q∘scale)·code nên chỉ
+cần nhân query với scale một lần, sau đó nhân ma trận với các khối code (giải nén từng
+khối nhỏ vừa cache, không bao giờ giữ bản float32 của cả gallery).
+
+BLOB trong KhuonMat được nhận dạng theo độ dài:
+    - 512 byte: float32
+    - 256 byte: float16
+    - 132 byte: int8 + một hệ số scale float32 cho vector đó (scale theo chiều cần thống kê
+      trên cả gallery nên không lưu được trong từng dòng)
+"""
+import time
+
+import numpy as np
+
+EMBEDDING_DIM = 128
+STORAGE_DTYPES = {
+    'float32': np.float32,
+    'float16': np.float16,
+    'int8': np.int8,
+}
+
+# Số dòng gallery giải nén mỗi lần khi so khớp trên dữ liệu lượng tử
+_DOT_CHUNK = 16384
+# Dư biên khi ước lượng scale int8 để embedding thêm sau ít bị cắt (clip)
+_INT8_HEADROOM = 1.25
+
+
+def check_storage(storage):
+    if storage not in STORAGE_DTYPES:
+        raise ValueError(f"Kiểu lưu trữ không hỗ trợ: {storage} (chọn {', '.join(STORAGE_DTYPES)})")
+    return storage
+
+
+def fit_int8_scale(matrix, headroom=_INT8_HEADROOM):
+    """
+    Ước lượng hệ số scale theo từng chiều cho lượng tử hóa int8 đối xứng
+
+    Returns:
+        numpy.ndarray: Vector scale float32 kích thước D
+    """
+    if matrix.shape[0] == 0:
+        return np.full(matrix.shape[1], 0.5 / 127.0, dtype=np.float32)
+    max_abs = np.abs(matrix).max(axis=0) * headroom
+    return np.maximum(max_abs / 127.0, 1e-6).astype(np.float32)
+
+
+def quantize(matrix, storage, scale=None):
+    """
+    Chuyển ma trận float32 sang kiểu lưu trữ
+
+    Args:
+        matrix (numpy.ndarray): Ma trận N×D float32
+        storage (str): 'float32' | 'float16' | 'int8'
+        scale (numpy.ndarray): Scale theo chiều (bắt buộc với int8)
+
+    Returns:
+        numpy.ndarray: Ma trận mã N×D
+    """
+    if storage == 'int8':
+        codes = np.rint(matrix / scale)
+        np.clip(codes, -127, 127, out=codes)
+        return codes.astype(np.int8)
+    return np.ascontiguousarray(matrix, dtype=STORAGE_DTYPES[storage])
+
+
+def dequantize(codes, scale=None):
+    """Giải nén ma trận mã về float32"""
+    if codes.dtype == np.int8:
+        return codes.astype(np.float32) * scale
+    return np.asarray(codes, dtype=np.float32)
+
+
+def quantized_dot(queries, codes, scale=None):
+    """
+    Tích vô hướng Q×N giữa các query float32 và gallery đã lượng tử
+
+    Args:
+        queries (numpy.ndarray): Ma trận Q×D float32
+        codes (numpy.ndarray): Ma trận N×D (float32, float16 hoặc int8)
+        scale (numpy.ndarray): Scale theo chiều nếu codes là int8
+
+    Returns:
+        numpy.ndarray: Ma trận Q×N float32
+    """
+    if codes.dtype == np.float32:
+        return queries @ codes.T
+
+    if codes.dtype == np.int8:
+        queries = queries * scale  # q·(code∘scale) = (q∘scale)·code
+    out = np.empty((queries.shape[0], codes.shape[0]), dtype=np.float32)
+    for start in range(0, codes.shape[0], _DOT_CHUNK):
+        block = codes[start:start + _DOT_CHUNK].astype(np.float32)
+        out[:, start:start + block.shape[0]] = queries @ block.T
+    return out
+
+
+def row_norms_sq(codes, scale=None):
+    """Bình phương chuẩn của từng dòng (tính trên giá trị đã giải nén, theo từng khối)"""
+    norms_sq = np.empty(codes.shape[0], dtype=np.float32)
+    for start in range(0, codes.shape[0], _DOT_CHUNK):
+        block = dequantize(codes[start:start + _DOT_CHUNK], scale)
+        norms_sq[start:start + block.shape[0]] = np.einsum('ij,ij->i', block, block)
+    return norms_sq
+
+
+# --- Định dạng BLOB trong KhuonMat ---
+def encode_blob(embedding, storage='float32'):
+    """
+    Mã hóa một embedding 128 chiều thành BLOB để lưu vào KhuonMat
+
+    int8 dùng một hệ số scale cho cả vector (đặt ở 4 byte đầu).
+    """
+    vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+    if vector.shape[0] != EMBEDDING_DIM:
+        raise ValueError(f"Embedding phải có {EMBEDDING_DIM} chiều, nhận được {vector.shape[0]}")
+
+    check_storage(storage)
+    if storage == 'int8':
+        scale = np.float32(max(float(np.abs(vector).max()) / 127.0, 1e-6))
+        codes = np.clip(np.rint(vector / scale), -127, 127).astype(np.int8)
+        return scale.tobytes() + codes.tobytes()
+    return vector.astype(STORAGE_DTYPES[storage]).tobytes()
+
+
+BLOB_SIZES = {
+    EMBEDDING_DIM * 4: 'float32',
+    EMBEDDING_DIM * 2: 'float16',
+    EMBEDDING_DIM + 4: 'int8',
+}
+
+
+def decode_blob(blob):
+    """
+    Giải mã BLOB KhuonMat (float32/float16/int8) về vector float32
+
+    Returns:
+        numpy.ndarray: Vector 128 chiều float32, hoặc None nếu độ dài không hợp lệ
+    """
+    storage = BLOB_SIZES.get(len(blob))
+    if storage == 'float32':
+        return np.frombuffer(blob, dtype=np.float32)
+    if storage == 'float16':
+        return np.frombuffer(blob, dtype=np.float16).astype(np.float32)
+    if storage == 'int8':
+        scale = np.frombuffer(blob, dtype=np.float32, count=1)[0]
+        return np.frombuffer(blob, dtype=np.int8, offset=4).astype(np.float32) * scale
+    return None
+
+
+def compare_storage(vectors, queries, threshold=0.5, storages=('float32', 'float16', 'int8'), repeats=3):
+    """
+    So sánh độ chính xác, độ trễ và bộ nhớ của các kiểu lưu trữ so với float32
+
+    Args:
+        vectors (numpy.ndarray): Gallery N×128 float32
+        queries (numpy.ndarray): Query Q×128 float32
+        threshold (float): Ngưỡng chấp nhận dùng để đo độ khớp quyết định nhận diện
+
+    Returns:
+        list: Mỗi phần tử là dict {storage, bytes_per_vector, gallery_mb, ms_per_query,
+              top1_agreement, decision_agreement, max_distance_error}
+    """
+    from face_recognition_module.face_gallery import FaceGallery
+
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    ids = list(range(vectors.shape[0]))
+    num_queries = max(queries.shape[0], 1)
+
+    reference = None
+    report = []
+    for storage in storages:
+        gallery = FaceGallery(storage=storage)
+        gallery.set_data(ids, ids, vectors)
+
+        best = float('inf')
+        dist = None
+        for _ in range(repeats):
+            start = time.perf_counter()
+            dist = gallery.distances(queries)
+            best = min(best, time.perf_counter() - start)
+
+        top1 = np.argmin(dist, axis=1)
+        top1_dist = dist[np.arange(dist.shape[0]), top1]
+        accepted = top1_dist < threshold
+        if reference is None:
+            reference = (top1, dist, accepted)
+
+        report.append({
+            'storage': storage,
+            'bytes_per_vector': gallery.codes.itemsize * gallery.dim,
+            'gallery_mb': round(gallery.codes.nbytes / 2 ** 20, 2),
+            'ms_per_query': round(best * 1000 / num_queries, 4),
+            'top1_agreement': round(float(np.mean(top1 == reference[0])), 4),
+            'decision_agreement': round(float(np.mean(
+                (accepted == reference[2]) & (~accepted | (top1 == reference[0])))), 4),
+            'max_distance_error': round(float(np.abs(dist - reference[1]).max()), 5),
+        })
+    return report
+
+
+# --- So sánh float32 / float16 / int8 trên gallery tổng hợp ---
+# python -m face_recognition_module.face_quantization --size 100000
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="So sánh lưu trữ float32/float16/int8 cho gallery")
+    parser.add_argument('--size', type=int, default=100000, help="Số embedding trong gallery")
+    parser.add_argument('--queries', type=int, default=200, help="Số query")
+    parser.add_argument('--threshold', type=float, default=0.5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    # Gallery giả lập: mỗi "sinh viên" có 5 mẫu quanh một tâm, thang đo giống embedding dlib
+    num_students = max(1, args.size // 5)
+    centers = rng.normal(0, 0.09, (num_students, EMBEDDING_DIM)).astype(np.float32)
+    gallery_vectors = np.repeat(centers, 5, axis=0)[:args.size]
+    gallery_vectors += rng.normal(0, 0.02, gallery_vectors.shape).astype(np.float32)
+    query_set = gallery_vectors[rng.choice(gallery_vectors.shape[0], args.queries, replace=False)]
+    query_set = query_set + rng.normal(0, 0.02, query_set.shape).astype(np.float32)
+
+    print(f"{'storage':>8} {'B/vec':>6} {'MB':>8} {'ms/query':>9} {'top1':>7} {'decision':>9} {'max_err':>8}")
+    for row in compare_storage(gallery_vectors, query_set, args.threshold):
+        print(f"{row['storage']:>8} {row['bytes_per_vector']:>6} {row['gallery_mb']:>8} "
+              f"{row['ms_per_query']:>9} {row['top1_agreement']:>7} {row['decision_agreement']:>9} "
+              f"{row['max_distance_error']:>8}")
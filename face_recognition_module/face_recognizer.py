@@ -4,6 +4,8 @@ import face_recognition
 import numpy as np
 import os
 import sys
+import threading
+import time
 
 # Thêm đường dẫn thư mục gốc của project vào sys.path
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
@@ -11,84 +13,102 @@ if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
 from database.student_repository import StudentRepository
-from config import DB_CONFIG
+from face_recognition_module.face_detector import FaceDetector
+from face_recognition_module.face_gallery import FaceGallery
+from face_recognition_module.face_index import IVFIndex
+from face_recognition_module.face_quality import FaceQualityScorer
+from face_recognition_module.gallery_cache import default_cache, load_gallery
+from face_recognition_module.pipeline_metrics import PipelineMetrics
+from config import DB_CONFIG, EMBEDDING_STORAGE, FACE_SEARCH_CONFIG, PIPELINE_METRICS
 
 
 class FaceRecognizer:
-    def __init__(self, recognition_threshold=0.6):
+    def __init__(self, recognition_threshold=0.6, detector=None, gallery=None, quality=None):
         """
         Khởi tạo Face Recognizer
 
         Args:
             recognition_threshold (float): Ngưỡng nhận diện (0.0-1.0, càng nhỏ càng nghiêm ngặt)
+            detector (FaceDetector): Bộ phát hiện khuôn mặt (mặc định theo FACE_DETECTION_CONFIG)
+            gallery (FaceGallery): Gallery dựng sẵn (ví dụ chia sẻ giữa các tiến trình);
+                                   khi có, không kết nối CSDL và không nhận cập nhật tăng dần
+            quality (FaceQualityScorer): Cổng chất lượng trước khi mã hóa (mặc định theo FACE_QUALITY_CONFIG)
         """
-        self.student_repo = StudentRepository()
-        self.known_face_encodings = []
-        self.known_face_ids = []
-        self.known_student_names = []
-        self.recognition_threshold = recognition_threshold
-        self.load_known_faces()
-
-    def load_known_faces(self):
-        """
-        Tải dữ liệu khuôn mặt đã mã hóa từ DB và lưu vào bộ nhớ.
-        """
-        print("Đang tải dữ liệu khuôn mặt từ cơ sở dữ liệu...")
-
-        try:
-            embeddings_from_db = self.student_repo.get_all_face_embeddings()
-
-            if not embeddings_from_db:
-                print("⚠️ Không có dữ liệu khuôn mặt trong CSDL.")
-                return
-
-            # Reset bộ nhớ
-            self.known_face_encodings = []
-            self.known_face_ids = []
-            self.known_student_names = []
+        self.student_repo = StudentRepository() if gallery is None else None
+        self.detector = detector or FaceDetector()
+        self.quality = quality or FaceQualityScorer()
+        self.gallery = gallery if gallery is not None else FaceGallery(storage=EMBEDDING_STORAGE['gallery'])
+        self.gallery_cache = default_cache() if gallery is None else None
+        self.last_load_stats = None
+        # Thời gian từng giai đoạn (cvtColor, detect, encode, match...); tắt mặc định
+        self.metrics = PipelineMetrics(PIPELINE_METRICS['enabled'], PIPELINE_METRICS['window'])
+
+        # Gallery con theo danh sách lớp của buổi học đang điểm danh (None = toàn trường)
+        self.session_roster = None
+        self.session_gallery = None
+        self._session_gallery_version = None
+        self.roster_fallback = False
+        self._session_lock = threading.Lock()  # Luồng GUI đổi buổi học trong khi worker đang nhận diện
 
-            successful = 0
-            failed = 0
-
-            for row in embeddings_from_db:
-                # row có thể là tuple hoặc dict
-                if isinstance(row, dict):
-                    ma_sv = row["MaSV_FK"]
-                    encoding_blob = row["DuLieuMaHoa"]
-                else:
-                    ma_sv, encoding_blob = row
-
-                try:
-                    if encoding_blob is None:
-                        raise ValueError("encoding_blob is None")
+        self.recognition_threshold = recognition_threshold
+        # Từ chối khi hai sinh viên gần nhất quá sát nhau (khuôn mặt mơ hồ)
+        self.min_margin = FACE_SEARCH_CONFIG['min_margin']
+        self.top_k = FACE_SEARCH_CONFIG['top_k']
+        if gallery is None:
+            self.load_known_faces()
 
-                    face_encoding = np.frombuffer(encoding_blob, dtype=np.float32)
+            # Nhận cập nhật tăng dần khi thêm khuôn mặt / xóa sinh viên qua StudentRepository
+            StudentRepository.add_face_listener(self)
 
-                    if face_encoding.shape != (128,):
-                        raise ValueError(f"Invalid shape: {face_encoding.shape}")
+    @property
+    def known_face_encodings(self):
+        """Ma trận N×128 float32 của gallery (chỉ đọc)"""
+        return self.gallery.embeddings
 
-                    student = self.student_repo.get_student_by_id(ma_sv)
-                    if not student:
-                        raise ValueError(f"Không tìm thấy sinh viên {ma_sv}")
+    @property
+    def known_face_ids(self):
+        return self.gallery.student_ids
 
-                    name = student["TenSV"]  # hoặc student["TenSV"] nếu là dict
+    @property
+    def known_student_names(self):
+        return self.gallery.student_names
 
-                    self.known_face_encodings.append(face_encoding)
-                    self.known_face_ids.append(ma_sv)
-                    self.known_student_names.append(name)
+    def load_known_faces(self):
+        """
+        Tải dữ liệu khuôn mặt đã mã hóa từ DB và lưu vào bộ nhớ.
 
-                    successful += 1
+        Nếu cache trên đĩa (GalleryCache) còn đúng phiên bản dữ liệu CSDL thì memory-map
+        cache thay vì tải BLOB. Ngược lại chỉ dùng một truy vấn KhuonMat JOIN SinhVien
+        (stream bằng server-side cursor) rồi ghi lại cache.
 
-                except Exception as e:
-                    import traceback
-                    print(f"⚠️ Lỗi xử lý sinh viên {ma_sv}: {type(e).__name__} - {e}")
-                    traceback.print_exc()
-                    failed += 1
+        Returns:
+            dict: Thống kê lần tải {'rows', 'loaded', 'skipped', 'seconds', 'source'}
+        """
+        print("Đang tải dữ liệu khuôn mặt...")
+        start = time.perf_counter()
 
-            print(f"✅ Tải xong: {successful} thành công, {failed} lỗi.")
+        try:
+            loaded, skipped, source = load_gallery(self.gallery, self.student_repo, self.gallery_cache)
+            elapsed = time.perf_counter() - start
+
+            stats = {
+                'rows': loaded + skipped,
+                'loaded': loaded,
+                'skipped': skipped,
+                'seconds': round(elapsed, 3),
+                'source': source,
+            }
+            self.last_load_stats = stats
+
+            if loaded == 0:
+                print("⚠️ Không có dữ liệu khuôn mặt trong CSDL.")
+            print(f"✅ Tải xong từ {'cache' if source == 'cache' else 'CSDL'}: {loaded} thành công, "
+                  f"{skipped} lỗi ({stats['rows']} dòng, {elapsed:.3f}s).")
+            return stats
 
         except Exception as e:
             print(f"❌ Lỗi tổng khi tải dữ liệu khuôn mặt: {e}")
+            return None
 
     def recognize_face_from_image(self, image_path):
         """
@@ -109,20 +129,14 @@ class FaceRecognizer:
             image = face_recognition.load_image_file(image_path)
 
             # Tìm khuôn mặt trong ảnh
-            face_locations = face_recognition.face_locations(image)
-            face_encodings = face_recognition.face_encodings(image, face_locations)
+            face_locations = self.detect_faces(image)
 
-            if not face_encodings:
+            if not face_locations:
                 print("Không tìm thấy khuôn mặt nào trong ảnh.")
                 return []
 
-            results = []
-            for face_encoding in face_encodings:
-                recognized_student = self._compare_face_with_database(face_encoding)
-                if recognized_student:
-                    results.append(recognized_student)
-
-            return results
+            matches = self.identify_faces(image, face_locations)
+            return [match for match in matches if match]
 
         except Exception as e:
             print(f"Lỗi khi xử lý ảnh {image_path}: {e}")
@@ -140,38 +154,90 @@ class FaceRecognizer:
                   face_location: (top, right, bottom, left)
                   face_img: ảnh khuôn mặt được cắt từ frame (dạng numpy)
         """
-        if not self.known_face_encodings:
+        if len(self.gallery) == 0:
             return []
 
         try:
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            face_locations = face_recognition.face_locations(rgb_frame)
+            with self.metrics.stage('recognize'):
+                with self.metrics.stage('cvtColor'):
+                    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                face_locations = self.detect_faces(rgb_frame)
 
-            if not face_locations:
-                return []
-
-            face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
+                if not face_locations:
+                    return []
 
-            results = []
-            for face_encoding, face_location in zip(face_encodings, face_locations):
-                recognized_student = self._compare_face_with_database(face_encoding)
+                # So khớp tất cả khuôn mặt trong frame bằng một phép tính vector hóa
+                matches = self.identify_faces(rgb_frame, face_locations)
 
-                (top, right, bottom, left) = face_location
-                # Cắt ảnh khuôn mặt từ frame gốc (vì frame gốc đang là BGR để hiển thị được bằng Qt)
-                face_img = frame[top:bottom, left:right]
+                results = []
+                for recognized_student, face_location in zip(matches, face_locations):
+                    results.append(self.build_result(frame, face_location, recognized_student))
 
-                if recognized_student:
-                    ma_sv, ten_sv, confidence = recognized_student
-                    results.append((ma_sv, ten_sv, face_location, confidence, face_img))
-                else:
-                    results.append((None, "Unknown", face_location, 0.0, face_img))
-
-            return results
+                return results
 
         except Exception as e:
             print(f"Lỗi khi nhận diện khuôn mặt trong frame: {e}")
             return []
 
+    def detect_faces(self, rgb_frame):
+        """
+        Phát hiện vị trí khuôn mặt trong frame RGB (có thể trên ảnh thu nhỏ, xem FaceDetector)
+
+        Returns:
+            list: [(top, right, bottom, left), ...]
+        """
+        with self.metrics.stage('detect'):
+            return self.detector.detect(rgb_frame)
+
+    def check_quality(self, rgb_frame, face_locations):
+        """
+        Cổng chất lượng trước khi mã hóa (kích thước, độ nét, góc quay)
+
+        Returns:
+            list: Với mỗi vị trí, True nếu đáng mã hóa
+        """
+        with self.metrics.stage('quality'):
+            passed = [q.ok for q in self.quality.score_faces(rgb_frame, face_locations)]
+        skipped = passed.count(False)
+        if skipped:
+            self.metrics.count('faces_skipped_quality', skipped)
+        return passed
+
+    def identify_faces(self, rgb_frame, face_locations, check_quality=True):
+        """
+        Mã hóa các khuôn mặt tại vị trí cho trước và so khớp với gallery
+
+        Args:
+            check_quality (bool): Bỏ qua (không mã hóa) khuôn mặt không qua cổng chất lượng
+
+        Returns:
+            list: Với mỗi vị trí, (ma_sv, ten_sv, confidence) hoặc None
+        """
+        if not face_locations:
+            return []
+
+        passed = self.check_quality(rgb_frame, face_locations) if check_quality else [True] * len(face_locations)
+        good_locations = [loc for loc, ok in zip(face_locations, passed) if ok]
+        if not good_locations:
+            return [None] * len(face_locations)
+
+        with self.metrics.stage('encode'):
+            face_encodings = face_recognition.face_encodings(rgb_frame, good_locations)
+        with self.metrics.stage('match'):
+            good_matches = iter(self._compare_faces_with_database(face_encodings))
+        return [next(good_matches) if ok else None for ok in passed]
+
+    @staticmethod
+    def build_result(frame, face_location, recognized_student):
+        (top, right, bottom, left) = face_location
+        # Cắt ảnh khuôn mặt từ frame gốc (vì frame gốc đang là BGR để hiển thị được bằng Qt)
+        face_img = frame[max(top, 0):bottom, max(left, 0):right]
+
+        if recognized_student:
+            ma_sv, ten_sv, confidence = recognized_student
+            return (ma_sv, ten_sv, face_location, confidence, face_img)
+        return (None, "Unknown", face_location, 0.0, face_img)
+
     def _compare_face_with_database(self, face_encoding):
         """
         So sánh một khuôn mặt với tất cả khuôn mặt trong database
@@ -182,31 +248,71 @@ class FaceRecognizer:
         Returns:
             tuple: (ma_sv, ten_sv, confidence) hoặc None nếu không nhận diện được
         """
-        if not self.known_face_encodings:
-            return None
+        matches = self._compare_faces_with_database([face_encoding])
+        return matches[0] if matches else None
 
-        try:
-            # Tính khoảng cách với tất cả khuôn mặt đã biết
-            face_distances = face_recognition.face_distance(self.known_face_encodings, face_encoding)
+    def _compare_faces_with_database(self, face_encodings):
+        """
+        So sánh nhiều khuôn mặt với gallery trong một lần tính khoảng cách
 
-            # Tìm khuôn mặt gần nhất
-            best_match_index = np.argmin(face_distances)
-            best_distance = face_distances[best_match_index]
+        Args:
+            face_encodings (list | numpy.array): Danh sách hoặc ma trận Q×128 các mã hóa khuôn mặt
 
-            # Kiểm tra xem có đạt ngưỡng nhận diện không
-            if best_distance < self.recognition_threshold:
-                confidence = (1.0 - best_distance) * 100  # Chuyển thành phần trăm
+        Returns:
+            list: Với mỗi khuôn mặt, (ma_sv, ten_sv, confidence) hoặc None nếu không nhận diện được
+        """
+        if len(face_encodings) == 0:
+            return []
 
-                ma_sv = self.known_face_ids[best_match_index]
-                ten_sv = self.known_student_names[best_match_index]
+        if len(self.gallery) == 0:
+            return [None] * len(face_encodings)
 
-                return (ma_sv, ten_sv, round(confidence, 2))
+        try:
+            results = []
+            for search in self.search_faces(face_encodings):  # top_k + margin theo FACE_SEARCH_CONFIG
+                if search.match is None:
+                    results.append(None)
+                    continue
 
-            return None
+                ma_sv, ten_sv, best_distance = search.match
+                confidence = (1.0 - best_distance) * 100  # Chuyển thành phần trăm
+                results.append((ma_sv, ten_sv, round(confidence, 2)))
+
+            return results
 
         except Exception as e:
             print(f"Lỗi khi so sánh khuôn mặt: {e}")
-            return None
+            return [None] * len(face_encodings)
+
+    def search_faces(self, face_encodings, k=None):
+        """
+        Tìm kiếm open-set cho cả lô khuôn mặt trên gallery đang dùng (theo buổi học nếu có)
+
+        Args:
+            face_encodings (list | numpy.array): Danh sách hoặc ma trận Q×128
+            k (int): Số sinh viên ứng viên mỗi khuôn mặt (mặc định FACE_SEARCH_CONFIG['top_k'])
+
+        Returns:
+            list: SearchResult cho mỗi khuôn mặt (candidates, margin, match)
+        """
+        if len(face_encodings) == 0:
+            return []
+
+        gallery = self._active_gallery()
+        fallback = self.roster_fallback
+        k = k or self.top_k
+        results = gallery.search(face_encodings, k, self.recognition_threshold, self.min_margin)
+
+        # Sinh viên ngoài danh sách lớp (walk-in): chỉ tìm toàn trường cho các khuôn mặt chưa khớp
+        if gallery is not self.gallery and fallback:
+            missing = [i for i, result in enumerate(results) if result.match is None]
+            if missing:
+                queries = np.asarray(face_encodings, dtype=np.float32)[missing]
+                for i, result in zip(missing, self.gallery.search(queries, k, self.recognition_threshold,
+                                                                  self.min_margin)):
+                    if result.match is not None:
+                        results[i] = result
+        return results
 
     def get_student_info(self, ma_sv):
         """
@@ -218,6 +324,8 @@ class FaceRecognizer:
         Returns:
             tuple: Thông tin sinh viên hoặc None
         """
+        if self.student_repo is None:
+            return None
         try:
             return self.student_repo.get_student_by_id(ma_sv)
         except Exception as e:
@@ -244,6 +352,135 @@ class FaceRecognizer:
         print("Đang tải lại dữ liệu khuôn mặt...")
         self.load_known_faces()
 
+    def set_session_roster(self, student_ids, fallback_to_global=False):
+        """
+        Giới hạn nhận diện trong danh sách sinh viên của buổi học
+
+        Args:
+            student_ids (iterable): Mã sinh viên thuộc lớp-môn của buổi học
+            fallback_to_global (bool): Nếu True, khuôn mặt không khớp danh sách lớp
+                                       sẽ được tìm tiếp trong toàn bộ gallery
+        """
+        roster = set(student_ids or [])
+        if not roster:
+            print("⚠️ Danh sách lớp rỗng, nhận diện trên toàn bộ dữ liệu.")
+            self.clear_session_roster()
+            return
+
+        with self._session_lock:
+            self.session_roster = roster
+            self.roster_fallback = fallback_to_global
+            self._session_gallery_version = None
+        gallery = self._active_gallery()
+        print(f"Đã giới hạn nhận diện trong {len(roster)} sinh viên ({len(gallery)} mẫu khuôn mặt).")
+
+    def clear_session_roster(self):
+        """Bỏ giới hạn danh sách lớp, nhận diện trên toàn bộ gallery"""
+        with self._session_lock:
+            self.session_roster = None
+            self.session_gallery = None
+            self._session_gallery_version = None
+            self.roster_fallback = False
+
+    def _active_gallery(self):
+        """Gallery dùng để so khớp: gallery theo buổi học nếu có, ngược lại gallery toàn trường"""
+        with self._session_lock:
+            if self.session_roster is None:
+                return self.gallery
+            # Gallery con được dựng lại khi gallery gốc thay đổi (thêm/xóa khuôn mặt)
+            if self._session_gallery_version != self.gallery.version:
+                self._session_gallery_version = self.gallery.version
+                self.session_gallery = self.gallery.subset(self.session_roster)
+            return self.session_gallery
+
+    def build_index(self, **index_options):
+        """
+        Dựng chỉ mục ANN (IVF, tùy chọn PQ) cho gallery lớn
+
+        Args:
+            **index_options: nlist, nprobe, pq_m, rerank... (xem IVFIndex)
+        """
+        try:
+            return self.gallery.build_index(**index_options)
+        except Exception as e:
+            print(f"Lỗi khi dựng chỉ mục khuôn mặt: {e}")
+            return None
+
+    def save_index(self, path):
+        """Lưu chỉ mục ANN hiện tại ra file"""
+        if self.gallery.index is None:
+            print("Chưa có chỉ mục để lưu.")
+            return False
+        try:
+            self.gallery.index.save(path)
+            return True
+        except Exception as e:
+            print(f"Lỗi khi lưu chỉ mục {path}: {e}")
+            return False
+
+    def load_index(self, path):
+        """
+        Tải chỉ mục ANN từ file và gắn vào gallery (chỉ khi khớp dữ liệu hiện tại)
+
+        Returns:
+            bool: True nếu tải và gắn thành công
+        """
+        try:
+            self.gallery.set_index(IVFIndex.load(path))
+            return True
+        except Exception as e:
+            print(f"Lỗi khi tải chỉ mục {path}: {e}")
+            return False
+
+    def add_student_faces(self, ma_sv, face_encodings, ten_sv=None):
+        """
+        Thêm embedding của một sinh viên vào gallery mà không tải lại toàn bộ
+
+        Args:
+            ma_sv (str): Mã sinh viên
+            face_encodings (list | numpy.array): Một hoặc nhiều vector 128 chiều
+            ten_sv (str): Tên sinh viên (nếu None sẽ lấy từ gallery hoặc CSDL)
+
+        Returns:
+            int: Số embedding đã thêm
+        """
+        ten_sv = ten_sv or self._resolve_student_name(ma_sv)
+        return self.gallery.add_student(ma_sv, ten_sv, face_encodings)
+
+    def replace_student_faces(self, ma_sv, face_encodings, ten_sv=None):
+        """
+        Thay thế toàn bộ embedding của một sinh viên trong gallery
+
+        Returns:
+            int: Số embedding sau khi thay thế
+        """
+        ten_sv = ten_sv or self._resolve_student_name(ma_sv)
+        return self.gallery.replace_student(ma_sv, ten_sv, face_encodings)
+
+    def remove_student_faces(self, ma_sv):
+        """
+        Xóa embedding của một sinh viên khỏi gallery
+
+        Returns:
+            int: Số embedding đã xóa
+        """
+        return self.gallery.remove_student(ma_sv)
+
+    def on_face_embeddings_added(self, ma_sv, face_encodings):
+        """Callback từ StudentRepository.add_face_embedding"""
+        self.add_student_faces(ma_sv, face_encodings)
+
+    def on_student_deleted(self, ma_sv):
+        """Callback từ StudentRepository.delete_student"""
+        self.remove_student_faces(ma_sv)
+
+    def _resolve_student_name(self, ma_sv):
+        name = self.gallery.get_student_name(ma_sv)
+        if name:
+            return name
+        student = self.get_student_info(ma_sv)
+        return student["TenSV"] if student else str(ma_sv)
+
     def get_statistics(self):
         """
         Lấy thống kê về dữ liệu nhận diện
@@ -252,8 +489,14 @@ class FaceRecognizer:
             dict: Thống kê
         """
         return {
-            'total_known_faces': len(self.known_face_encodings),
+            'total_known_faces': len(self.gallery),
             'recognition_threshold': self.recognition_threshold,
+            'last_load': self.last_load_stats,
+            'gallery_storage': self.gallery.storage,
+            'pipeline': self.metrics.snapshot(),
+            'gallery_mb': round(self.gallery.codes.nbytes / 2 ** 20, 2),
+            'index': type(self.gallery.index).__name__ if self.gallery.index_is_current else None,
+            'session_roster_size': len(self.session_roster) if self.session_roster is not None else None,
             'known_students': list(zip(self.known_face_ids, self.known_student_names))
         }
 
@@ -0,0 +1,310 @@
+# face_recognition_module\face_tracker.py
+"""
+Theo dõi khuôn mặt giữa các frame để tránh phát hiện và mã hóa lại liên tục.
+
+Trong lớp học, sinh viên thường ngồi yên nhiều phút. FaceTracker chỉ chạy phát hiện
+đầy đủ mỗi N frame (hoặc khi mất dấu), ghép khuôn mặt với các track cũ bằng IoU và
+chỉ mã hóa lại những track mới hoặc có độ tin cậy thấp. Danh tính được mang theo track
+qua các frame.
+
+Danh tính của track được làm mượt theo thời gian: kết quả so khớp của K lần mã hóa gần
+nhất được giữ trong cửa sổ trượt và track chỉ báo một sinh viên sau khi người đó đạt đủ
+số phiếu. Danh tính ổn định được cache trên track nên các frame sau bỏ qua so khớp hoàn toàn.
+"""
+import logging
+from collections import deque
+
+import cv2
+
+from face_recognition_module.pipeline_metrics import PipelineMetrics
+
+logger = logging.getLogger(__name__)
+
+
+def iou(box_a, box_b):
+    """IoU giữa hai khung (top, right, bottom, left)"""
+    top = max(box_a[0], box_b[0])
+    right = min(box_a[1], box_b[1])
+    bottom = min(box_a[2], box_b[2])
+    left = max(box_a[3], box_b[3])
+
+    inter = max(0, right - left) * max(0, bottom - top)
+    if inter == 0:
+        return 0.0
+    area_a = (box_a[1] - box_a[3]) * (box_a[2] - box_a[0])
+    area_b = (box_b[1] - box_b[3]) * (box_b[2] - box_b[0])
+    return inter / float(area_a + area_b - inter)
+
+
+def _create_cv_tracker():
+    """Tạo correlation tracker của OpenCV nếu bản cài đặt hỗ trợ, ngược lại None"""
+    for factory in ("TrackerKCF_create", "TrackerMOSSE_create", "TrackerCSRT_create"):
+        for namespace in (getattr(cv2, "legacy", None), cv2):
+            create = getattr(namespace, factory, None) if namespace is not None else None
+            if create is not None:
+                return create()
+    return None
+
+
+class Track:
+    """Một khuôn mặt đang được theo dõi"""
+
+    def __init__(self, track_id, box, vote_window=1):
+        self.track_id = track_id
+        self.box = box
+        self.ma_sv = None
+        self.ten_sv = "Unknown"
+        self.confidence = 0.0
+        self.needs_encoding = True
+        self.misses = 0
+        self.frames_since_encoding = 0
+        self.cv_tracker = None
+        # Cửa sổ K kết quả so khớp gần nhất: (ma_sv, ten_sv, distance) hoặc (None, "Unknown", None)
+        self.history = deque(maxlen=max(1, vote_window))
+
+    @property
+    def is_identified(self):
+        return self.ma_sv is not None
+
+    @property
+    def is_collecting(self):
+        """Chưa có danh tính ổn định và cửa sổ bỏ phiếu chưa đầy"""
+        return not self.is_identified and len(self.history) < self.history.maxlen
+
+
+class FaceTracker:
+    """
+    Bộ theo dõi khuôn mặt dựa trên IoU (tùy chọn correlation tracker của OpenCV)
+    bọc quanh FaceRecognizer.
+    """
+
+    def __init__(self, face_recognizer, detect_every=5, iou_threshold=0.3, max_misses=2,
+                 min_confidence=75.0, reencode_every=30, use_cv_tracker=False,
+                 vote_window=5, min_votes=3):
+        """
+        Args:
+            face_recognizer (FaceRecognizer): Bộ nhận diện cung cấp detect/encode/match
+            detect_every (int): Chạy phát hiện đầy đủ mỗi N frame
+            iou_threshold (float): IoU tối thiểu để ghép khuôn mặt với track cũ
+            max_misses (int): Số lần phát hiện liên tiếp không thấy trước khi xóa track
+            min_confidence (float): Track dưới ngưỡng này (%) được mã hóa lại ở lần phát hiện sau
+            reencode_every (int): Mã hóa lại track đã nhận diện sau N frame để tự sửa sai (0 = tắt)
+            use_cv_tracker (bool): Dùng correlation tracker của OpenCV giữa các lần phát hiện
+            vote_window (int): Số kết quả so khớp gần nhất (K) giữ cho mỗi track
+            min_votes (int): Số phiếu tối thiểu trong cửa sổ để chấp nhận một danh tính
+                             (vote_window=1, min_votes=1: quyết định theo từng frame như trước)
+        """
+        self.face_recognizer = face_recognizer
+        # Dùng chung bộ đo của FaceRecognizer để get_statistics() thấy cả thời gian theo dõi
+        self.metrics = getattr(face_recognizer, 'metrics', None) or PipelineMetrics()
+        self.detect_every = max(1, detect_every)
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.min_confidence = min_confidence
+        self.reencode_every = reencode_every
+        self.use_cv_tracker = use_cv_tracker
+        self.vote_window = max(1, vote_window)
+        self.min_votes = max(1, min(min_votes, self.vote_window))
+
+        self.tracks = []
+        self._next_track_id = 1
+        self._frame_index = 0
+        self._lost = False
+        self._reset_requested = False
+
+        self.detections_run = 0
+        self.faces_encoded = 0
+        self.cached_results = 0  # Số kết quả trả về từ danh tính đã cache, không so khớp lại
+
+    def reset(self):
+        """
+        Yêu cầu xóa toàn bộ track (ví dụ khi đổi buổi học hoặc khởi động lại camera).
+        Việc xóa thực hiện ở đầu lần process() kế tiếp để an toàn khi gọi từ luồng khác.
+        """
+        self._reset_requested = True
+
+    def _clear(self):
+        self._reset_requested = False
+        self.tracks = []
+        self._frame_index = 0
+        self._lost = False
+
+    def process(self, frame):
+        """
+        Nhận diện khuôn mặt trong frame, tận dụng track từ các frame trước
+
+        Args:
+            frame (numpy.array): Khung hình BGR
+
+        Returns:
+            list: [(ma_sv, ten_sv, face_location, confidence, face_img), ...] giống
+                  FaceRecognizer.recognize_faces_in_frame
+        """
+        with self.metrics.stage('recognize'):
+            return self._process(frame)
+
+    def _process(self, frame):
+        try:
+            if self._reset_requested:
+                self._clear()
+
+            rgb_frame = None
+            detect = (self._frame_index % self.detect_every == 0) or not self.tracks or self._lost
+            self._frame_index += 1
+
+            if not detect and self.use_cv_tracker:
+                self._update_cv_trackers(frame)
+                detect = self._lost
+
+            if detect:
+                with self.metrics.stage('cvtColor'):
+                    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                face_locations = self.face_recognizer.detect_faces(rgb_frame)
+                self.detections_run += 1
+                self._associate(face_locations)
+                if self.use_cv_tracker:
+                    self._init_cv_trackers(frame)
+                self._lost = False
+
+            for track in self.tracks:
+                track.frames_since_encoding += 1
+                if (track.is_identified and self.reencode_every
+                        and track.frames_since_encoding >= self.reencode_every):
+                    track.needs_encoding = True
+
+            # Mã hóa track mới / độ tin cậy thấp khi khung vừa được phát hiện chính xác. Track đang
+            # thu phiếu được mã hóa cả ở frame giữa hai lần phát hiện chỉ khi cv tracker vừa cập nhật
+            # khung; không có cv tracker thì khung là vị trí cũ, mã hóa lại chỉ cho phiếu từ ảnh lệch
+            to_encode = [t for t in self.tracks
+                         if t.needs_encoding and t.misses == 0
+                         and (detect or (self.use_cv_tracker and t.is_collecting))]
+            if to_encode:
+                if rgb_frame is None:
+                    with self.metrics.stage('cvtColor'):
+                        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                # Khuôn mặt không qua cổng chất lượng được hoãn: không mã hóa, không tính phiếu
+                passed = self.face_recognizer.check_quality(rgb_frame, [t.box for t in to_encode])
+                to_encode = [t for t, ok in zip(to_encode, passed) if ok]
+                if to_encode:
+                    matches = self.face_recognizer.identify_faces(
+                        rgb_frame, [t.box for t in to_encode], check_quality=False)
+                    self.faces_encoded += len(to_encode)
+                    for track, match in zip(to_encode, matches):
+                        self._update_identity(track, match)
+
+            visible = [track for track in self.tracks if track.misses == 0]
+            self.cached_results += sum(1 for t in visible if t.is_identified and t not in to_encode)
+            return [self.face_recognizer.build_result(frame, track.box, self._track_match(track))
+                    for track in visible]
+
+        except Exception as e:
+            print(f"Lỗi khi theo dõi khuôn mặt: {e}")
+            self._clear()
+            return []
+
+    def _associate(self, face_locations):
+        """Ghép khuôn mặt vừa phát hiện với track cũ theo IoU (tham lam, IoU lớn nhất trước)"""
+        pairs = []
+        for ti, track in enumerate(self.tracks):
+            for di, box in enumerate(face_locations):
+                score = iou(track.box, box)
+                if score >= self.iou_threshold:
+                    pairs.append((score, ti, di))
+        pairs.sort(reverse=True)
+
+        matched_tracks = set()
+        matched_detections = set()
+        for _, ti, di in pairs:
+            if ti in matched_tracks or di in matched_detections:
+                continue
+            matched_tracks.add(ti)
+            matched_detections.add(di)
+            track = self.tracks[ti]
+            track.box = tuple(face_locations[di])
+            track.misses = 0
+
+        survivors = []
+        for ti, track in enumerate(self.tracks):
+            if ti not in matched_tracks:
+                track.misses += 1
+                if track.misses > self.max_misses:
+                    continue
+            survivors.append(track)
+
+        for di, box in enumerate(face_locations):
+            if di not in matched_detections:
+                survivors.append(Track(self._next_track_id, tuple(box), self.vote_window))
+                self._next_track_id += 1
+
+        self.tracks = survivors
+
+    def _update_identity(self, track, match):
+        track.needs_encoding = False
+        track.frames_since_encoding = 0
+        if match:
+            ma_sv, ten_sv, confidence = match
+            track.history.append((ma_sv, ten_sv, 1.0 - confidence / 100.0))
+        else:
+            track.history.append((None, "Unknown", None))
+
+        winner = self._vote(track)
+        if winner:
+            track.ma_sv, track.ten_sv, track.confidence = winner
+            if track.confidence < self.min_confidence:
+                track.needs_encoding = True
+        else:
+            track.ma_sv, track.ten_sv, track.confidence = None, "Unknown", 0.0
+            track.needs_encoding = True
+
+    def _vote(self, track):
+        """
+        Bỏ phiếu trên cửa sổ của track
+
+        Returns:
+            tuple: (ma_sv, ten_sv, confidence) của sinh viên nhiều phiếu nhất (hòa thì khoảng
+                   cách trung bình nhỏ hơn thắng) nếu đạt min_votes, ngược lại None.
+                   confidence tính từ khoảng cách trung bình qua các phiếu của sinh viên đó.
+        """
+        tally = {}
+        for ma_sv, ten_sv, distance in track.history:
+            if ma_sv is None:
+                continue
+            entry = tally.setdefault(ma_sv, [ten_sv, 0, 0.0])
+            entry[1] += 1
+            entry[2] += distance
+
+        if not tally:
+            return None
+        ma_sv, (ten_sv, votes, total) = max(tally.items(), key=lambda kv: (kv[1][1], -kv[1][2] / kv[1][1]))
+        if votes < self.min_votes:
+            return None
+        return ma_sv, ten_sv, round((1.0 - total / votes) * 100, 2)
+
+    @staticmethod
+    def _track_match(track):
+        return (track.ma_sv, track.ten_sv, track.confidence) if track.is_identified else None
+
+    # --- Correlation tracker của OpenCV (tùy chọn) ---
+    def _init_cv_trackers(self, frame):
+        for track in self.tracks:
+            if track.misses:
+                track.cv_tracker = None
+                continue
+            track.cv_tracker = _create_cv_tracker()
+            if track.cv_tracker is None:
+                logger.warning("OpenCV không hỗ trợ correlation tracker, chỉ dùng IoU.")
+                self.use_cv_tracker = False
+                return
+            top, right, bottom, left = track.box
+            track.cv_tracker.init(frame, (left, top, right - left, bottom - top))
+
+    def _update_cv_trackers(self, frame):
+        for track in self.tracks:
+            if track.cv_tracker is None or track.misses:
+                continue
+            ok, (x, y, w, h) = track.cv_tracker.update(frame)
+            if not ok:
+                # Mất dấu: phát hiện đầy đủ ngay trong frame này
+                self._lost = True
+                continue
+            track.box = (int(y), int(x + w), int(y + h), int(x))
@@ -0,0 +1,175 @@
+# face_recognition_module\gallery_cache.py
+"""
+Cache gallery khuôn mặt trên đĩa để khởi động không phải tải toàn bộ BLOB KhuonMat.
+
+Mỗi snapshot gồm ma trận embedding dạng .npy (đúng kiểu lưu trữ của gallery: float32,
+float16 hoặc int8) (mở lại bằng memory-map, nên
+nhiều tiến trình dùng chung page cache của hệ điều hành) và một file JSON kèm theo
+chứa mã/tên sinh viên theo từng dòng cùng phiên bản dữ liệu CSDL lúc chụp. Cache
+chỉ được làm mới khi StudentRepository.get_face_gallery_version() thay đổi.
+"""
+import glob
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+
+import numpy as np
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from config import GALLERY_CACHE_DIR
+from face_recognition_module.face_quantization import STORAGE_DTYPES, dequantize
+
+logger = logging.getLogger(__name__)
+
+CACHE_FORMAT = 2
+
+
+class GalleryCache:
+    def __init__(self, cache_dir=None):
+        """
+        Args:
+            cache_dir (str): Thư mục chứa cache (mặc định config.GALLERY_CACHE_DIR)
+        """
+        self.cache_dir = os.path.join(project_root, cache_dir or GALLERY_CACHE_DIR)
+        self.meta_path = os.path.join(self.cache_dir, 'gallery.json')
+
+    def load(self, version):
+        """
+        Mở snapshot nếu được chụp ở đúng phiên bản dữ liệu
+
+        Args:
+            version (str): Phiên bản dữ liệu hiện tại của CSDL
+
+        Returns:
+            tuple: (student_ids, student_names, codes, storage, scale) với codes là memmap chỉ đọc,
+                   hoặc None nếu chưa có cache / cache đã cũ / hỏng
+        """
+        if version is None or not os.path.exists(self.meta_path):
+            return None
+
+        try:
+            with open(self.meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('format') != CACHE_FORMAT or meta.get('version') != version:
+                return None
+
+            codes = np.load(os.path.join(self.cache_dir, meta['matrix']), mmap_mode='r')
+            student_ids = meta['student_ids']
+            student_names = meta['student_names']
+            storage = meta['storage']
+            scale = None if meta.get('scale') is None else np.asarray(meta['scale'], dtype=np.float32)
+            if (codes.dtype != STORAGE_DTYPES.get(storage) or codes.ndim != 2
+                    or not codes.shape[0] == len(student_ids) == len(student_names)):
+                logger.warning("Cache gallery không nhất quán, bỏ qua.")
+                return None
+            return student_ids, student_names, codes, storage, scale
+
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Không đọc được cache gallery: {e}")
+            return None
+
+    def save(self, version, gallery):
+        """
+        Ghi snapshot của gallery cho phiên bản dữ liệu cho trước
+
+        Ma trận được ghi vào file có tên riêng rồi mới thay file JSON (os.replace), nên
+        tiến trình khác đang đọc cache cũ không bao giờ thấy dữ liệu ghi dở.
+
+        Returns:
+            bool: True nếu ghi thành công
+        """
+        if version is None:
+            return False
+
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with gallery.lock:
+                codes = np.ascontiguousarray(gallery.codes)
+                scale = None if gallery.scale is None else gallery.scale.tolist()
+                student_ids = list(gallery.student_ids)
+                student_names = list(gallery.student_names)
+
+            matrix_name = f"embeddings-{uuid.uuid4().hex}.npy"
+            np.save(os.path.join(self.cache_dir, matrix_name), codes)
+
+            meta = {
+                'format': CACHE_FORMAT,
+                'version': version,
+                'matrix': matrix_name,
+                'storage': gallery.storage,
+                'scale': scale,
+                'rows': len(student_ids),
+                'dim': codes.shape[1],
+                'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'student_ids': student_ids,
+                'student_names': student_names,
+            }
+            tmp_path = f"{self.meta_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.replace(tmp_path, self.meta_path)
+
+            self._remove_stale(matrix_name)
+            return True
+
+        except OSError as e:
+            logger.warning(f"Không ghi được cache gallery: {e}")
+            return False
+
+    def clear(self):
+        """Xóa toàn bộ cache"""
+        if os.path.exists(self.meta_path):
+            os.remove(self.meta_path)
+        self._remove_stale(None)
+
+    def _remove_stale(self, keep):
+        for path in glob.glob(os.path.join(self.cache_dir, 'embeddings-*.npy')):
+            if os.path.basename(path) == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # Windows: file đang được tiến trình khác memory-map, xóa ở lần sau
+
+
+def default_cache():
+    """GalleryCache theo cấu hình, hoặc None nếu GALLERY_CACHE_DIR tắt cache"""
+    return GalleryCache() if GALLERY_CACHE_DIR else None
+
+
+def load_gallery(gallery, student_repo, cache=None):
+    """
+    Nạp gallery từ cache trên đĩa nếu còn hợp lệ, ngược lại tải từ CSDL rồi ghi lại cache
+
+    Args:
+        gallery (FaceGallery): Gallery cần nạp
+        student_repo (StudentRepository): Nguồn dữ liệu và phiên bản
+        cache (GalleryCache): Cache dùng (None = không dùng cache)
+
+    Returns:
+        tuple: (số dòng nạp, số dòng bỏ qua, nguồn 'cache' | 'database')
+    """
+    version = student_repo.get_face_gallery_version() if cache is not None else None
+
+    cached = cache.load(version) if cache is not None else None
+    if cached is not None:
+        student_ids, student_names, codes, storage, scale = cached
+        if storage == gallery.storage:
+            gallery.set_codes(student_ids, student_names, codes, scale)
+        else:
+            # Đổi kiểu lưu trữ trong cấu hình: lượng tử lại từ cache, không cần tải CSDL
+            gallery.set_data(student_ids, student_names, dequantize(codes, scale))
+            cache.save(version, gallery)
+        return len(gallery), 0, 'cache'
+
+    loaded, skipped = gallery.load_rows(student_repo.iter_face_gallery())
+    if cache is not None:
+        # Phiên bản được đọc TRƯỚC khi tải: nếu CSDL đổi trong lúc tải, lần sau sẽ tải lại
+        cache.save(version, gallery)
+    return loaded, skipped, 'database'
@@ -0,0 +1,143 @@
+# face_recognition_module\pipeline_metrics.py
+"""
+Đo thời gian từng giai đoạn của pipeline nhận diện (cvtColor, phát hiện, mã hóa,
+so khớp, vẽ, hiển thị...) và đếm frame vào/ra/bị bỏ.
+
+Mỗi giai đoạn giữ N mẫu gần nhất (cửa sổ trượt) để tính p50/p95/p99 khi cần xem.
+Khi tắt, stage() trả về một context manager rỗng dùng chung và count() thoát ngay,
+nên chi phí trên đường nóng chỉ là một phép kiểm tra cờ.
+"""
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    __slots__ = ('_samples', '_start')
+
+    def __init__(self, samples):
+        self._samples = samples
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._samples.append(time.perf_counter() - self._start)
+        return False
+
+
+class PipelineMetrics:
+    def __init__(self, enabled=False, window=1000):
+        """
+        Args:
+            enabled (bool): Bật đo (có thể đổi lúc chạy)
+            window (int): Số mẫu gần nhất giữ cho mỗi giai đoạn
+        """
+        self.enabled = enabled
+        self.window = window
+        self._samples = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+        self._started = time.time()
+
+    def stage(self, name):
+        """
+        Context manager đo thời gian một giai đoạn:
+
+            with metrics.stage('detect'):
+                ...
+        """
+        if not self.enabled:
+            return _NULL_STAGE
+        samples = self._samples.get(name)
+        if samples is None:
+            with self._lock:
+                samples = self._samples.setdefault(name, deque(maxlen=self.window))
+        # Mỗi lần gọi một đối tượng riêng: an toàn khi nhiều luồng đo cùng giai đoạn
+        return _Stage(samples)
+
+    def record(self, name, seconds):
+        """Ghi một mẫu thời gian đã đo sẵn"""
+        if not self.enabled:
+            return
+        samples = self._samples.get(name)
+        if samples is None:
+            with self._lock:
+                samples = self._samples.setdefault(name, deque(maxlen=self.window))
+        samples.append(seconds)
+
+    def count(self, name, n=1):
+        """Tăng bộ đếm (frames_in, frames_out, frames_dropped...)"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def reset(self):
+        with self._lock:
+            self._samples = {}
+            self._counters = {}
+            self._started = time.time()
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: {'enabled', 'seconds', 'counters': {...},
+                   'stages': {tên: {'samples', 'p50_ms', 'p95_ms', 'p99_ms', 'mean_ms'}}}
+        """
+        with self._lock:
+            stages = {name: list(samples) for name, samples in self._samples.items()}
+            counters = dict(self._counters)
+            elapsed = time.time() - self._started
+
+        report = {}
+        for name, samples in stages.items():
+            if not samples:
+                continue
+            ms = np.asarray(samples, dtype=np.float64) * 1000
+            p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+            report[name] = {
+                'samples': len(samples),
+                'p50_ms': round(float(p50), 3),
+                'p95_ms': round(float(p95), 3),
+                'p99_ms': round(float(p99), 3),
+                'mean_ms': round(float(ms.mean()), 3),
+            }
+        return {
+            'enabled': self.enabled,
+            'seconds': round(elapsed, 1),
+            'counters': counters,
+            'stages': report,
+        }
+
+    def format_lines(self, stage_order=None):
+        """Các dòng văn bản ngắn gọn để vẽ overlay lên frame"""
+        snap = self.snapshot()
+        names = stage_order or sorted(snap['stages'])
+        lines = []
+        for name in names:
+            stats = snap['stages'].get(name)
+            if stats:
+                lines.append(f"{name:<10} p50 {stats['p50_ms']:7.1f}  p95 {stats['p95_ms']:7.1f}  "
+                             f"p99 {stats['p99_ms']:7.1f} ms")
+        counters = snap['counters']
+        if counters:
+            lines.append("  ".join(f"{k}={v}" for k, v in sorted(counters.items())))
+        return lines
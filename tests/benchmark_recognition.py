@@ -0,0 +1,270 @@
+# benchmark_recognition.py
+"""
+Bộ benchmark nhận diện có thể lặp lại (không cần camera, không cần CSDL)
+
+- Sinh gallery 128 chiều tổng hợp ở nhiều kích thước (mặc định 1k/10k/100k/1M mẫu)
+- Đo _compare_face_with_database (1 khuôn mặt) và _compare_faces_with_database (lô nhiều khuôn mặt)
+- Phát lại một tập frame cố định từ đĩa và đo từng giai đoạn của recognize_faces_in_frame:
+  phát hiện, mã hóa, so khớp và toàn bộ
+- Ghi kết quả ra JSON và so sánh với baseline đã lưu để phát hiện hồi quy hiệu năng
+
+Ví dụ:
+    python tests/benchmark_recognition.py --frames assets/benchmark_frames -o bench.json
+    python tests/benchmark_recognition.py --sizes 1000 10000 --baseline tests/benchmark_baseline.json
+    python tests/benchmark_recognition.py --save-baseline tests/benchmark_baseline.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import cv2
+import numpy as np
+
+# Thêm đường dẫn project root
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+try:
+    import face_recognition
+    from face_recognition_module.face_detector import FaceDetector
+    from face_recognition_module.face_gallery import FaceGallery
+    from face_recognition_module.face_recognizer import FaceRecognizer
+except ImportError as e:
+    print(f"Lỗi import module nhận diện: {e}")
+    sys.exit(1)
+
+SAMPLES_PER_STUDENT = 5
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+
+
+def make_synthetic_gallery(size, seed=0, storage='float32'):
+    """
+    Gallery giả lập: mỗi "sinh viên" có SAMPLES_PER_STUDENT mẫu quanh một tâm,
+    thang đo gần với embedding dlib (khoảng cách cùng người ~0.3, khác người ~0.9)
+    """
+    rng = np.random.default_rng(seed)
+    num_students = max(1, size // SAMPLES_PER_STUDENT)
+    centers = rng.normal(0, 0.09, (num_students, 128)).astype(np.float32)
+    vectors = np.repeat(centers, SAMPLES_PER_STUDENT, axis=0)[:size]
+    vectors += rng.normal(0, 0.02, vectors.shape).astype(np.float32)
+
+    ids = [f"SV{i // SAMPLES_PER_STUDENT:07d}" for i in range(size)]
+    gallery = FaceGallery(storage=storage)
+    gallery.set_data(ids, ids, vectors)
+    return gallery, vectors
+
+
+def load_frames(frame_dir, limit=None):
+    """Đọc các frame (.jpg/.png) theo thứ tự tên file để lần chạy nào cũng giống nhau"""
+    frames = []
+    if not frame_dir or not os.path.isdir(frame_dir):
+        return frames
+    for name in sorted(os.listdir(frame_dir)):
+        if name.lower().endswith(('.jpg', '.jpeg', '.png')):
+            frame = cv2.imread(os.path.join(frame_dir, name))
+            if frame is not None:
+                frames.append(frame)
+        if limit and len(frames) >= limit:
+            break
+    return frames
+
+
+def summarize(stage, gallery_size, samples, items_per_sample=1):
+    """Tóm tắt danh sách thời gian (giây) thành p50/p95/p99/mean (ms) và thông lượng"""
+    ms = np.asarray(samples, dtype=np.float64) * 1000
+    total_seconds = float(np.sum(samples))
+    return {
+        'stage': stage,
+        'gallery_size': gallery_size,
+        'samples': len(samples),
+        'p50_ms': round(float(np.percentile(ms, 50)), 4),
+        'p95_ms': round(float(np.percentile(ms, 95)), 4),
+        'p99_ms': round(float(np.percentile(ms, 99)), 4),
+        'mean_ms': round(float(ms.mean()), 4),
+        'throughput_per_s': round(len(samples) * items_per_sample / total_seconds, 2) if total_seconds else None,
+    }
+
+
+def timed(fn, repeats):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+class RecognitionBenchmark:
+    """Chạy các phép đo cho từng kích thước gallery"""
+
+    def __init__(self, sizes, frames, repeats=50, batch=8, storage='float32', threshold=0.6, warmup=3):
+        self.sizes = sizes
+        self.frames = frames
+        self.repeats = repeats
+        self.batch = batch
+        self.storage = storage
+        self.threshold = threshold
+        self.warmup = warmup
+        self.results = []
+
+    def run(self):
+        for size in self.sizes:
+            print(f"\n--- Gallery {size:,} mẫu ({self.storage}) ---")
+            gallery, vectors = make_synthetic_gallery(size, storage=self.storage)
+            recognizer = FaceRecognizer(self.threshold, detector=FaceDetector(), gallery=gallery)
+
+            self._bench_compare(recognizer, vectors, size)
+            if self.frames:
+                self._bench_frames(recognizer, size)
+
+            del recognizer, gallery, vectors
+        return self.results
+
+    def _record(self, row):
+        self.results.append(row)
+        print(f"{row['stage']:<22} p50 {row['p50_ms']:>9.3f} ms  p95 {row['p95_ms']:>9.3f} ms  "
+              f"{row['throughput_per_s']:>10} /s")
+
+    def _bench_compare(self, recognizer, vectors, size):
+        rng = np.random.default_rng(1)
+        picks = rng.choice(vectors.shape[0], max(self.repeats, self.batch), replace=True)
+        queries = vectors[picks] + rng.normal(0, 0.02, (picks.size, 128)).astype(np.float32)
+
+        for q in queries[:self.warmup]:
+            recognizer._compare_face_with_database(q)
+
+        it = iter(range(self.repeats))
+        single = timed(lambda: recognizer._compare_face_with_database(queries[next(it)]), self.repeats)
+        self._record(summarize('compare_single', size, single))
+
+        batch = queries[:self.batch]
+        batched = timed(lambda: recognizer._compare_faces_with_database(batch), self.repeats)
+        self._record(summarize(f'compare_batch_{self.batch}', size, batched, self.batch))
+
+    def _bench_frames(self, recognizer, size):
+        detect_t, encode_t, match_t, total_t = [], [], [], []
+        faces = 0
+
+        for frame in self.frames[:self.warmup]:
+            recognizer.recognize_faces_in_frame(frame)
+
+        for frame in self.frames:
+            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+            start = time.perf_counter()
+            locations = recognizer.detect_faces(rgb)
+            detect_t.append(time.perf_counter() - start)
+
+            if locations:
+                start = time.perf_counter()
+                encodings = face_recognition.face_encodings(rgb, locations)
+                encode_t.append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                recognizer._compare_faces_with_database(encodings)
+                match_t.append(time.perf_counter() - start)
+                faces += len(locations)
+
+            start = time.perf_counter()
+            recognizer.recognize_faces_in_frame(frame)
+            total_t.append(time.perf_counter() - start)
+
+        self._record(summarize('frame_detect', size, detect_t))
+        if encode_t:
+            self._record(summarize('frame_encode', size, encode_t))
+            self._record(summarize('frame_match', size, match_t))
+        self._record(summarize('frame_total', size, total_t))
+        print(f"{len(self.frames)} frame, {faces} khuôn mặt")
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """
+    So sánh p50 với baseline
+
+    Returns:
+        list: Các dòng hồi quy (stage, gallery_size, baseline_ms, current_ms, ratio)
+    """
+    reference = {(row['stage'], row['gallery_size']): row for row in baseline.get('results', [])}
+    regressions = []
+    print(f"\n=== SO SÁNH BASELINE (ngưỡng +{tolerance:.0%}) ===")
+    for row in results:
+        base = reference.get((row['stage'], row['gallery_size']))
+        if not base or not base['p50_ms']:
+            continue
+        ratio = row['p50_ms'] / base['p50_ms']
+        flag = "✗ CHẬM HƠN" if ratio > 1 + tolerance else "✓"
+        print(f"{flag:<11} {row['stage']:<22} {row['gallery_size']:>9,}  "
+              f"{base['p50_ms']:>9.3f} -> {row['p50_ms']:>9.3f} ms (x{ratio:.2f})")
+        if ratio > 1 + tolerance:
+            regressions.append((row['stage'], row['gallery_size'], base['p50_ms'], row['p50_ms'], round(ratio, 2)))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark nhận diện trên gallery tổng hợp và frame ghi sẵn")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="Kích thước gallery")
+    parser.add_argument('--frames', help="Thư mục frame ghi sẵn (.jpg/.png); bỏ trống để chỉ đo so khớp")
+    parser.add_argument('--max-frames', type=int, default=50)
+    parser.add_argument('--repeats', type=int, default=50, help="Số lần đo mỗi phép so khớp")
+    parser.add_argument('--batch', type=int, default=8, help="Số khuôn mặt mỗi lô so khớp")
+    parser.add_argument('--storage', default='float32', choices=['float32', 'float16', 'int8'])
+    parser.add_argument('-o', '--output', default='benchmark_results.json', help="File kết quả JSON")
+    parser.add_argument('--baseline', help="File baseline để so sánh")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Cho phép chậm hơn baseline bao nhiêu (0.2 = 20%%)")
+    parser.add_argument('--save-baseline', help="Lưu kết quả lần chạy này làm baseline")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("RECOGNITION BENCHMARK SUITE")
+    print("=" * 60)
+
+    frames = load_frames(args.frames, args.max_frames)
+    if args.frames and not frames:
+        print(f"⚠️ Không đọc được frame nào trong {args.frames}, chỉ đo so khớp.")
+
+    benchmark = RecognitionBenchmark(args.sizes, frames, args.repeats, args.batch, args.storage)
+    results = benchmark.run()
+
+    report = {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'machine': {
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+        },
+        'config': {
+            'sizes': args.sizes, 'frames': len(frames), 'repeats': args.repeats,
+            'batch': args.batch, 'storage': args.storage,
+        },
+        'results': results,
+    }
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n✓ Đã ghi kết quả vào {args.output}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"✓ Đã lưu baseline vào {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n✗ {len(regressions)} phép đo chậm hơn baseline quá {args.tolerance:.0%}")
+            return 1
+        print("\n✓ Không có hồi quy so với baseline")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
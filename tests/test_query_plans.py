@@ -0,0 +1,117 @@
+# test_query_plans.py
+"""
+Kiểm tra kế hoạch thực thi (EXPLAIN) của các truy vấn điểm danh sau khi chạy migration.
+
+Script chạy trên CSDL thật trong config.DB_CONFIG: áp dụng migration còn thiếu, ghi lại
+câu SQL mà AttendanceRepository sinh ra rồi EXPLAIN từng câu và kiểm tra bảng cần lọc
+được truy cập qua chỉ mục mong đợi (không quét toàn bảng).
+
+Lưu ý: với bảng gần như rỗng, MySQL có thể chọn quét toàn bảng vì rẻ hơn; nên chạy trên
+CSDL có dữ liệu thực tế (vài nghìn bản ghi DiemDanh trở lên).
+
+    python tests/test_query_plans.py
+"""
+
+import os
+import sys
+from datetime import date
+
+# Thêm đường dẫn project root
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+try:
+    from database.attendance_repository import AttendanceRepository
+    from database.connection_manager import ConnectionManager
+    from database.migrations import migrate
+except ImportError as e:
+    print(f"Lỗi import: {e}")
+    sys.exit(1)
+
+
+class QueryRecorder(AttendanceRepository):
+    """Ghi lại câu SQL thay vì thực thi"""
+
+    def __init__(self):
+        super().__init__()
+        self.queries = []
+
+    def fetch_all(self, query, params=None):
+        self.queries.append((query, params))
+        return []
+
+    def fetch_one(self, query, params=None):
+        self.queries.append((query, params))
+        return None
+
+
+def capture(call):
+    recorder = QueryRecorder()
+    call(recorder)
+    return recorder.queries[-1]
+
+
+def explain(query, params):
+    with ConnectionManager().connection(transaction=False) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("EXPLAIN " + query, params or ())
+            return cursor.fetchall()
+
+
+def check_plan(name, query, params, table_alias, expected_keys):
+    """Kiểm tra dòng EXPLAIN của bảng table_alias dùng một trong các chỉ mục expected_keys"""
+    rows = explain(query, params)
+    print(f"\n{name}")
+    for row in rows:
+        print(f"   {row.get('table')}: type={row.get('type')}, key={row.get('key')}, rows={row.get('rows')}")
+
+    row = next((r for r in rows if r.get('table') == table_alias), None)
+    if row is None:
+        # Ví dụ "no matching row in const table": MySQL không cần đọc bảng
+        print(f"   ⚠️ Không có dòng cho bảng {table_alias} (bảng rỗng?)")
+        return True
+    ok = row.get('type') != 'ALL' and row.get('key') in expected_keys
+    print(f"   {'✅' if ok else '❌'} {table_alias} dùng {row.get('key')} (mong đợi {' / '.join(expected_keys)})")
+    return ok
+
+
+def main():
+    print("=" * 50)
+    print("KIỂM TRA EXPLAIN CÁC TRUY VẤN ĐIỂM DANH")
+    print("=" * 50)
+
+    applied = migrate()
+    print(f"Migration vừa áp dụng: {applied or 'không có'}")
+
+    today = date.today()
+    by_time = ['idx_DiemDanh_ThoiGian']
+    cases = [
+        ("get_attendance_today", capture(lambda r: r.get_attendance_today()), 'DiemDanh', by_time),
+        ("count_attendance_today", capture(lambda r: r.count_attendance_today()), 'DiemDanh', by_time),
+        ("get_attendance_records(Ngay)", capture(lambda r: r.get_attendance_records(Ngay=today)), 'dd', by_time),
+        ("get_attendance_records(MaSV, Ngay)",
+         capture(lambda r: r.get_attendance_records(MaSV='SV001', Ngay=today)), 'dd',
+         ['idx_DiemDanh_SV_ThoiGian']),
+        ("get_daily_attendance_summary(Ngay)",
+         capture(lambda r: r.get_daily_attendance_summary(Ngay=today)), 'dd', by_time),
+        ("check_student_attended_today",
+         capture(lambda r: r.check_student_attended_today('SV001', 'BH001')), 'DiemDanh',
+         ['uq_DiemDanh_BuoiHoc_SV']),
+        ("BuoiHoc theo ngày + giảng viên",
+         ("SELECT MaBuoiHoc FROM BuoiHoc WHERE NgayHoc = %s AND MaGV_FK = %s", (today, 'GV001')), 'BuoiHoc',
+         ['idx_BuoiHoc_Ngay_GV']),
+    ]
+
+    failed = [name for name, (query, params), table, keys in cases
+              if not check_plan(name, query, params, table, keys)]
+
+    print("\n" + "=" * 50)
+    if failed:
+        print(f"❌ {len(failed)}/{len(cases)} truy vấn không dùng chỉ mục mong đợi: {', '.join(failed)}")
+        sys.exit(1)
+    print(f"✅ {len(cases)}/{len(cases)} truy vấn dùng đúng chỉ mục")
+
+
+if __name__ == "__main__":
+    main()
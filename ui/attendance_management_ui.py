@@ -17,6 +17,7 @@ class AttendanceManagementUI(QWidget):
         self.setWindowTitle("Quản lý thông tin điểm danh")
         self.setGeometry(100, 100, 1200, 700)
         self.attendance = AttendanceRepository()
+        self.page_cursor = None  # (ThoiGian, ID_DiemDanh) của dòng cuối đã tải ở chế độ "Xem tất cả"
         self.init_ui()
         self.setup_styles()
         self.setup_connections()
@@ -283,10 +284,16 @@ class AttendanceManagementUI(QWidget):
         self.table.setSelectionMode(QAbstractItemView.SingleSelection)
         self.table.verticalHeader().setVisible(False)
 
+        # Chỉ tải từng trang, bấm "Tải thêm" để nạp trang tiếp theo
+        self.btn_load_more = QPushButton("Tải thêm")
+        self.btn_load_more.setFixedHeight(35)
+        self.btn_load_more.setEnabled(False)
+
         # Load dữ liệu
         self.load_all_attendance()
 
         table_layout.addWidget(self.table)
+        table_layout.addWidget(self.btn_load_more)
         table_group.setLayout(table_layout)
         right_panel.addWidget(table_group)
 
@@ -303,6 +310,7 @@ class AttendanceManagementUI(QWidget):
         self.btn_search.clicked.connect(self.search_attendance)
         self.btn_today.clicked.connect(self.show_today_attendance)
         self.btn_view_all.clicked.connect(self.load_all_attendance)
+        self.btn_load_more.clicked.connect(self.load_more_attendance)
         self.table.cellClicked.connect(self.on_table_cell_clicked)
 
     def search_attendance(self):
@@ -334,20 +342,47 @@ class AttendanceManagementUI(QWidget):
             QMessageBox.critical(self, "Lỗi", f"Lỗi tìm kiếm: {str(e)}")
 
     def load_all_attendance(self):
-        """Load tất cả dữ liệu điểm danh"""
+        """Load trang đầu của toàn bộ dữ liệu điểm danh (mới nhất trước)"""
         try:
-            records = self.attendance.get_all_attendance()
+            records = self.attendance.get_attendance_page()
             self.populate_table(records)
+            self.set_page_cursor(records)
+        except Exception as e:
+            QMessageBox.critical(self, "Lỗi", f"Không thể tải dữ liệu: {str(e)}")
+
+    def load_more_attendance(self):
+        """Nối trang tiếp theo vào cuối bảng"""
+        if self.page_cursor is None:
+            return
+        try:
+            records = self.attendance.get_attendance_page(after=self.page_cursor)
+            self.append_rows(records)
+            self.set_page_cursor(records)
         except Exception as e:
             QMessageBox.critical(self, "Lỗi", f"Không thể tải dữ liệu: {str(e)}")
 
+    def set_page_cursor(self, records):
+        """Ghi nhớ vị trí trang; trang không đầy nghĩa là đã hết dữ liệu"""
+        full_page = records is not None and len(records) >= self.attendance.PAGE_SIZE
+        self.page_cursor = self.attendance.page_cursor(records) if full_page else None
+        self.btn_load_more.setEnabled(self.page_cursor is not None)
+
     def populate_table(self, records):
         """Điền dữ liệu vào bảng"""
+        # Kết quả tìm kiếm/lọc thay thế bảng nên không còn trang tiếp theo
+        self.page_cursor = None
+        self.btn_load_more.setEnabled(False)
+        self.table.setRowCount(0)
+        self.table.setColumnHidden(5, True)  # Ẩn cột hình ảnh
         if records is None:
-            self.table.setRowCount(0)
             return
-        self.table.setRowCount(len(records))
-        for i, record in enumerate(records):
+        self.append_rows(records)
+
+    def append_rows(self, records):
+        """Thêm các dòng vào cuối bảng"""
+        start = self.table.rowCount()
+        self.table.setRowCount(start + len(records))
+        for i, record in enumerate(records, start):
             self.table.setItem(i, 0, QTableWidgetItem(str(record["ID_DiemDanh"])))
             self.table.setItem(i, 1, QTableWidgetItem(str(record["MaBuoiHoc_FK"])))
             self.table.setItem(i, 2, QTableWidgetItem(str(record["MaSV_FK"])))
@@ -362,8 +397,6 @@ class AttendanceManagementUI(QWidget):
             self.table.setItem(i, 4, QTableWidgetItem(str(record["TrangThai"])))
             self.table.setItem(i, 5, QTableWidgetItem(str(record["HinhAnh"])))
 
-            # Ân cột hình ảnh
-            self.table.setColumnHidden(5, True)
     def on_table_cell_clicked(self, row, column):
         """Xử lý khi click vào cell trong bảng"""
         if row < self.table.rowCount():
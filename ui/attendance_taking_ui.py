@@ -6,11 +6,83 @@ import cv2
 import sys
 import datetime
 import os
+import threading
+import time
 from PIL import Image, ImageQt
 
 from face_recognition_module.face_recognizer import FaceRecognizer
+from face_recognition_module.face_tracker import FaceTracker
+from face_recognition_module.camera_manager import CameraManager, decode_face_image
+from config import CAMERA_SOURCES, PIPELINE_METRICS
 from database.attendance_repository import AttendanceRepository
+from database.attendance_queue import AttendanceWriteBehind
 from database.session_repository import SessionRepository
+from database.class_subject_repository import ClassSubjectRepository
+
+
+class RecognitionWorker(QtCore.QThread):
+    """
+    Luồng nhận diện chạy tách khỏi luồng giao diện.
+
+    Luồng GUI chỉ đẩy frame mới nhất vào worker; nếu worker còn bận thì frame cũ
+    chưa xử lý bị thay thế (drop) thay vì xếp hàng, nên preview luôn chạy theo FPS
+    camera còn nhận diện chạy ở tốc độ CPU cho phép.
+    """
+    results_ready = QtCore.pyqtSignal(object, object)  # (frame, recognized_faces)
+
+    def __init__(self, face_recognizer, face_tracker=None, parent=None):
+        super().__init__(parent)
+        self.face_recognizer = face_recognizer
+        self.face_tracker = face_tracker
+        self._condition = threading.Condition()
+        self._pending_frame = None
+        # Đặt trước start() và chỉ xóa trong stop(): stop() gọi trước khi luồng kịp chạy
+        # không bị run() ghi đè thành True rồi chờ mãi
+        self._running = True
+        self.frames_in = 0
+        self.frames_processed = 0
+        self.frames_dropped = 0
+
+    def submit_frame(self, frame):
+        """Gửi frame mới nhất cho worker (không chặn luồng GUI)"""
+        with self._condition:
+            if self._pending_frame is not None:
+                self.frames_dropped += 1
+                self.face_recognizer.metrics.count('frames_dropped')
+            self._pending_frame = frame
+            self.frames_in += 1
+            self._condition.notify()
+
+    def run(self):
+        while True:
+            with self._condition:
+                while self._running and self._pending_frame is None:
+                    self._condition.wait()
+                if not self._running:
+                    break
+                frame = self._pending_frame
+                self._pending_frame = None
+
+            try:
+                if self.face_tracker:
+                    recognized_faces = self.face_tracker.process(frame)
+                else:
+                    recognized_faces = self.face_recognizer.recognize_faces_in_frame(frame)
+            except Exception as e:
+                print(f"Lỗi RecognitionWorker: {str(e)}")
+                recognized_faces = []
+
+            self.frames_processed += 1
+            self.face_recognizer.metrics.count('frames_recognized')
+            self.results_ready.emit(frame, recognized_faces)
+
+    def stop(self):
+        """Dừng luồng và chờ kết thúc"""
+        with self._condition:
+            self._running = False
+            self._pending_frame = None
+            self._condition.notify()
+        self.wait()
 
 
 class AttendanceUI(QtWidgets.QWidget):
@@ -19,12 +91,32 @@ class AttendanceUI(QtWidgets.QWidget):
         self.setWindowTitle("🎓 Hệ thống điểm danh khuôn mặt")
         self.setGeometry(100, 100, 1200, 700)
         self.face_recognizer = FaceRecognizer()
+        # Chỉ phát hiện đầy đủ mỗi vài frame; danh tính được bỏ phiếu qua 5 lần so khớp
+        # (cần 3 phiếu) rồi mang theo track, tránh nhấp nháy giữa các sinh viên
+        self.face_tracker = FaceTracker(self.face_recognizer, detect_every=5, vote_window=5, min_votes=3)
         self.attendance = AttendanceRepository()
+        # Điểm danh ghi vào journal cục bộ, luồng nền đẩy lên MySQL (giao diện không chờ mạng)
+        self.attendance_queue = AttendanceWriteBehind(self.attendance)
+        self.attendance_queue.start()
         self.session = SessionRepository()
+        self.session_info = None  # Thông tin buổi học đang chọn (tránh truy vấn lại khi điểm danh)
+        self.class_subject = ClassSubjectRepository()
+        self.allow_walk_ins = False  # True: vẫn tìm toàn trường cho sinh viên ngoài danh sách lớp
         self.camera_running = False
         self.cap = None
         self.timer = None
+        self.recognition_worker = None
+        self.camera_manager = None  # Các camera phụ (CAMERA_SOURCES[1:]), mỗi camera một tiến trình
+        self.camera_poll_timer = None
+        self.last_recognized_faces = []  # Kết quả nhận diện gần nhất, vẽ lên mọi frame preview
         self.current_student = None  # Lưu thông tin sinh viên hiện tại
+        self.displayed_student_id = None  # Sinh viên đang hiển thị, chỉ cập nhật khi danh tính ổn định đổi
+
+        # Đo thời gian từng giai đoạn (dùng chung với FaceRecognizer); F3 bật/tắt overlay
+        self.metrics = self.face_recognizer.metrics
+        self.show_metrics_overlay = False
+        self._overlay_lines = []
+        self._overlay_updated = 0.0
 
         # Thiết lập style cho toàn bộ ứng dụng
         self.setStyleSheet("""
@@ -112,6 +204,7 @@ class AttendanceUI(QtWidgets.QWidget):
         """)
 
         self.setup_ui()
+        QtWidgets.QShortcut(QtGui.QKeySequence("F3"), self, activated=self.toggle_metrics_overlay)
         self.load_sessions()
         self.session_combo.currentIndexChanged.connect(self.load_session_time)
 
@@ -321,9 +414,12 @@ class AttendanceUI(QtWidgets.QWidget):
                 self.session_time_label.setText("⏰ Thời gian buổi học: --")
                 self.subject_label.setText("📚 Môn học: --")
                 self.class_label.setText("🏫 Phòng học: --")
+                self.face_recognizer.clear_session_roster()
+                self.session_info = None
                 return
 
             session_info = self.session.get_session_by_id(ma_buoi_hoc)
+            self.session_info = session_info
             if session_info:
                 bat_dau = session_info.get("GioBatDau", "??:??:??")
                 ket_thuc = session_info.get("GioKetThuc", "??:??:??")
@@ -332,17 +428,41 @@ class AttendanceUI(QtWidgets.QWidget):
                 self.session_time_label.setText(f"⏰ Thời gian buổi học: {bat_dau} - {ket_thuc}")
                 self.subject_label.setText(f"📚 Môn học: {ten_mon}")
                 self.class_label.setText(f"🏫 Phòng học:  {phong_hoc}")
+                self.load_session_roster(session_info)
             else:
                 self.session_time_label.setText("⏰ Thời gian buổi học: Không tìm thấy")
                 self.subject_label.setText("📚 Môn học: Không rõ")
         except Exception as e:
             self.session_time_label.setText("⏰ Thời gian buổi học: Lỗi tải dữ liệu")
 
+    def load_session_roster(self, session_info):
+        """Giới hạn nhận diện trong danh sách sinh viên của lớp-môn thuộc buổi học"""
+        try:
+            ma_lop = session_info.get("MaLop")
+            ma_mon = session_info.get("MaMon")
+            if not ma_lop or not ma_mon:
+                self.face_recognizer.clear_session_roster()
+                return
+
+            students = self.class_subject.get_students_in_class_subject(ma_lop, ma_mon) or []
+            student_ids = [s["MaSV"] if isinstance(s, dict) else s[0] for s in students]
+            self.face_recognizer.set_session_roster(student_ids, fallback_to_global=self.allow_walk_ins)
+            # Danh tính trên các track cũ có thể không còn hợp lệ với danh sách lớp mới
+            self.face_tracker.reset()
+            self.displayed_student_id = None
+        except Exception as e:
+            print(f"Lỗi load_session_roster: {str(e)}")
+            self.face_recognizer.clear_session_roster()
+        finally:
+            # Tiến trình camera phụ giữ danh sách lớp của buổi cũ: khởi động lại theo buổi mới
+            if self.camera_manager:
+                self.camera_manager.restart()
+
     def start_camera(self):
         """Khởi động camera"""
         try:
             if not self.camera_running:
-                self.cap = cv2.VideoCapture(0)
+                self.cap = cv2.VideoCapture(CAMERA_SOURCES[0])
                 if not self.cap.isOpened():
                     QtWidgets.QMessageBox.critical(self, "❌ Lỗi Camera",
                                                    "Không thể mở camera!\nVui lóng kiểm tra:\n"
@@ -355,10 +475,18 @@ class AttendanceUI(QtWidgets.QWidget):
                 self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
 
                 self.camera_running = True
+                self.last_recognized_faces = []
+                self.face_tracker.reset()
+                self.recognition_worker = RecognitionWorker(self.face_recognizer, self.face_tracker, self)
+                self.recognition_worker.results_ready.connect(self.on_recognition_results)
+                self.recognition_worker.start()
+
                 self.timer = QtCore.QTimer()
                 self.timer.timeout.connect(self.update_frame)
                 self.timer.start(30)  # 30ms = ~33 FPS
 
+                self.start_extra_cameras()
+
                 self.camera_label.setText("📷 Camera đang hoạt động...")
                 self.open_btn.setEnabled(False)
                 self.close_btn.setEnabled(True)
@@ -366,53 +494,140 @@ class AttendanceUI(QtWidgets.QWidget):
         except Exception as e:
             QtWidgets.QMessageBox.critical(self, "❌ Lỗi", f"Không thể khởi động camera: {str(e)}")
 
+    def start_extra_cameras(self):
+        """Khởi động nhận diện trên các camera phụ (nếu cấu hình nhiều nguồn)"""
+        if len(CAMERA_SOURCES) < 2:
+            return
+        try:
+            self.camera_manager = CameraManager(CAMERA_SOURCES[1:], self.face_recognizer)
+            self.camera_manager.start()
+
+            self.camera_poll_timer = QtCore.QTimer()
+            self.camera_poll_timer.timeout.connect(self.poll_extra_cameras)
+            self.camera_poll_timer.start(200)
+        except Exception as e:
+            print(f"Lỗi start_extra_cameras: {str(e)}")
+            self.stop_extra_cameras()
+
+    def poll_extra_cameras(self):
+        """Nhận các sinh viên mới được camera phụ nhận diện (đã gộp theo buổi học)"""
+        if not self.camera_manager:
+            return
+        for student in self.camera_manager.poll():
+            print(f"Camera phụ nhận diện: {student['student_id']} - {student['student_name']} "
+                  f"({student['best_confidence']}%)")
+            self.display_student_info(student['student_id'], student['student_name'],
+                                      decode_face_image(student['face_jpg']), student['best_confidence'])
+
+    def stop_extra_cameras(self):
+        if self.camera_poll_timer:
+            self.camera_poll_timer.stop()
+            self.camera_poll_timer = None
+        if self.camera_manager:
+            self.camera_manager.stop()
+            self.camera_manager = None
+
     def update_frame(self):
-        """Cập nhật frame từ camera"""
+        """Cập nhật frame từ camera (chỉ đọc, gửi cho worker và hiển thị; không nhận diện ở đây)"""
         try:
             if not self.cap or not self.camera_running:
                 return
 
-            ret, frame = self.cap.read()
+            with self.metrics.stage('capture'):
+                ret, frame = self.cap.read()
             if not ret:
                 return
+            self.metrics.count('frames_in')
 
             # Lật frame theo chiều ngang (mirror effect)
             frame = cv2.flip(frame, 1)
 
-            # Nhận diện khuôn mặt
-            recognized_faces = self.face_recognizer.recognize_faces_in_frame(frame)
-
-            # Vẽ khung cho các khuôn mặt được nhận diện
-            for student_id, student_name, face_location, confidence, face_img in recognized_faces:
-                top, right, bottom, left = face_location
-
-                if student_id and confidence > 75:  # Độ tin cậy cao
-                    print(f"Đã nhận diện: {student_id} - {student_name} ({confidence}%)")
-
-                    # Vẽ khung xanh cho khuôn mặt được nhận diện
-                    cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
-                    cv2.putText(frame, f"{student_name} ({confidence}%)",
-                                (left, top - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+            # Nhận diện chạy ở luồng riêng; worker chỉ giữ frame mới nhất
+            if self.recognition_worker:
+                self.recognition_worker.submit_frame(frame)
 
-                    # Chỉ hiển thị thông tin mà không tắt camera
-                    self.display_student_info(student_id, student_name, face_img, confidence)
-
-                elif student_id:  # Nhận diện được nhưng độ tin cậy thấp
-                    cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 255), 2)
-                    cv2.putText(frame, f"{student_name} ({confidence}%)",
-                                (left, top - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 2)
-                else:
-                    # Vẽ khung đỏ cho khuôn mặt chưa nhận diện được
-                    cv2.rectangle(frame, (left, top), (right, bottom), (0, 0, 255), 2)
-                    cv2.putText(frame, "Unknown",
-                                (left, top - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
+            # Vẽ kết quả nhận diện gần nhất lên bản sao (frame gốc đang được worker dùng)
+            with self.metrics.stage('draw'):
+                display = frame.copy()
+                self.draw_recognition_results(display, self.last_recognized_faces)
+            if self.show_metrics_overlay:
+                self.draw_metrics_overlay(display)
 
             # Hiển thị frame lên giao diện
-            self.display_frame(frame)
+            with self.metrics.stage('display'):
+                self.display_frame(display)
+            self.metrics.count('frames_out')
 
         except Exception as e:
             print(f"Lỗi update_frame: {str(e)}")
 
+    def on_recognition_results(self, frame, recognized_faces):
+        """Nhận kết quả từ RecognitionWorker (chạy trên luồng GUI)"""
+        if not self.camera_running:
+            return
+
+        self.last_recognized_faces = recognized_faces
+
+        # FaceTracker chỉ báo danh tính sau khi bỏ phiếu; giữ nguyên sinh viên đang hiển thị
+        # khi người đó vẫn còn trong khung để không nhảy qua lại giữa nhiều sinh viên
+        confident = [face for face in recognized_faces if face[0] and face[3] > 75]  # Độ tin cậy cao
+        if any(face[0] == self.displayed_student_id for face in confident):
+            return
+
+        for student_id, student_name, face_location, confidence, face_img in confident:
+            # Có camera phụ: gộp chung theo buổi học, sinh viên đã được camera nào đó báo thì bỏ qua
+            if self.camera_manager and not self.camera_manager.add_primary_detection(
+                    student_id, student_name, confidence):
+                continue
+            print(f"Đã nhận diện: {student_id} - {student_name} ({confidence}%)")
+            # Chỉ hiển thị thông tin mà không tắt camera
+            self.display_student_info(student_id, student_name, face_img, confidence)
+            self.displayed_student_id = student_id
+            break
+
+    def draw_recognition_results(self, frame, recognized_faces):
+        """Vẽ khung cho các khuôn mặt được nhận diện"""
+        for student_id, student_name, face_location, confidence, face_img in recognized_faces:
+            top, right, bottom, left = face_location
+
+            if student_id and confidence > 75:  # Độ tin cậy cao
+                # Vẽ khung xanh cho khuôn mặt được nhận diện
+                cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
+                cv2.putText(frame, f"{student_name} ({confidence}%)",
+                            (left, top - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+
+            elif student_id:  # Nhận diện được nhưng độ tin cậy thấp
+                cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 255), 2)
+                cv2.putText(frame, f"{student_name} ({confidence}%)",
+                            (left, top - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 2)
+            else:
+                # Vẽ khung đỏ cho khuôn mặt chưa nhận diện được
+                cv2.rectangle(frame, (left, top), (right, bottom), (0, 0, 255), 2)
+                cv2.putText(frame, "Unknown",
+                            (left, top - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
+
+    def toggle_metrics_overlay(self):
+        """Bật/tắt overlay thời gian từng giai đoạn (bật đo khi overlay bật)"""
+        self.show_metrics_overlay = not self.show_metrics_overlay
+        if self.show_metrics_overlay and not self.metrics.enabled:
+            self.metrics.reset()
+        self.metrics.enabled = self.show_metrics_overlay or PIPELINE_METRICS['enabled']
+        self._overlay_lines = []
+        self._overlay_updated = 0.0
+
+    def draw_metrics_overlay(self, frame):
+        """Vẽ p50/p95/p99 từng giai đoạn lên góc frame (tính lại mỗi giây)"""
+        now = time.monotonic()
+        if now - self._overlay_updated >= 1.0:
+            self._overlay_lines = self.metrics.format_lines(
+                ['capture', 'recognize', 'cvtColor', 'detect', 'encode', 'match', 'draw', 'display'])
+            self._overlay_updated = now
+
+        for i, line in enumerate(self._overlay_lines):
+            y = 18 + i * 16
+            cv2.putText(frame, line, (8, y), cv2.FONT_HERSHEY_PLAIN, 0.9, (0, 0, 0), 3)
+            cv2.putText(frame, line, (8, y), cv2.FONT_HERSHEY_PLAIN, 0.9, (255, 255, 255), 1)
+
     def display_frame(self, frame):
         """Hiển thị frame lên label"""
         try:
@@ -496,7 +711,6 @@ class AttendanceUI(QtWidgets.QWidget):
     def process_attendance(self, student_id, student_name, face_img):
         """Xử lý điểm danh và lưu ảnh khuôn mặt"""
         try:
-            student_info = self.face_recognizer.get_student_info(student_id)
             now = datetime.datetime.now()
             session_id = self.session_combo.currentData()
 
@@ -504,8 +718,16 @@ class AttendanceUI(QtWidgets.QWidget):
                 QtWidgets.QMessageBox.warning(self, "⚠️ Thông báo", "Vui lòng chọn buổi học trước khi điểm danh!")
                 return
 
-            # Lấy giờ bắt đầu của buổi học
-            session_info = self.session.get_session_by_id(session_id)
+            if self.attendance_queue.is_recorded(session_id, student_id):
+                QtWidgets.QMessageBox.information(self, "ℹ️ Thông báo",
+                                                  f"Sinh viên {student_name} đã điểm danh trong buổi học này!")
+                return
+
+            # Lấy giờ bắt đầu của buổi học (đã tải khi chọn buổi học)
+            session_info = self.session_info
+            if not session_info or session_info.get("MaBuoiHoc") != session_id:
+                session_info = self.session.get_session_by_id(session_id)
+                self.session_info = session_info
             gio_bat_dau_timedelta = session_info.get("GioBatDau")
             ngay_hoc = session_info.get("NgayHoc")  # dạng "YYYY-MM-DD"
 
@@ -533,20 +755,24 @@ class AttendanceUI(QtWidgets.QWidget):
             image_path = os.path.join(image_dir, f"{student_id}_{now.strftime('%H%M%S')}.jpg")
             cv2.imwrite(image_path, face_img)
 
-            # Lưu vào DB
-            self.attendance.add_attendance_record(
+            # Ghi vào journal; luồng nền ghi DiemDanh lên MySQL
+            queued = self.attendance_queue.enqueue(
                 MaBuoiHoc_FK=session_id,
                 MaSV_FK=student_id,
                 ThoiGian=now.strftime("%Y-%m-%d %H:%M:%S"),
                 TrangThai=status,
                 HinhAnh=image_path
             )
+            if not queued:
+                QtWidgets.QMessageBox.information(self, "ℹ️ Thông báo",
+                                                  f"Sinh viên {student_name} đã điểm danh trong buổi học này!")
+                return
 
             # Thông báo
             msg = QtWidgets.QMessageBox()
             msg.setIcon(QtWidgets.QMessageBox.Information)
             msg.setWindowTitle("✅ Điểm danh thành công")
-            msg.setText(f"Sinh viên {student_info.get('TenSV', student_name)} đã điểm danh!")
+            msg.setText(f"Sinh viên {student_name} đã điểm danh!")
             msg.setDetailedText(f"Thời gian: {now.strftime('%H:%M:%S %d/%m/%Y')}\nTrạng thái: {status}")
             msg.exec_()
 
@@ -560,6 +786,12 @@ class AttendanceUI(QtWidgets.QWidget):
                 self.timer.stop()
                 self.timer = None
 
+            if self.recognition_worker:
+                self.recognition_worker.stop()
+                self.recognition_worker = None
+            self.last_recognized_faces = []
+            self.stop_extra_cameras()
+
             if self.cap:
                 self.cap.release()
                 self.cap = None
@@ -572,12 +804,14 @@ class AttendanceUI(QtWidgets.QWidget):
             self.close_btn.setEnabled(False)
             self.attendance_btn.setEnabled(False)  # Disable nút điểm danh
             self.current_student = None  # Reset thông tin sinh viên
+            self.displayed_student_id = None
         except Exception as e:
             print(f"Lỗi stop_camera: {str(e)}")
 
     def closeEvent(self, event):
         """Xử lý khi đóng ứng dụng"""
         self.stop_camera()
+        self.attendance_queue.stop()
         event.accept()
 
 
@@ -26,6 +26,9 @@ class FaceCaptureDialog(QDialog):
         self.student_id = student_id
         self.face_embedder = FaceEmbedder()
         self.face_embeddings = []
+        # Ứng viên (điểm chất lượng, embedding, frame); chỉ các mẫu tốt nhất được lưu
+        self.candidates = []
+        self.last_candidate_time = 0
         self.cap = None
         self.timer = None
         self.setupUI()
@@ -152,27 +155,18 @@ class FaceCaptureDialog(QDialog):
 
             frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
 
-            # Detect và encode embedding
-            embeddings = self.face_embedder.detect_and_encode_faces(frame_rgb)
-            if embeddings:
-                embedding = embeddings[0]  # lấy khuôn mặt đầu tiên
-                # Lưu ảnh vào thư mục với tên rõ ràng
-                timestamp = int(time.time())
-                img_filename = f"{self.student_id}_{self.sample_count + 1}_{timestamp}.jpg"
-                img_path = os.path.join(self.save_dir, img_filename)
-                cv2.imwrite(img_path, frame)
-
-                # Lưu embedding vào CSDL
-                embedding_blob = embedding.astype(np.float32).tobytes()
-                with self.face_embedder.processing_lock:
-                    if self.student_repo.add_face_embedding(self.student_id, img_path, embedding_blob):
-                        self.face_embeddings.append(embedding)
-                        self.sample_count += 1
-                        self.status_label.setText(f"Đã chụp {self.sample_count}/{self.max_samples} mẫu")
-                    else:
-                        print(f"Lỗi khi lưu embedding mẫu {self.sample_count + 1}")
-
-                if self.sample_count >= self.max_samples:
+            # Detect, chấm điểm chất lượng và chỉ encode khuôn mặt tốt nhất
+            num_candidates = self.max_samples * self.face_embedder.enroll_candidates
+            best_face = self.face_embedder.detect_and_encode_best_face(frame_rgb)
+            now = time.time()
+            if best_face is not None and now - self.last_candidate_time >= 0.3:
+                embedding, quality, _ = best_face
+                self.candidates.append((quality.score, embedding.astype(np.float32), frame.copy()))
+                self.last_candidate_time = now
+                self.status_label.setText(
+                    f"Đã thu {len(self.candidates)}/{num_candidates} ảnh (chất lượng {quality.score:.2f})")
+
+                if len(self.candidates) >= num_candidates:
                     self.stopCapture()
 
             # Hiển thị video
@@ -192,13 +186,35 @@ class FaceCaptureDialog(QDialog):
         if self.timer:
             self.killTimer(self.timer)
             self.timer = None
+        self.persistBestSamples()
         self.start_btn.setEnabled(True)
         self.stop_btn.setEnabled(False)
-        self.status_label.setText(f"Đã chụp {len(self.face_embeddings)}/3 mẫu khuôn mặt")
+        self.status_label.setText(f"Đã chụp {len(self.face_embeddings)}/{self.max_samples} mẫu khuôn mặt")
+
+    def persistBestSamples(self):
+        """Lưu ảnh và embedding của các ứng viên có điểm chất lượng cao nhất vào CSDL"""
+        needed = self.max_samples - self.sample_count
+        best = self.face_embedder.select_best_samples(self.candidates, needed) if needed > 0 else []
+        self.candidates = []
+
+        for score, embedding, frame in best:
+            # Lưu ảnh vào thư mục với tên rõ ràng
+            timestamp = int(time.time())
+            img_filename = f"{self.student_id}_{self.sample_count + 1}_{timestamp}.jpg"
+            img_path = os.path.join(self.save_dir, img_filename)
+            cv2.imwrite(img_path, frame)
+
+            # Lưu embedding vào CSDL
+            with self.face_embedder.processing_lock:
+                if self.student_repo.add_face_embedding(self.student_id, img_path, embedding.tobytes()):
+                    self.face_embeddings.append(embedding)
+                    self.sample_count += 1
+                else:
+                    print(f"Lỗi khi lưu embedding mẫu {self.sample_count + 1}")
 
     def saveFaces(self):
-        if len(self.face_embeddings) < 3:
-            QMessageBox.warning(self, "Cảnh báo", "Cần ít nhất 3 mẫu khuôn mặt!")
+        if len(self.face_embeddings) < self.max_samples:
+            QMessageBox.warning(self, "Cảnh báo", f"Cần ít nhất {self.max_samples} mẫu khuôn mặt!")
             return
         self.facesCaptured.emit(self.face_embeddings)
         self.accept()